@@ -0,0 +1,412 @@
+'''
+Native pcap / pcapng reader. Returns numpy column arrays with the same field names pcap_to_csv.py asks tshark
+for, without the tshark -> quoted csv -> pandas round trip.
+
+The capture is memory-mapped. Only the record headers are walked one by one (their offsets are not known in
+advance); Ethernet/IPv4/TCP/UDP headers are then decoded for all packets at once with numpy fancy indexing.
+
+Usage:
+    columns = read_pcap(path + 'capture.pcap')         # tcp, or udp if 'udp' is in the file name
+    df = pd.DataFrame(columns)
+
+Differences with the tshark csv:
+- only frames of the requested protocol are returned (tshark writes an empty row for every other frame).
+- ip.src / ip.dst are uint32 (see ipv4_to_str), ports uint16, seq/ack/len uint32, times float64 seconds.
+- tcp.seq / tcp.ack / tcp.nxtseq are relative to the first segment of each direction, like tshark's default.
+- tcp.window_size is scaled only when both SYNs with the window scale option are in the capture.
+- tcp.analysis.* fields need tshark's stateful tcp analysis and are not produced.
+- tcp.stream / udp.stream number conversations by first appearance; port reuse is not split into new streams.
+'''
+
+import mmap
+import struct
+import numpy as np
+from array import array
+
+PCAP_MAGIC_US = 0xa1b2c3d4
+PCAP_MAGIC_NS = 0xa1b23c4d
+PCAPNG_SHB = 0x0a0d0d0a
+PCAPNG_BYTE_ORDER_MAGIC = 0x1a2b3c4d
+PCAPNG_IDB = 1
+PCAPNG_PB = 2
+PCAPNG_EPB = 6
+
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_IPV4 = 228
+
+ETHERTYPE_IPV4 = 0x0800
+ETHERTYPE_VLAN = (0x8100, 0x88a8)
+
+IP_PROTO_TCP = 6
+IP_PROTO_UDP = 17
+
+TCP_FLAG_FIN = 0x01
+TCP_FLAG_SYN = 0x02
+TCP_FLAG_ACK = 0x10
+TCP_OPTION_WINDOW_SCALE = 3
+
+
+'''
+record walking
+'''
+
+
+# classic pcap: returns (data offset, caplen, timestamp ns, linktype) per record
+def _walk_pcap(buf):
+    magic = struct.unpack_from('<I', buf, 0)[0]
+    endian = '<' if magic in (PCAP_MAGIC_US, PCAP_MAGIC_NS) else '>'
+    magic = struct.unpack_from(endian + 'I', buf, 0)[0]
+    frac_to_ns = 1 if magic == PCAP_MAGIC_NS else 1000
+    linktype = struct.unpack_from(endian + 'I', buf, 20)[0] & 0x0fffffff
+
+    record = struct.Struct(endian + 'IIII')
+    offsets, caplens, seconds, fractions = array('q'), array('q'), array('q'), array('q')
+    pos, size = 24, len(buf)
+    while pos + 16 <= size:
+        sec, frac, caplen, _ = record.unpack_from(buf, pos)
+        pos += 16
+        if pos + caplen > size:
+            break  # truncated last record, capture was still being written
+        offsets.append(pos)
+        caplens.append(caplen)
+        seconds.append(sec)
+        fractions.append(frac)
+        pos += caplen
+
+    ts = np.frombuffer(seconds, dtype=np.int64) * 1000000000 + np.frombuffer(fractions, dtype=np.int64) * frac_to_ns
+    return (np.frombuffer(offsets, dtype=np.int64), np.frombuffer(caplens, dtype=np.int64), ts,
+            np.full(len(offsets), linktype, dtype=np.int64))
+
+
+# if_tsresol and if_tsoffset options of an interface description block
+def _idb_time_options(buf, pos, end, endian):
+    resolution, offset = (False, 6), 0
+    while pos + 4 <= end:
+        code, length = struct.unpack_from(endian + 'HH', buf, pos)
+        if code == 0:
+            break
+        if code == 9 and length >= 1:
+            value = buf[pos + 4]
+            resolution = (bool(value & 0x80), value & 0x7f)
+        elif code == 14 and length >= 8:
+            offset = struct.unpack_from(endian + 'q', buf, pos + 4)[0]
+        pos += 4 + (length + 3) // 4 * 4
+    return resolution, offset
+
+
+# raw pcapng timestamp units to ns, vectorized per interface
+def _pcapng_ts_to_ns(raw, resolution, offset):
+    binary, exponent = resolution
+    if binary:
+        seconds = raw >> np.uint64(exponent)
+        fraction = raw & np.uint64((1 << exponent) - 1)
+        ns = seconds.astype(np.int64) * 1000000000 + (fraction.astype(np.float64) * 1e9 / 2 ** exponent).astype(np.int64)
+    elif exponent <= 9:
+        ns = raw.astype(np.int64) * 10 ** (9 - exponent)
+    else:
+        ns = (raw // np.uint64(10 ** (exponent - 9))).astype(np.int64)
+    return ns + offset * 1000000000
+
+
+# pcapng: enhanced and (obsolete) packet blocks. Every section header resets the interface list.
+def _walk_pcapng(buf):
+    offsets, caplens, iface_ids, ts_raw = array('q'), array('q'), array('q'), array('Q')
+    interfaces = []  # (linktype, resolution, offset) for every interface in the file
+    section_base = 0
+    endian = '<'
+    pos, size = 0, len(buf)
+    while pos + 12 <= size:
+        block_type = struct.unpack_from('<I', buf, pos)[0]
+        if block_type == PCAPNG_SHB:
+            endian = '<' if struct.unpack_from('<I', buf, pos + 8)[0] == PCAPNG_BYTE_ORDER_MAGIC else '>'
+            section_base = len(interfaces)
+        else:
+            block_type = struct.unpack_from(endian + 'I', buf, pos)[0]
+        block_len = struct.unpack_from(endian + 'I', buf, pos + 4)[0]
+        if block_len < 12 or pos + block_len > size:
+            break
+        body = pos + 8
+        if block_type == PCAPNG_IDB:
+            linktype = struct.unpack_from(endian + 'H', buf, body)[0]
+            resolution, offset = _idb_time_options(buf, body + 8, pos + block_len - 4, endian)
+            interfaces.append((linktype, resolution, offset))
+        elif block_type in (PCAPNG_EPB, PCAPNG_PB):
+            if block_type == PCAPNG_EPB:
+                iface, high, low, caplen = struct.unpack_from(endian + 'IIII', buf, body)
+            else:
+                iface, _, high, low, caplen = struct.unpack_from(endian + 'HHIII', buf, body)
+            offsets.append(body + 20)
+            caplens.append(caplen)
+            iface_ids.append(section_base + iface)
+            ts_raw.append((high << 32) | low)
+        pos += block_len
+
+    iface_ids = np.frombuffer(iface_ids, dtype=np.int64)
+    ts_raw = np.frombuffer(ts_raw, dtype=np.uint64)
+    ts = np.zeros(len(ts_raw), dtype=np.int64)
+    linktypes = np.zeros(len(ts_raw), dtype=np.int64)
+    for i, (linktype, resolution, offset) in enumerate(interfaces):
+        mask = iface_ids == i
+        if mask.any():
+            ts[mask] = _pcapng_ts_to_ns(ts_raw[mask], resolution, offset)
+            linktypes[mask] = linktype
+    return np.frombuffer(offsets, dtype=np.int64), np.frombuffer(caplens, dtype=np.int64), ts, linktypes
+
+
+'''
+vectorized header decoding
+'''
+
+
+def _be16(frame, idx):
+    return (frame[idx].astype(np.uint16) << 8) | frame[idx + 1]
+
+
+def _be32(frame, idx):
+    return ((frame[idx].astype(np.uint32) << 24) | (frame[idx + 1].astype(np.uint32) << 16)
+            | (frame[idx + 2].astype(np.uint32) << 8) | frame[idx + 3])
+
+
+# offset of the ip header inside every frame, -1 if the frame does not carry IPv4
+def _l3_offsets(frame, offsets, caplens, linktypes):
+    l3 = np.full(len(offsets), -1, dtype=np.int64)
+
+    raw = np.isin(linktypes, (LINKTYPE_RAW, LINKTYPE_IPV4)) & (caplens >= 1)
+    l3[raw] = 0
+
+    sll = (linktypes == LINKTYPE_LINUX_SLL) & (caplens >= 16)
+    sll_ipv4 = _be16(frame, offsets[sll] + 14) == ETHERTYPE_IPV4
+    l3[np.flatnonzero(sll)[sll_ipv4]] = 16
+
+    eth = np.flatnonzero((linktypes == LINKTYPE_ETHERNET) & (caplens >= 14))
+    eth_header = np.full(len(eth), 14, dtype=np.int64)
+    ethertype = _be16(frame, offsets[eth] + 12)
+    # up to two stacked vlan tags (QinQ)
+    for _ in range(2):
+        tagged = np.isin(ethertype, ETHERTYPE_VLAN) & (caplens[eth] >= eth_header + 8)
+        eth_header[tagged] += 4
+        ethertype[tagged] = _be16(frame, offsets[eth[tagged]] + eth_header[tagged] - 2)
+    eth_ipv4 = ethertype == ETHERTYPE_IPV4
+    l3[eth[eth_ipv4]] = eth_header[eth_ipv4]
+    return l3
+
+
+# group ids numbered in order of first appearance, like tshark's stream index. Also returns first row of each group.
+def _first_seen_ids(a, b):
+    keys = np.empty(len(a), dtype=[('a', np.uint64), ('b', np.uint64)])
+    keys['a'] = a
+    keys['b'] = b
+    _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    order = np.argsort(first)
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    return rank[inverse.ravel()], first[order]
+
+
+# time since the first frame and since the previous frame of the same stream, in seconds
+def _stream_times(ts, stream, stream_first):
+    relative = (ts - ts[stream_first][stream]) / 1e9
+    order = np.argsort(stream, kind='stable')
+    ts_sorted = ts[order]
+    same_stream = np.zeros(len(order), dtype=bool)
+    same_stream[1:] = stream[order][1:] == stream[order][:-1]
+    delta_sorted = np.zeros(len(order), dtype=np.int64)
+    delta_sorted[1:] = ts_sorted[1:] - ts_sorted[:-1]
+    delta = np.empty(len(order), dtype=np.float64)
+    delta[order] = np.where(same_stream, delta_sorted, 0) / 1e9
+    return relative, delta
+
+
+# window scale option of SYN segments; only a handful per capture so a python loop is fine
+def _syn_window_shift(frame, tcp_offsets, header_len, caplen_left):
+    shifts = np.full(len(tcp_offsets), -1, dtype=np.int64)
+    for i in range(len(tcp_offsets)):
+        pos = int(tcp_offsets[i]) + 20
+        end = int(tcp_offsets[i]) + int(min(header_len[i], caplen_left[i]))
+        while pos < end:
+            kind = frame[pos]
+            if kind == 0:
+                break
+            if kind == 1:
+                pos += 1
+                continue
+            if pos + 1 >= end or frame[pos + 1] < 2:
+                break
+            if kind == TCP_OPTION_WINDOW_SCALE and pos + 2 < end:
+                shifts[i] = min(int(frame[pos + 2]), 14)
+                break
+            pos += frame[pos + 1]
+    return shifts
+
+
+def _decode_tcp(frame, pkt, ts, l4, caplen_left, ip):
+    # drop frames cut before the end of the fixed header first, the header length byte may be past the capture
+    keep = caplen_left >= 20
+    pkt, ts, l4, caplen_left = pkt[keep], ts[keep], l4[keep], caplen_left[keep]
+    ip = {key: value[keep] for key, value in ip.items()}
+    header_len = (frame[l4 + 12] >> 4).astype(np.int64) * 4
+    keep = header_len >= 20
+    pkt, ts, l4, caplen_left, header_len = pkt[keep], ts[keep], l4[keep], caplen_left[keep], header_len[keep]
+    ip = {key: value[keep] for key, value in ip.items()}
+
+    src_port = _be16(frame, l4)
+    dst_port = _be16(frame, l4 + 2)
+    seq = _be32(frame, l4 + 4)
+    ack = _be32(frame, l4 + 8)
+    flags = frame[l4 + 13].astype(np.uint16) | ((frame[l4 + 12].astype(np.uint16) & 1) << 8)
+    window = _be16(frame, l4 + 14).astype(np.uint32)
+    length = np.clip(ip['total_len'] - ip['header_len'] - header_len, 0, None).astype(np.uint32)
+
+    src_endpoint = (ip['src'].astype(np.uint64) << np.uint64(16)) | src_port
+    dst_endpoint = (ip['dst'].astype(np.uint64) << np.uint64(16)) | dst_port
+    stream, stream_first = _first_seen_ids(np.minimum(src_endpoint, dst_endpoint), np.maximum(src_endpoint, dst_endpoint))
+    direction, direction_first = _first_seen_ids(src_endpoint, dst_endpoint)
+
+    # the other direction of the same stream, -1 if only one side was captured
+    direction_stream = stream[direction_first]
+    order = np.argsort(direction_stream, kind='stable')
+    paired = direction_stream[order][1:] == direction_stream[order][:-1]
+    reverse = np.full(len(direction_first), -1, dtype=np.int64)
+    reverse[order[:-1][paired]] = order[1:][paired]
+    reverse[order[1:][paired]] = order[:-1][paired]
+
+    # relative sequence numbers, uint32 arithmetic wraps like the real sequence space
+    seq_base = seq[direction_first]
+    ack_base = np.where(reverse >= 0, seq_base[np.maximum(reverse, 0)], 0).astype(np.uint32)
+    relative_seq = seq - seq_base[direction]
+    relative_ack = np.where(flags & TCP_FLAG_ACK, ack - ack_base[direction], 0).astype(np.uint32)
+    next_seq = relative_seq + length + ((flags & TCP_FLAG_SYN) > 0) + ((flags & TCP_FLAG_FIN) > 0)
+
+    # window scaling: shift announced in the SYN of each direction, active only if both sides announced it
+    syn = np.flatnonzero(flags & TCP_FLAG_SYN)
+    syn_shift = _syn_window_shift(frame, l4[syn], header_len[syn], caplen_left[syn])
+    direction_shift = np.full(len(direction_first), -1, dtype=np.int64)
+    direction_shift[direction[syn]] = syn_shift
+    reverse_shift = np.where(reverse >= 0, direction_shift[np.maximum(reverse, 0)], -1)
+    scaled = (direction_shift >= 0) & (reverse_shift >= 0)
+    shift = np.where(scaled, direction_shift, 0)[direction]
+    shift[syn] = 0
+    window_size = window << shift.astype(np.uint32)
+
+    time_relative, time_delta = _stream_times(ts, stream, stream_first)
+    return {
+        'frame.number': pkt.astype(np.uint32) + 1,
+        'frame.time_epoch': ts / 1e9,
+        'ip.ttl': ip['ttl'],
+        'ip.src': ip['src'],
+        'ip.dst': ip['dst'],
+        'tcp.srcport': src_port,
+        'tcp.dstport': dst_port,
+        'tcp.seq': relative_seq,
+        'tcp.ack': relative_ack,
+        'tcp.len': length,
+        'tcp.nxtseq': next_seq.astype(np.uint32),
+        'tcp.flags': flags,
+        'tcp.time_delta': time_delta,
+        'tcp.time_relative': time_relative,
+        'tcp.stream': stream.astype(np.uint32),
+        'tcp.window_size': window_size,
+    }
+
+
+def _decode_udp(frame, pkt, ts, l4, caplen_left, ip):
+    keep = caplen_left >= 8
+    pkt, ts, l4 = pkt[keep], ts[keep], l4[keep]
+    ip = {key: value[keep] for key, value in ip.items()}
+
+    src_port = _be16(frame, l4)
+    dst_port = _be16(frame, l4 + 2)
+    src_endpoint = (ip['src'].astype(np.uint64) << np.uint64(16)) | src_port
+    dst_endpoint = (ip['dst'].astype(np.uint64) << np.uint64(16)) | dst_port
+    stream, stream_first = _first_seen_ids(np.minimum(src_endpoint, dst_endpoint), np.maximum(src_endpoint, dst_endpoint))
+    time_relative, time_delta = _stream_times(ts, stream, stream_first)
+    return {
+        'frame.number': pkt.astype(np.uint32) + 1,
+        'frame.time_epoch': ts / 1e9,
+        'ip.ttl': ip['ttl'],
+        'ip.src': ip['src'],
+        'ip.dst': ip['dst'],
+        'udp.srcport': src_port,
+        'udp.dstport': dst_port,
+        'udp.length': _be16(frame, l4 + 4).astype(np.uint32),
+        'udp.time_delta': time_delta,
+        'udp.time_relative': time_relative,
+        'udp.stream': stream.astype(np.uint32),
+    }
+
+
+def decode_packets(frame, offsets, caplens, ts, linktypes, protocol='tcp'):
+    l3 = _l3_offsets(frame, offsets, caplens, linktypes)
+    pkt = np.flatnonzero((l3 >= 0) & (caplens - l3 >= 20))
+    ip_start = offsets[pkt] + l3[pkt]
+    left = caplens[pkt] - l3[pkt]
+
+    version = frame[ip_start] >> 4
+    ip_header_len = (frame[ip_start] & 0x0f).astype(np.int64) * 4
+    proto = frame[ip_start + 9]
+    # non-first fragments do not carry the transport header
+    fragment_offset = _be16(frame, ip_start + 6) & 0x1fff
+    wanted = IP_PROTO_UDP if protocol == 'udp' else IP_PROTO_TCP
+    keep = (version == 4) & (ip_header_len >= 20) & (proto == wanted) & (fragment_offset == 0) & (left > ip_header_len)
+    pkt, ip_start, left, ip_header_len = pkt[keep], ip_start[keep], left[keep], ip_header_len[keep]
+
+    ip = {
+        'ttl': frame[ip_start + 8],
+        'src': _be32(frame, ip_start + 12),
+        'dst': _be32(frame, ip_start + 16),
+        'total_len': _be16(frame, ip_start + 2).astype(np.int64),
+        'header_len': ip_header_len,
+    }
+    # captures taken with segmentation offload can have a zero total length, use the captured length instead
+    ip['total_len'] = np.where(ip['total_len'] == 0, left, ip['total_len'])
+    l4 = ip_start + ip_header_len
+    caplen_left = left - ip_header_len
+    if protocol == 'udp':
+        return _decode_udp(frame, pkt, ts[pkt], l4, caplen_left, ip)
+    return _decode_tcp(frame, pkt, ts[pkt], l4, caplen_left, ip)
+
+
+# read a pcap or pcapng capture and return a dict of numpy columns keyed by tshark field name.
+# protocol 'tcp' or 'udp'; by default it follows pcap_to_csv.py and picks udp when 'udp' is in the file name.
+def read_pcap(filename, protocol=None):
+    if protocol is None:
+        protocol = 'udp' if 'udp' in filename.split('/')[-1] else 'tcp'
+    with open(filename, 'rb') as f:
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    frame = None
+    try:
+        magic = struct.unpack_from('<I', buf, 0)[0]
+        if magic == PCAPNG_SHB:
+            records = _walk_pcapng(buf)
+        elif magic in (PCAP_MAGIC_US, PCAP_MAGIC_NS) or struct.unpack_from('>I', buf, 0)[0] in (PCAP_MAGIC_US, PCAP_MAGIC_NS):
+            records = _walk_pcap(buf)
+        else:
+            raise ValueError('not a pcap/pcapng file: ' + filename)
+        frame = np.frombuffer(buf, dtype=np.uint8)
+        columns = decode_packets(frame, *records, protocol=protocol)
+    finally:
+        frame = None
+        try:
+            buf.close()
+        except BufferError:
+            # a decode error is propagating and its traceback still holds views of the buffer, the mapping is
+            # released with them; keep the original error
+            pass
+    return columns
+
+
+def ipv4_to_str(values):
+    values = np.asarray(values, dtype=np.uint32)
+    return np.array(['{}.{}.{}.{}'.format(v >> 24, (v >> 16) & 0xff, (v >> 8) & 0xff, v & 0xff) for v in values.tolist()],
+                    dtype=object)
+
+
+def ipv4_from_str(values):
+    out = np.zeros(len(values), dtype=np.uint32)
+    for i, value in enumerate(values):
+        if isinstance(value, str) and value:
+            a, b, c, d = value.split('.')
+            out[i] = (int(a) << 24) | (int(b) << 16) | (int(c) << 8) | int(d)
+    return out
@@ -9,53 +9,359 @@ https://stackoverflow.com/questions/60228142/how-to-execute-tshark-in-python-for
 https://shantoroy.com/networking/convert-pcap-to-csv-using-tshark/
 https://stackoverflow.com/questions/47319313/get-filenames-in-a-directory-without-extension-python
 https://www.geeksforgeeks.org/python-os-path-splitext-method/
+
+Parallel conversion: add "tshark_workers": <N> to parameters.json to run up to N tshark jobs at once.
+A job is only started when its estimated memory fits in the budget ("tshark_mem_budget_gb", default is a
+fraction of MemAvailable), so a few huge captures do not push the node into swap. Largest files start first.
+
+Conversions are recorded in .pcap_to_csv_manifest.jsonl inside datapath (pcap size, mtime, hash and field profile).
+A csv is rebuilt when its pcap or the field list changed, or when it is missing. tshark writes to
+<name>.csv.<pid>.part which is renamed only on success, so an interrupted run just resumes with the files that were
+not finished; the temp file of a process that is no longer running is removed when its capture is queued again.
+A csv that already exists for a pcap without manifest entry (converted before the manifest existed) is recorded
+as it is when it is complete (expected header, whole last row), converted again otherwise.
+Set "manifest_reconvert_existing": true to convert those captures again anyway.
 '''
 
 import os
+import csv
 import subprocess
 import json
+import hashlib
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+TSHARK_FIELD_OPTIONS = ['-T', 'fields', '-E', 'header=y', '-E', 'separator=,', '-E', 'quote=d', '-E', 'occurrence=a']
+
+UDP_FIELDS = ['ip.ttl', 'ip.src', 'ip.dst',
+              'udp.srcport', 'udp.dstport',
+              'udp.length',
+              'udp.time_delta', 'udp.time_relative']
+
+# tcp.seq is extracted twice on purpose, the analysis scripts expect the csv layout to stay the same.
+TCP_FIELDS = ['ip.ttl', 'ip.src', 'ip.dst',
+              'tcp.srcport', 'tcp.dstport', 'tcp.seq', 'tcp.ack',
+              'tcp.len', 'tcp.seq', 'tcp.nxtseq',
+              'tcp.time_delta', 'tcp.time_relative', 'tcp.stream',
+              'tcp.analysis.retransmission', 'tcp.analysis.lost_segment',
+              'tcp.window_size',
+              'tcp.analysis.ack_rtt',
+              'tcp.analysis.bytes_in_flight']
+
+# memory estimate of one tshark job: fixed base plus a factor of the pcap size (tcp analysis keeps per-frame state)
+TSHARK_BASE_MEM = 256 * 1024 ** 2
+TSHARK_MEM_FACTOR = 1.5
+# fraction of MemAvailable used as the default budget for all running tshark jobs
+TSHARK_MEM_FRACTION = 0.7
+
+MANIFEST_FILENAME = '.pcap_to_csv_manifest.jsonl'
+PARTIAL_SUFFIX = '.part'
+HASH_SAMPLE_BYTES = 1024 ** 2
+# end of a csv read to check its last row, many times the longest row
+CSV_TAIL_BYTES = 64 * 1024
+CSV_ENCODING = "ISO-8859-1"
+
+
+# choose the field list based on the file name, same rule used since the first version of the script
+def select_fields(filename):
+    if 'udp' in filename:
+        return UDP_FIELDS
+    return TCP_FIELDS
+
+
+def tshark_args(pcap_path, fields):
+    args = ['tshark', '-r', pcap_path] + TSHARK_FIELD_OPTIONS
+    for field in fields:
+        args += ['-e', field]
+    args.append('-q')
+    return args
+
+
+# MemAvailable from /proc/meminfo in bytes, None if it can not be read (not linux)
+def available_memory():
+    try:
+        with open('/proc/meminfo') as meminfo:
+            for line in meminfo:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def estimate_tshark_memory(pcap_path):
+    return TSHARK_BASE_MEM + int(TSHARK_MEM_FACTOR * os.path.getsize(pcap_path))
+
+
+# admission control for the worker pool: a job waits until its memory estimate fits in the budget.
+# One job is always admitted when nothing else is running, so an oversized capture still gets converted.
+class MemoryGate:
+    def __init__(self, budget):
+        self.budget = budget
+        self.in_use = 0
+        self.condition = threading.Condition()
+
+    def acquire(self, amount):
+        with self.condition:
+            while self.in_use > 0 and self.in_use + amount > self.budget:
+                self.condition.wait()
+            self.in_use += amount
+
+    def release(self, amount):
+        with self.condition:
+            self.in_use -= amount
+            self.condition.notify_all()
+
+
+# field profile: changes whenever the tshark options or the field list change, so old csv files get rebuilt
+def field_profile(fields):
+    return hashlib.sha1(' '.join(TSHARK_FIELD_OPTIONS + fields).encode()).hexdigest()[:16]
+
+
+# content hash of a capture. By default only the head and tail are hashed (plus the size), which is enough to
+# tell captures apart and keeps re-runs over thousands of multi-GB files fast. full=True hashes everything.
+def pcap_hash(pcap_path, full=False):
+    digest = hashlib.sha1()
+    size = os.path.getsize(pcap_path)
+    digest.update(str(size).encode())
+    with open(pcap_path, 'rb') as f:
+        if full or size <= 2 * HASH_SAMPLE_BYTES:
+            for block in iter(lambda: f.read(1024 ** 2), b''):
+                digest.update(block)
+        else:
+            digest.update(f.read(HASH_SAMPLE_BYTES))
+            f.seek(size - HASH_SAMPLE_BYTES)
+            digest.update(f.read(HASH_SAMPLE_BYTES))
+    return digest.hexdigest()
+
+
+# temp file of a conversion of this process, the pid keeps concurrent converters of the same folder apart
+def partial_path(file_path):
+    return file_path + '.' + str(os.getpid()) + PARTIAL_SUFFIX
+
+
+def _pid_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True  # running, owned by another user
+    return True
+
+
+# temp files of filename left by converters that are not running anymore (or written before the pid was added)
+def remove_stale_partials(path, filename, names):
+    prefix = filename + '.'
+    for name in names:
+        if not name.startswith(prefix) or not name.endswith(PARTIAL_SUFFIX):
+            continue
+        pid = name[len(prefix):-len(PARTIAL_SUFFIX)]
+        if pid and (not pid.isdigit() or _pid_running(int(pid))):
+            continue
+        print("removing partial file: " + name)
+        try:
+            os.remove(os.path.join(path, name))
+        except FileNotFoundError:
+            pass
+
+
+# the manifest is a json lines journal in the data folder, one entry per finished conversion.
+# Appending keeps every completed file recorded even if the run is killed; the last entry of a pcap wins.
+def load_manifest(path):
+    manifest = {}
+    try:
+        with open(os.path.join(path, MANIFEST_FILENAME)) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # partially written line from an interrupted run
+                manifest[entry['pcap']] = entry
+    except FileNotFoundError:
+        pass
+    return manifest
+
+
+def append_manifest(path, entry, lock):
+    with lock:
+        with open(os.path.join(path, MANIFEST_FILENAME), 'a') as f:
+            f.write(json.dumps(entry) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+
+# rewrite the journal with one line per pcap, through a temp file so a crash never leaves it half written
+def compact_manifest(path, manifest):
+    manifest_path = os.path.join(path, MANIFEST_FILENAME)
+    with open(partial_path(manifest_path), 'w') as f:
+        for pcap_file in sorted(manifest):
+            f.write(json.dumps(manifest[pcap_file]) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(partial_path(manifest_path), manifest_path)
+
+
+# run tshark on one pcap file and write the csv. Returns the manifest entry of the conversion.
+# tshark writes to a temp file that is renamed when it finishes, a killed run never leaves a truncated csv behind.
+def convert_file(path, pcap_file, filename, gate=None, full_hash=False):
+    pcap_path = os.path.join(path, pcap_file)
+    csv_path = os.path.join(path, filename)
+    fields = select_fields(filename)
+    stat = os.stat(pcap_path)
+    entry = {'pcap': pcap_file, 'csv': filename, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+             'hash': pcap_hash(pcap_path, full_hash), 'profile': field_profile(fields)}
+    mem = estimate_tshark_memory(pcap_path)
+    if gate is not None:
+        gate.acquire(mem)
+    try:
+        start = time.perf_counter()
+        part_path = partial_path(csv_path)
+        try:
+            with open(part_path, "w") as outfile:
+                print("writing: " + filename)
+                subprocess.run(tshark_args(pcap_path, fields), stdout=outfile, check=True)
+                outfile.flush()
+                os.fsync(outfile.fileno())
+            os.replace(part_path, csv_path)
+        except BaseException:
+            if os.path.exists(part_path):
+                os.remove(part_path)
+            raise
+        entry['elapsed'] = time.perf_counter() - start
+        entry['csv_size'] = os.path.getsize(csv_path)
+        print("done: " + filename + " in " + "{:.1f}".format(entry['elapsed']) + " s")
+        return entry
+    finally:
+        if gate is not None:
+            gate.release(mem)
+
+
+# True if the manifest entry still describes this pcap and its csv. size/mtime are checked first,
+# the hash is only computed when they changed (e.g. the sweep folder was copied to another machine).
+def is_up_to_date(path, pcap_file, filename, entry, csv_size, full_hash=False):
+    if entry is None or entry.get('csv') != filename or entry.get('profile') != field_profile(select_fields(filename)):
+        return False
+    if csv_size is None or csv_size != entry.get('csv_size'):
+        return False
+    stat = os.stat(os.path.join(path, pcap_file))
+    if stat.st_size != entry['size']:
+        return False
+    if stat.st_mtime_ns == entry['mtime_ns']:
+        return True
+    if pcap_hash(os.path.join(path, pcap_file), full_hash) == entry['hash']:
+        entry['mtime_ns'] = stat.st_mtime_ns
+        return True
+    return False
+
+
+# list (pcap, csv) pairs that still have to be converted. The folder is listed once.
+# True if the csv looks like a finished tshark export of fields: the header lists them and the file ends with a
+# newline after a complete row. A csv cut short by a killed tshark (written in place before the temp files) fails.
+def is_complete_csv(csv_path, fields):
+    with open(csv_path, 'rb') as f:
+        header = next(csv.reader([f.readline().decode(CSV_ENCODING)]), [])
+        size = f.seek(0, os.SEEK_END)
+        f.seek(max(0, size - CSV_TAIL_BYTES))
+        tail = f.read()
+    if header != fields or not tail.endswith(b'\n'):
+        return False
+    last = tail[:-1].rsplit(b'\n', 1)[-1].rstrip(b'\r')
+    return len(next(csv.reader([last.decode(CSV_ENCODING)]), [])) == len(fields)
+
+
+# adopt_existing records csv files written before the manifest existed instead of converting them again, once
+# is_complete_csv checked them.
+def find_pending(path, manifest, full_hash=False, adopt_existing=True):
+    pending = []
+    existing = {}
+    partials = []
+    for dir_entry in os.scandir(path):
+        if dir_entry.name.endswith(PARTIAL_SUFFIX):
+            partials.append(dir_entry.name)
+        elif dir_entry.is_file():
+            existing[dir_entry.name] = dir_entry.stat().st_size
+    for pcap_file in sorted(existing):
+        # analyze only pcap files
+        if pcap_file.endswith(".pcap"):
+            #os.path.splitext returns in  position 0 the fileneme, in position 1 the extension
+            filename = os.path.splitext(pcap_file)[0] + '.csv'
+            entry = manifest.get(pcap_file)
+            if is_up_to_date(path, pcap_file, filename, entry, existing.get(filename), full_hash):
+                continue
+            adopt = adopt_existing and entry is None and bool(existing.get(filename))
+            if adopt and not is_complete_csv(os.path.join(path, filename), select_fields(filename)):
+                print(filename + " on " + path + " is incomplete, converting it again")
+                adopt = False
+            if adopt:
+                stat = os.stat(os.path.join(path, pcap_file))
+                manifest[pcap_file] = {'pcap': pcap_file, 'csv': filename, 'size': stat.st_size,
+                                       'mtime_ns': stat.st_mtime_ns,
+                                       'hash': pcap_hash(os.path.join(path, pcap_file), full_hash),
+                                       'profile': field_profile(select_fields(filename)),
+                                       'csv_size': existing[filename]}
+                print(filename + " already exists on " + path + ", added to manifest")
+                continue
+            # leftovers of an interrupted conversion of this capture
+            remove_stale_partials(path, filename, partials)
+            pending.append((pcap_file, filename))
+    print(str(len(pending)) + " files to convert")
+    return pending
+
+
+def convert_all(path, workers=1, mem_budget=None, full_hash=False, adopt_existing=True):
+    manifest = load_manifest(path)
+    pending = find_pending(path, manifest, full_hash, adopt_existing)
+    lock = threading.Lock()
+    start = time.perf_counter()
+    timings = {}
+
+    def run(pcap_file, filename, gate=None):
+        entry = convert_file(path, pcap_file, filename, gate, full_hash)
+        append_manifest(path, entry, lock)
+        with lock:
+            manifest[pcap_file] = entry
+        return entry['elapsed']
+
+    try:
+        if workers <= 1:
+            for pcap_file, filename in pending:
+                timings[filename] = run(pcap_file, filename)
+        else:
+            if mem_budget is None:
+                available = available_memory()
+                mem_budget = TSHARK_MEM_FRACTION * available if available is not None else float('inf')
+            gate = MemoryGate(mem_budget)
+            # largest captures first, so the long jobs do not end up alone at the tail of the sweep
+            pending.sort(key=lambda job: os.path.getsize(os.path.join(path, job[0])), reverse=True)
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                futures = {pool.submit(run, pcap_file, filename, gate): filename
+                           for pcap_file, filename in pending}
+                for future, filename in futures.items():
+                    try:
+                        timings[filename] = future.result()
+                    except subprocess.CalledProcessError as e:
+                        print("error converting: " + filename + " (tshark exit code " + str(e.returncode) + ")")
+    finally:
+        with lock:
+            compact_manifest(path, manifest)
+    total = time.perf_counter() - start
+    print("converted " + str(len(timings)) + " files in " + "{:.1f}".format(total) + " s"
+          + " (sum of per-file times " + "{:.1f}".format(sum(timings.values())) + " s)")
+    return timings
+
+
+if __name__ == '__main__':
+    parameters = json.load(open('parameters.json'))
+    path = parameters["datapath"]
+    workers = parameters.get("tshark_workers", 1)
+    mem_budget = parameters.get("tshark_mem_budget_gb")
+    if mem_budget is not None:
+        mem_budget = mem_budget * 1024 ** 3
 
-parameters = json.load(open('parameters.json'))
-path = parameters["datapath"]
-
-# get the file list in the directory
-path_files = os.listdir(path)
-
-
-print ("reading pcap /writing csv in: "+path)
-for pcap_file in os.listdir(path):
-     # analyze only pcap files
-     if pcap_file.endswith(".pcap"):
-         #os.path.splitext returns in  position 0 the fileneme, in position 1 the extension
-         #if (os.path.splitext(pcap_file)[0] + '.csv') in os.listdir(path):
-         #   filename = os.path.splitext(pcap_file)[0] + '.csv'
-         filename = os.path.splitext(pcap_file)[0] + '.csv'
-         # write the csv file if not already in the folder.
-         if filename not in os.listdir(path):
-             if 'udp' in filename:
-                 args = ['tshark', '-r', os.path.join(path, pcap_file),
-                         '-T', 'fields', '-E', 'header=y', '-E', 'separator=,', '-E', 'quote=d', '-E', 'occurrence=a',
-                         '-e', 'ip.ttl', '-e', 'ip.src', '-e', 'ip.dst',
-                         '-e', 'udp.srcport', '-e', 'udp.dstport',
-                         '-e', 'udp.length',
-                         '-e', 'udp.time_delta', '-e', 'udp.time_relative',
-                         '-q']
-             else:
-                 args = ['tshark', '-r', os.path.join(path, pcap_file),
-                         '-T', 'fields', '-E', 'header=y', '-E', 'separator=,', '-E', 'quote=d', '-E', 'occurrence=a',
-                         '-e', 'ip.ttl', '-e', 'ip.src', '-e', 'ip.dst',
-                         '-e', 'tcp.srcport', '-e', 'tcp.dstport', '-e', 'tcp.seq', '-e', 'tcp.ack',
-                         '-e', 'tcp.len', '-e', 'tcp.seq', '-e', 'tcp.nxtseq',
-                         '-e', 'tcp.time_delta', '-e', 'tcp.time_relative', '-e', 'tcp.stream',
-                         '-e', 'tcp.analysis.retransmission', '-e', 'tcp.analysis.lost_segment',
-                         '-e', 'tcp.window_size',
-                         '-e', 'tcp.analysis.ack_rtt',
-                         '-e', 'tcp.analysis.bytes_in_flight',
-                         '-q']
-             with open(path+filename,"w") as outfile:
-                 print("writing: " + filename)
-                 subprocess.run(args, stdout=outfile, check=True)
-         else:
-             print(filename + " already exists on " + path)
-
-print("------Finished-------")
\ No newline at end of file
+    print ("reading pcap /writing csv in: "+path)
+    convert_all(path, workers, mem_budget,
+                full_hash=parameters.get("manifest_full_hash", False),
+                adopt_existing=not parameters.get("manifest_reconvert_existing", False))
+    print("------Finished-------")
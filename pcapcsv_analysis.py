@@ -10,7 +10,10 @@ TO BE EXECUTED in any computer/server where the csv file is stored. The pcap fil
 Required columns: Source, Destination, Stream index, Time since first frame in this TCP stream, Time, TCP Segment Len, Retransmission
 '''
 import math
-import pandas as pd
+from pcapcsv_render import select_backend, show_or_render
+from pcapcsv_bins import bin_counters
+from pcapcsv_loader import read_csv_cached
+select_backend(interactive=None) #Agg when "render_dir" is set in parameters.json
 import matplotlib.pyplot as plt
 
 import json
@@ -19,6 +22,7 @@ parameters = json.load(open('parameters.json'))
 path = parameters["datapath"]
 
 TCP_WINDOW_SIZE = 65535 # in Bytes
+BIN_WIDTH = 1 # seconds, interval of the packet counters
 Gbs_scale_factor = 1000000000 * math.sqrt(2) # for some reason, the calculated value is scaled by sqrt(2), so should divide by this.
 ms_scale_factor = 1000
 stream_index = 1
@@ -27,7 +31,7 @@ stream_index = 1
 
 filename = 'csv2gpython.csv'
 
-df = pd.read_csv(path+filename)
+df = read_csv_cached(path+filename)
 
 # filter traffic sent from vm1 to vm4
 df2 = df[(df['Source'] == '10.0.0.1')
@@ -85,24 +89,20 @@ plt.grid('on')
 
 
 # =============================================================================================================================
-# now group retransmissions each second.
+# now group retransmissions each BIN_WIDTH seconds.
 
+# the loader decodes the Retransmission column to bool (any text marks a retransmission)
 
-# convert time index to integer
-# https://www.geeksforgeeks.org/convert-floats-to-integers-in-a-pandas-dataframe/
-df2['Time since first frame in this TCP stream'] = df2['Time since first frame in this TCP stream'].astype(int)
-
-# convert retransmissions column to int
-df2['Retransmission'] = df2['Retransmission'].replace(df2['Retransmission'].unique()[0], 0) #first element should be NaN for not retransmission
-df2['Retransmission'] = df2['Retransmission'].replace(df2['Retransmission'].unique()[1], 1) # second element should be a weird string of len 9, for retransmission
-
-# count all the packets, no matter if lost or sent successfully. 
-pkt_sent = df2.groupby('Time since first frame in this TCP stream')['Retransmission'].count()
-# add all the retransmissions per second, as a metric for packet loss
-pkt_retransmit = df2.groupby('Time since first frame in this TCP stream')['Retransmission'].sum()
+# one bincount per counter over the bin of every packet
+bins = bin_counters(df2['Time since first frame in this TCP stream'], BIN_WIDTH,
+                    retransmission=df2['Retransmission'])
+# count all the packets, no matter if lost or sent successfully.
+pkt_sent = bins['packets']
+# add all the retransmissions per bin, as a metric for packet loss
+pkt_retransmit = bins['retransmissions']
 
 # calculate the packet loss metric
-pkt_loss_ratio = 100*pkt_retransmit/pkt_sent
+pkt_loss_ratio = bins['loss_ratio']
 
 # Now plot the results.
 # Plot sent packets per second
@@ -137,4 +137,4 @@ plt.xlabel("t (s)")
 plt.ylabel("Throughput (Gbps)")
 plt.grid('on')
 
-plt.show()
+show_or_render()
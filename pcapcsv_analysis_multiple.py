@@ -12,9 +12,15 @@ TO BE EXECUTED in any computer/server where the csv file is stored. The pcap fil
 Required columns: Source, Destination, Stream index, Time since first frame in this TCP stream, Time, TCP Segment Len, Retransmission
 '''
 import math
-import pandas as pd
+from functools import partial
+import numpy as np
+from pcapcsv_render import select_backend, show_or_render
+from pcapcsv_bins import bin_counters
+select_backend(interactive=None) #Agg when "render_dir" is set in parameters.json
 import matplotlib.pyplot as plt
 import json
+from pcapcsv_decimate import decimate
+from pcapcsv_sweep import sweep, reduce_file, peak_memory
 
 parameters = json.load(open('parameters.json'))
 path = parameters["datapath"]
@@ -34,6 +40,7 @@ desired_df_columns=['Time since first frame in this TCP stream',
                     'Retransmission']
 
 TCP_WINDOW_SIZE = 65535 # in Bytes
+BIN_WIDTH = 1 # seconds, interval of the packet counters
 #Gbs_scale_factor = 1000000000 * math.sqrt(2) # for some reason, the calculated value is scaled by sqrt(2), so should divide by this.
 Gbs_scale_factor = 1000000000
 ms_scale_factor = 1000
@@ -50,23 +57,6 @@ def get_filenames(no_files=no_files,filename=filename,extension=extension,files_
         files_array.append(filename+str(i)+extension)
     return files_array
 
-#read files and return the dataframe with the required columns
-def read_files(files_array, path=path):
-    df_array=[]
-    for i,filename in enumerate(files_array):
-        #read csv file and convert to pandas dataframe
-        df_temp=pd.read_csv(path+filename)
-        print('reading: '+path+filename)
-        #print(df_temp.keys())
-
-        #drop not desired columns to avoid extra memory
-        for i, key in enumerate(df_temp.keys()):
-            if key not in desired_df_columns:
-                df_temp=df_temp.drop(columns=key)
-        #df_temp.dropna()
-        df_array.append(df_temp)
-    return df_array
-
 
 #df = pd.read_csv(path+filename)
 
@@ -82,12 +72,45 @@ def filter_packets_vm1_vm4(df_array):
     return df_out
 
 
+# reduce one run to what the figures need: decimated RTT, segment length and throughput series (time sorted,
+# min/max of every pixel column kept) and the per BIN_WIDTH packet counters. The packets are dropped afterwards.
+def reduce_run(df, filename):
+    t = df['Time since first frame in this TCP stream']
+    # Throughput as the ratio of the moving average of TCP segment length / RTT
+    #https://www.geeksforgeeks.org/how-to-calculate-moving-average-in-a-pandas-dataframe/
+    throughput = 8 * ((df['TCP Segment Len'].rolling(10000).mean()) / (df['Time'].rolling(10000).mean())) / Gbs_scale_factor
+    # rows without a time in the tcp stream (non-tcp rows of the export) can not be plotted, drop them before sorting
+    valid = np.flatnonzero(t.notna().to_numpy())
+    order = valid[np.argsort(t.to_numpy()[valid], kind='stable')]
+    run = {'rtt': decimate(t.to_numpy()[order], (df['Time'] * ms_scale_factor).to_numpy()[order]),
+           'segment_length': decimate(t.to_numpy()[order], df['TCP Segment Len'].to_numpy()[order]),
+           'throughput': decimate(t.to_numpy()[order], throughput.to_numpy()[order])}
+
+    # now group retransmissions each BIN_WIDTH seconds.
+    # drop na values on the time column
+    # https: // stackoverflow.com / questions / 13413590 / how - to - drop - rows - of - pandas - dataframe - whose - value - in -a - certain - column - is -nan
+    df = df[df['Time since first frame in this TCP stream'].notna()]
+    # the loader decodes the Retransmission column to bool (any text marks a retransmission)
+    # one bincount per counter over the bin of every packet
+    bins = bin_counters(df['Time since first frame in this TCP stream'], BIN_WIDTH,
+                        retransmission=df['Retransmission'])
+    # count all the packets, no matter if lost or sent successfully.
+    run['pkt_sent'] = bins['packets']
+    # add all the retransmissions per bin, as a metric for packet loss
+    run['pkt_retransmit'] = bins['retransmissions']
+    # calculate the packet loss metric
+    run['pkt_loss_ratio'] = bins['loss_ratio']
+    return run
+
+
 '''
 Processing section
 '''
 files_array = get_filenames()
-df_array = read_files(files_array)
-t_axis = df_array[0]['Time since first frame in this TCP stream']
+# one run at a time (or one per worker), only the reduced runs are kept
+runs = list(sweep(files_array, path, partial(reduce_file, reduce=reduce_run, usecols=desired_df_columns),
+                  workers=parameters.get("analysis_workers")))
+print('peak memory: ' + str(peak_memory()))
 
 
 '''
@@ -102,9 +125,10 @@ print('-------plotting-------')
 # -----------------------------------
 plt.figure()
 #plt.scatter(df2['Time since first frame in this TCP stream'], 1000*(df2['Time'].rolling(1000).mean()))
-for i,df in enumerate(df_array):
+for i,run in enumerate(runs):
     if i not in remove_from_plot:
-        plt.plot(df['Time since first frame in this TCP stream'], df['Time'] * ms_scale_factor, label='test ' + str(i))
+        x, y, _ = run['rtt']
+        plt.plot(x, y, label='test ' + str(i))
 plt.title(filename + " - RTT")
 plt.xlabel("t (s)")
 plt.ylabel("RTT (ms)")
@@ -116,9 +140,10 @@ plt.legend()
 # -----------------------------------
 plt.figure()
 #plt.scatter(df2['Time since first frame in this TCP stream'], 8*(df2['TCP Segment Len'].rolling(1000).mean()))
-for i,df in enumerate(df_array):
+for i,run in enumerate(runs):
     if i not in remove_from_plot:
-        plt.scatter(df['Time since first frame in this TCP stream'], (df['TCP Segment Len']), label='test ' + str(i))
+        x, y, _ = run['segment_length']
+        plt.scatter(x, y, label='test ' + str(i))
 plt.title(filename + " - TCP segment length (bits)")
 plt.xlabel("t (s)")
 plt.grid('on')
@@ -131,13 +156,10 @@ plt.legend()
 # plot Throughput as the ratio of the moving average of TCP segment length / RTT
 # -----------------------------------
 plt.figure()
-#create a new entry in the dataframe for the throughput with Moving Average
-#https://www.geeksforgeeks.org/how-to-calculate-moving-average-in-a-pandas-dataframe/
-for i,df in enumerate(df_array):
+for i,run in enumerate(runs):
     if i not in remove_from_plot:
-        df['Throughput'] = (8*df['TCP Segment Len']/df['Time']).rolling(1000).mean()
-        #plt.scatter(df2['Time since first frame in this TCP stream'], df2['Throughput'])
-        plt.plot(df['Time since first frame in this TCP stream'], 8 * ((df['TCP Segment Len'].rolling(10000).mean()) / (df['Time'].rolling(10000).mean())) / Gbs_scale_factor, label='test ' + str(i))
+        x, y, _ = run['throughput']
+        plt.plot(x, y, label='test ' + str(i))
         #plt.scatter(df2['Time since first frame in this TCP stream'], 8*(df2['TCP Segment Len']/(df2['Time']).rolling(1000).mean() / 1024000))
 
 plt.title(filename + " - Throughput (Gbps) WND/RTT")
@@ -155,38 +177,13 @@ plt.legend()
 
 
 # =============================================================================================================================
-# Calculate packets sent, retransmissions and packet loss ratio
-
-pkt_sent_array_series=[]
-pkt_retransmit_array_series=[]
-pkt_loss_ratio_array_series=[]
-for i, df in enumerate(df_array):
-    # now group retransmissions each second.
-    # convert time index to integer
-    # https://www.geeksforgeeks.org/convert-floats-to-integers-in-a-pandas-dataframe/
-    print('working on df: '+str(i))
-    #df = df.dropna()
-
-    # drop na values on the column that we are going to convert to integer
-    # https: // stackoverflow.com / questions / 13413590 / how - to - drop - rows - of - pandas - dataframe - whose - value - in -a - certain - column - is -nan
-    df = df[df['Time since first frame in this TCP stream'].notna()]
-    df['Time since first frame in this TCP stream'] = df['Time since first frame in this TCP stream'].astype(int)
-    #print(df.keys())
-    #print(df['Retransmission'].unique())
-
-    # convert retransmissions column to int
-    df['Retransmission'] = df['Retransmission'].replace(df['Retransmission'].unique()[0], 0) #first element should be NaN for not retransmission
-    df['Retransmission'] = df['Retransmission'].replace(df['Retransmission'].unique()[1], 1) # second element should be a weird string of len 9, for retransmission
+# packets sent, retransmissions and packet loss ratio, counted per run by reduce_run
 
-    # count all the packets, no matter if lost or sent successfully.
-    pkt_sent=df.groupby('Time since first frame in this TCP stream')['Retransmission'].count()
-    print('pkt sent mean: '+str(pkt_sent.mean()))
-    pkt_sent_array_series.append(pkt_sent)
-    # add all the retransmissions per second, as a metric for packet loss
-    pkt_retransmit=df.groupby('Time since first frame in this TCP stream')['Retransmission'].sum()
-    pkt_retransmit_array_series.append(pkt_retransmit)
-    # calculate the packet loss metric
-    pkt_loss_ratio_array_series.append(100*pkt_retransmit/pkt_sent)
+pkt_sent_array_series = [run['pkt_sent'] for run in runs]
+pkt_retransmit_array_series = [run['pkt_retransmit'] for run in runs]
+pkt_loss_ratio_array_series = [run['pkt_loss_ratio'] for run in runs]
+for i, pkt_sent in enumerate(pkt_sent_array_series):
+    print('pkt sent mean, df ' + str(i) + ': ' + str(pkt_sent.mean()))
 
 # Now plot the results.
 # -----------------------------------
@@ -242,4 +239,4 @@ plt.ylim(top=TOP_BW_AXIS, bottom=BOTTOM_BW_AXIS)
 plt.grid('on')
 plt.legend()
 
-plt.show()
+show_or_render()
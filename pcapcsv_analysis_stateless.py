@@ -16,7 +16,8 @@ Required columns: ip.src, ip.dst, tcp.stream, tcp.time_relative, tcp.time_delta,
 import math
 import pandas as pd
 import matplotlib
-matplotlib.use('Qt5Agg', force=True) #fix for use qt5agg backend for matplotlib. Use $pip install pyqt5
+from pcapcsv_render import select_backend, show_or_render
+select_backend() #qt5agg backend for matplotlib (Use $pip install pyqt5), Agg when "render_dir" is set in parameters.json
 # https://python-graph-gallery.com/custom-fonts-in-matplotlib
 matplotlib.rcParams['font.family'] = 'cmr10' #for labels, titles, and other text
 matplotlib.rcParams['mathtext.fontset'] = 'cm'
@@ -24,7 +25,11 @@ matplotlib.rcParams['font.size'] = 11
 import matplotlib.pyplot as plt
 from matplotlib.ticker import (AutoMinorLocator, MultipleLocator)
 import json
-import os
+from pcapcsv_metrics import analyze_files
+from pcapcsv_decimate import pixel_columns
+from pcapcsv_experiments import ExperimentSet
+from pcapcsv_loader import FLAGS_COLUMN
+from pcapcsv_summary import update_summary, summary_table
 
 #use this commands to find the available fonts, or at least, to find the folder where ttfs are stored.
 #from matplotlib import font_manager
@@ -34,14 +39,10 @@ import os
 parameters = json.load(open('parameters.json'))
 path = parameters["datapath_multi_bw"]
 
-files_array=[] # leave empty, for automatic file name appending
-
-#for analyzing csv files in path
-for file in os.listdir(path):
-    # analyze only pcap files
-    if (file.endswith(".csv")):# and ('v1' in file):
-        files_array.append(file)
-files_array.sort()
+# csv files in path indexed by the metadata of their names, nothing is loaded here.
+# Pick runs with e.g. files_array = experiments.select(bandwidth=10, run=lambda run: run <= 5)
+experiments = ExperimentSet(path)
+files_array = experiments.filenames
 
 #TEST_ID=1
 #files_array=[files_array[TEST_ID],files_array[TEST_ID+50]]
@@ -52,6 +53,8 @@ files_array.sort()
 remove_from_plot=[]
 #remove_from_plot.extend(list(range(0,10)))
 #remove_from_plot.extend(list(range(20,50)))
+# runs can also be left out of the plots by their metadata (ExperimentSet.select), e.g. {'run': lambda run: run > 5}
+remove_from_plot_metadata = {}
 
 
 
@@ -61,6 +64,7 @@ LABEL_RIGHT_LIMIT = 2 # last element of filename standard to include in plot lab
 TEST_DURATION = 20
 RECONFIGURATION = 10
 XAXIS_LOCATOR = 2 # for xticklabels. 2 for test duration 20, and 10 for test duration 60
+BIN_WIDTH = 0.01 # seconds, fine bins for the goodput around the reconfiguration
 
 markers = ['>', '+', '.', ',', 'o', 'v', 'x', 'X', 'D', '|']
 MARKER_SIZE = 10
@@ -97,8 +101,10 @@ elif 'MBB' in path:
 elif 'OST' in path:
     filename += 'OST v3'
 
+MULTI_STREAM = False # analyze every parallel flow, not only the dominant tcp.stream
 if 'Dual' in path:
     filename+=' - Bandwidth steering '
+    MULTI_STREAM = True
 
 #filename = 'Make before break - Bandwidth steering v1'
 extension = '.csv'
@@ -115,8 +121,8 @@ desired_df_columns = ['tcp.time_relative',
                       'tcp.time_delta',
                       'tcp.len',
                       'tcp.window_size',
-                      'tcp.analysis.retransmission',
-                      #'tcp.analysis.bytes_in_flight',
+                      FLAGS_COLUMN,
+                      'tcp.analysis.bytes_in_flight',
                       'tcp.analysis.ack_rtt']
 
 #factors for modifying the rolling window size of moving average
@@ -131,7 +137,6 @@ TCP_WINDOW_SIZE = 65535  # in Bytes
 Gbs_scale_factor = 1000000000
 ms_scale_factor = 1000
 kbps_scale_factor = 1000
-SPLIT_FILENAME_CHAR=')'
 #stream_index = 1
 
 
@@ -150,106 +155,40 @@ def get_filenames(no_files=no_files, filename=filename, extension=extension):
     return files_array
 
 
-# read files and return the dataframe with the required columns
-def read_files(files_array, path=path):
-    df_array = []
-    for i, filename in enumerate(files_array):
-        # Read csv file and convert to pandas dataframe. Pull only relevant columns
-        df_temp = pd.read_csv(path + filename, usecols=desired_df_columns, encoding="ISO-8859-1") #fix for pandas 1.4
-        print('reading: ' + path + filename)
-        df_array.append(df_temp)
-    return df_array
-
-def set_time_float_to_int(df_array, column='tcp.time_relative'):
-    df_out = []
-    for df in df_array:
-        df[column] = df[df[column].notna()][column].astype(int)
-        df_out.append(df)
-    print('converting time axis to int')
-    return df_out
-
-def find_pkt_sent(df_array,stream_index):
-    pkt_sent_array = []
-    for i, df in enumerate(df_array):
-        series=df[df['tcp.stream'] == stream_index[i]].groupby('tcp.time_relative')['ip.src'].count()
-        pkt_sent_array.append(series)
-    print('finding pkt sent series')
-    return pkt_sent_array
-
-def find_rolling_sma_window(pkt_sent_array):
-    rolling_window_array = []
-    for pkt_sent in pkt_sent_array:
-        rolling_window = int(pkt_sent.mean())
-        rolling_window_array.append(rolling_window)
-    print('finding rolling sma window')
-    return rolling_window_array
-
-
-# filter traffic of the actual tcp stream, drop the rest.
-# the pcap file show the data stream on ID 0 or 1. Must identify and filter the right tcp stream ID.
-# https://datagy.io/python-get-dictionary-key-with-max-value/
-def find_stream_index(df_array):
-    stream_index=[]
-    for df in df_array:
-        # get unique Stream IDs
-        packets_per_stream = {}  # key: unique stream_id, value: packets per stream
-        for index in df['tcp.stream'].unique():
-            packets_per_stream[index] = df[df['tcp.stream'] == index]['tcp.stream'].count()
-        #max_stream_index_value = max(packets_per_stream.values()) #to obtain the maximum value in dict.values()
-        stream_index.append(max(packets_per_stream, key=packets_per_stream.get)) #obtain the key of the max value in dict.values()
-    return stream_index
-
-def filter_packets(df_array, stream_index):
-    df_out = []
-    for i, df in enumerate(df_array):
-        df = df[ #((df['ip.src'] == '10.0.0.1') | (df['ip.src'] == '10.0.0.2'))
-                #&((df['ip.dst'] == '10.0.0.4') | (df['ip.dst'] == '10.0.0.3'))
-                (df['tcp.stream'] == stream_index[i])]
-        df_out.append(df)
-    return df_out
-
-
-def find_packet_loss(df_array):
-    df_out=[]
-    for i, df in enumerate(df_array):
-        #df['tcp.analysis.retransmission'] = df['tcp.analysis.retransmission'].replace(df['tcp.analysis.retransmission'].unique()[0], 0)
-        #try:
-        #    df['tcp.analysis.retransmission'] = df['tcp.analysis.retransmission'].replace(df['tcp.analysis.retransmission'].unique()[1], 1)
-        #except:
-        #    print('No tcp.analysis.retransmissions found')
-        df['loss'] = \
-        df[df['tcp.time_relative'].notna()]['tcp.analysis.retransmission'].rolling(int(rolling_sma_window_array[i] / ROLLING_FACTOR_LOSS)).sum() / \
-        df[df['tcp.time_relative'].notna()]['tcp.analysis.retransmission'].rolling(int(rolling_sma_window_array[i] / ROLLING_FACTOR_LOSS)).count() * 100
-        df_out.append(df)
-    return df_out
-
-def set_retransmission_values(df_array):
-    df_out=[]
-    for i, df in enumerate(df_array):
-        df['tcp.analysis.retransmission'] = df['tcp.analysis.retransmission'].replace(df['tcp.analysis.retransmission'].unique()[0], 0)
-        try:
-            # second element should be a weird string of len 9, for tcp.analysis.retransmission
-            df['tcp.analysis.retransmission'] = df['tcp.analysis.retransmission'].replace(df['tcp.analysis.retransmission'].unique()[1], 1)
-        except:
-            print('No tcp.analysis.retransmissions found')
-        df_out.append(df)
-    return df_out
-
 '''
 Processing section
 '''
 if len(files_array)==0:
     files_array = get_filenames()
-df_array = read_files(files_array)
-stream_index=find_stream_index(df_array)
-#df_array=filter_packets(df_array, stream_index)
-df_array_time_int = set_time_float_to_int(df_array)
-pkt_sent_array = find_pkt_sent(df_array_time_int, stream_index)
-rolling_sma_window_array = find_rolling_sma_window(pkt_sent_array)
-df_array = read_files(files_array)
-df_array=filter_packets(df_array,stream_index)
-df_array=set_retransmission_values(df_array)
-df_array=find_packet_loss(df_array)
+# legend label of every run: first fields of its file name and its position
+labels = [experiments.label(filename, LABEL_RIGHT_LIMIT, i + 1) for i, filename in enumerate(files_array)]
+if remove_from_plot_metadata:
+    hidden = set(experiments.select(**remove_from_plot_metadata))
+    remove_from_plot.extend(i for i, filename in enumerate(files_array) if filename in hidden)
+# every file is analyzed in a worker process (see pcapcsv_metrics.py), only the compact results come back:
+# per second series, event window values and decimated plot series. Raw packets never reach this process.
+analysis_config = {'usecols': desired_df_columns,
+                   'test_duration': TEST_DURATION,
+                   'steady_index': STEADY_INDEX,
+                   'rolling_factor': ROLLING_FACTOR,
+                   'rolling_factor_time_delta': ROLLING_FACTOR_TIME_DELTA,
+                   'rolling_factor_rtt_ack': ROLLING_FACTOR_RTT_ACK,
+                   'rolling_factor_loss': ROLLING_FACTOR_LOSS,
+                   'marker_every_s': MARKER_EVERY_S,
+                   # min and max of every pixel column of the widest figure (legend outside the axes)
+                   'max_plot_points': 4 * pixel_columns(1.3 * PIXEL_W * px, DPI),
+                   'bin_width': BIN_WIDTH,
+                   'multi_stream': MULTI_STREAM,
+                   # rows per chunk for captures that do not fit in memory (same results, see ChunkedRun)
+                   'chunk_rows': parameters.get("analysis_chunk_rows")}
+results = analyze_files(files_array, path, analysis_config, workers=parameters.get("analysis_workers"))
+stream_index = [result['stream_index'] for result in results]
+pkt_sent_array = [result['pkt_sent'] for result in results]
+rolling_sma_window_array = [result['rolling_sma_window'] for result in results]
+# per run summary values (loss and link unavailability per event window, stream statistics) are kept in
+# <path>/.pcapcsv_cache/tcp.summary.jsonl; the boxplots read them from there. Run pcapcsv_summary.py to update the
+# summaries of a sweep (only new or changed runs are analyzed) without plotting the time series.
+summary = summary_table(update_summary(path, results, analysis_config), files_array)
 
 #df_array[0]['tcp.time_relative']=df_array[0]['tcp.time_relative']-1
 '''
@@ -264,25 +203,16 @@ print('-------plotting-------')
 # -----------------------------------
 #fig1,ax1 = plt.subplots(figsize=(PIXEL_W*px, PIXEL_H*px))
 fig1,ax1 = plt.subplots(figsize=(WIDTH,HEIGHT),dpi=DPI)
-for i, df in enumerate(df_array):
+for i, result in enumerate(results):
     if i not in remove_from_plot:
+        x, y, markevery = result['series']['ack_rtt']
         ax1.plot(
-            df[(df['tcp.time_relative'].notna()) & (df['tcp.analysis.ack_rtt'].notna()) & (df['tcp.srcport']==5201)]['tcp.time_relative'],
-            df[(df['tcp.time_relative'].notna())
-               & (df['tcp.analysis.ack_rtt'].notna())
-               & (df['tcp.srcport']==5201)]
-            ['tcp.analysis.ack_rtt'].ewm
-                            (
-                                span=int(len(df[(df['tcp.time_relative'].notna())
-                                   & (df['tcp.analysis.ack_rtt'].notna())
-                                   & (df['tcp.srcport']==5201)])/TEST_DURATION/ROLLING_FACTOR_RTT_ACK)
-                            ).mean() * ms_scale_factor,
-            label=('$\|$'.join(files_array[i].split(SPLIT_FILENAME_CHAR)[0:LABEL_RIGHT_LIMIT]) + '$\|$'+ str(i+1)),
+            x,
+            y * ms_scale_factor,
+            label=labels[i],
             # https://www.geeksforgeeks.org/how-to-add-markers-to-a-graph-plot-in-matplotlib-with-python/
             marker=markers[i%len(markers)],
-            markevery=MARKER_EVERY_S*int(len(df[(df['tcp.time_relative'].notna())
-                                   & (df['tcp.analysis.ack_rtt'].notna())
-                                   & (df['tcp.srcport']==5201)])/TEST_DURATION),
+            markevery=markevery,
             markersize=MARKER_SIZE
         )
         #print("rolling sma: " + str(rolling_sma_window_array[i]))
@@ -323,22 +253,16 @@ ax1.grid(which='minor', color='#CCCCCC', linestyle=':')
 # plot TCP window size, vertical axis in KB.
 # -----------------------------------
 fig1,ax1 = plt.subplots(figsize=(WIDTH,HEIGHT),dpi=DPI)
-for i, df in enumerate(df_array):
+for i, result in enumerate(results):
     if i not in remove_from_plot:
+        x, y, markevery = result['series']['window_size']
         ax1.plot(
-            df[(df['tcp.time_relative'].notna()) & (df['tcp.analysis.ack_rtt'].notna()) & (df['tcp.srcport']==5201)]['tcp.time_relative'],
-             df[(df['tcp.time_relative'].notna())
-                       & (df['tcp.analysis.ack_rtt'].notna())
-                       & (df['tcp.srcport']==5201)]['tcp.window_size'].rolling
-                 (
-                    int(len(df[(df['tcp.time_relative'].notna())
-                    & (df['tcp.analysis.ack_rtt'].notna())
-                    & (df['tcp.srcport'] == 5201)]) / TEST_DURATION / ROLLING_FACTOR_RTT_ACK)
-                 ).mean() / kbps_scale_factor ,
-            label=('$\|$'.join(files_array[i].split(SPLIT_FILENAME_CHAR)[0:LABEL_RIGHT_LIMIT]) + '$\|$'+ str(i+1)),
+            x,
+            y / kbps_scale_factor ,
+            label=labels[i],
             # https://www.geeksforgeeks.org/how-to-add-markers-to-a-graph-plot-in-matplotlib-with-python/
             marker=markers[i%len(markers)],
-            markevery=MARKER_EVERY_S*rolling_sma_window_array[i],
+            markevery=markevery,
             markersize=MARKER_SIZE
         )
 ax1.set(title=(filename + " - Rcv Window size"),
@@ -374,26 +298,18 @@ ax1.grid(which='minor', color='#CCCCCC', linestyle=':')
 # plot TCP bytes in flight, vertical axis in KB.
 # -----------------------------------
 fig1,ax1 = plt.subplots(figsize=(WIDTH,HEIGHT),dpi=DPI)
-for i, df in enumerate(df_array):
+for i, result in enumerate(results):
     if i not in remove_from_plot:
+        x, y, markevery = result['series']['bytes_in_flight']
         ax1.plot(
-            df[(df['tcp.time_relative'].notna()) & (df['tcp.analysis.bytes_in_flight'].notna()) & (df['tcp.dstport']==5201)]['tcp.time_relative'],
-             df[(df['tcp.time_relative'].notna())
-                       & (df['tcp.analysis.bytes_in_flight'].notna())
-                       & (df['tcp.dstport']==5201)]['tcp.analysis.bytes_in_flight'].rolling
-                 (
-                    int(len(df[(df['tcp.time_relative'].notna())
-                    & (df['tcp.analysis.bytes_in_flight'].notna())
-                    & (df['tcp.dstport'] == 5201)]) / TEST_DURATION / ROLLING_FACTOR_RTT_ACK)
-                 ).mean() / kbps_scale_factor ,
-            label=('$\|$'.join(files_array[i].split(SPLIT_FILENAME_CHAR)[0:LABEL_RIGHT_LIMIT]) + '$\|$'+ str(i+1)),
+            x,
+            y / kbps_scale_factor ,
+            label=labels[i],
             # https://www.geeksforgeeks.org/how-to-add-markers-to-a-graph-plot-in-matplotlib-with-python/
             marker=markers[i%len(markers)],
-            markevery=MARKER_EVERY_S*rolling_sma_window_array[i],
+            markevery=markevery,
             markersize=MARKER_SIZE
         )
-print("len bytes in flight: "
-      + str(len(df[(df['tcp.time_relative'].notna()) & (df['tcp.analysis.bytes_in_flight'].notna()) & (df['tcp.dstport']==5201)]['tcp.time_relative'])))
 ax1.set(title=(filename + " - Bytes sent"),
         xlabel="Time [s]",
         ylabel="Bytes sent (KB)",
@@ -422,27 +338,23 @@ ax1.grid(which='minor', color='#CCCCCC', linestyle=':')
 
 
 '''
-#tricky, ack_rtt and bytes_in_flight are not in the same index of time_relative. Need to interpolate. 
-#Calculated throughput is not the same as the one calculated with other throughput plot. 
+#ack_rtt and bytes_in_flight are not in the same index of time_relative. The worker joins them as-of on a fixed
+#time grid (pcapcsv_metrics.bif_rtt_throughput). Calculated throughput is not the same as the one calculated with other throughput plot.
 # -----------------------------------
 # plot throughput v1 bytes in flight / rtt
 # -----------------------------------
 fig1,ax1 = plt.subplots(figsize=(WIDTH,HEIGHT),dpi=DPI)
-for i, df in enumerate(df_array):
+for i, result in enumerate(results):
     if i not in remove_from_plot:
+        # 8 * mean(bytes in flight) / mean(ACK RTT) on a 1 ms grid, window of 1/ROLLING_FACTOR_TIME_DELTA seconds
+        x, y, markevery = result['series']['bif_throughput']
         ax1.plot(
-            #df[(df['tcp.time_relative'].notna()) & (df['tcp.analysis.ack_rtt'].notna()) & (df['tcp.srcport']==5201)]['tcp.time_relative'],
-            #8* df[(df['tcp.time_relative'].notna())
-            #           & (df['tcp.analysis.ack_rtt'].notna())
-            #           & (df['tcp.srcport']==5201)]['tcp.window_size'].rolling(int(rolling_sma_window_array[i] / ROLLING_FACTOR_TIME_DELTA)).mean() / kbps_scale_factor ,
-            df['tcp.time_relative'],
-            8 * ((df['tcp.analysis.bytes_in_flight'].interpolate(method='linear',maxgap=2).ewm(span=int(rolling_sma_window_array[i] / ROLLING_FACTOR_TIME_DELTA)).mean())/
-                 (df['tcp.analysis.ack_rtt'].interpolate(method='linear',maxgap=2).ewm(span=int(rolling_sma_window_array[i] / ROLLING_FACTOR_TIME_DELTA)).mean())) /
-                 Gbs_scale_factor,
-            label=('$\|$'.join(files_array[i].split(SPLIT_FILENAME_CHAR)[0:LABEL_RIGHT_LIMIT]) + '$\|$'+ str(i+1)),
+            x,
+            y / Gbs_scale_factor,
+            label=labels[i],
             # https://www.geeksforgeeks.org/how-to-add-markers-to-a-graph-plot-in-matplotlib-with-python/
             marker=markers[i%len(markers)],
-            markevery=MARKER_EVERY_S*rolling_sma_window_array[i],
+            markevery=markevery,
             markersize=MARKER_SIZE
         )
 
@@ -476,15 +388,16 @@ ax1.grid(which='minor', color='#CCCCCC', linestyle=':')
 # plot tcp.time_delta, iperf data rate, vertical axis in ms.
 # -----------------------------------
 fig1,ax1 = plt.subplots(figsize=(WIDTH,HEIGHT),dpi=DPI)
-for i, df in enumerate(df_array):
+for i, result in enumerate(results):
     if i not in remove_from_plot:
+        x, y, markevery = result['series']['time_delta']
         ax1.plot(
-            df[df['tcp.time_relative'].notna()]['tcp.time_relative'],
-            df[df['tcp.time_relative'].notna()]['tcp.time_delta'].rolling(int(rolling_sma_window_array[i]/ROLLING_FACTOR_TIME_DELTA)).mean() * ms_scale_factor,
-            label=('$\|$'.join(files_array[i].split(SPLIT_FILENAME_CHAR)[0:LABEL_RIGHT_LIMIT]) + '$\|$'+ str(i+1)),
+            x,
+            y * ms_scale_factor,
+            label=labels[i],
             # https://www.geeksforgeeks.org/how-to-add-markers-to-a-graph-plot-in-matplotlib-with-python/
             marker=markers[i%len(markers)],
-            markevery=MARKER_EVERY_S*rolling_sma_window_array[i],
+            markevery=markevery,
             markersize=MARKER_SIZE
         )
 ax1.set(title=(filename + " - Packet $\Delta$t"),
@@ -518,16 +431,16 @@ ax1.grid(which='minor', color='#CCCCCC', linestyle=':')
 # -----------------------------------
 fig1,ax1 = plt.subplots(figsize=(WIDTH,HEIGHT),dpi=DPI)
 # plt.scatter(df2['tcp.time_relative'], 8*(df2['tcp.len'].rolling(1000).mean()))
-for i, df in enumerate(df_array):
+for i, result in enumerate(results):
     if i not in remove_from_plot:
-        #plt.scatter(df['tcp.time_relative'], (df['tcp.len']), label='test ' + str(i))
+        x, y, markevery = result['series']['payload']
         ax1.plot(
-            df[df['tcp.time_relative'].notna()]['tcp.time_relative'],
-            (df[df['tcp.time_relative'].notna()]['tcp.len'].rolling(rolling_sma_window_array[i]).mean() / kbps_scale_factor),
+            x,
+            y / kbps_scale_factor,
             #label=files_array[i]
-            label=('$\|$'.join(files_array[i].split(SPLIT_FILENAME_CHAR)[0:LABEL_RIGHT_LIMIT]) + '$\|$' + str(i+1)),
+            label=labels[i],
             marker=markers[i % len(markers)],
-            markevery=MARKER_EVERY_S * rolling_sma_window_array[i],
+            markevery=markevery,
             markersize=MARKER_SIZE
         )
 ax1.set(title=(filename + " - TCP payload size"),
@@ -563,11 +476,12 @@ ax1.grid(which='minor', color='#CCCCCC', linestyle=':')
 # -----------------------------------
 plt.figure()
 # plt.scatter(df2['tcp.time_relative'], 8*(df2['tcp.len'].rolling(1000).mean()))
-for i, df in enumerate(df_array):
+for i, result in enumerate(results):
     if i not in remove_from_plot:
-        plt.scatter(df['tcp.time_relative'], (df['tcp.len']),
+        x, y, _ = result['series']['segment_length']
+        plt.scatter(x, y,
                     #label=files_array[i]
-                    label=('$\|$'.join(files_array[i].split(SPLIT_FILENAME_CHAR)[0:LABEL_RIGHT_LIMIT]) + '$\|$' + str(i+1))
+                    label=labels[i]
                     )
         #plt.plot(
         #    df[df['tcp.time_relative'].notna()]['tcp.time_relative'],
@@ -591,19 +505,16 @@ plt.legend(loc='lower left')
 fig1,ax1 = plt.subplots(figsize=(WIDTH,HEIGHT),dpi=DPI)
 # create a new entry in the dataframe for the throughput with Moving Average
 # https://www.geeksforgeeks.org/how-to-calculate-moving-average-in-a-pandas-dataframe/
-for i, df in enumerate(df_array):
+for i, result in enumerate(results):
     if i not in remove_from_plot:
+        # 8 * sum(tcp.len) / sum(tcp.time_delta) over a time window of 1/ROLLING_FACTOR seconds
+        x, y, markevery = result['series']['throughput']
         ax1.plot(
-            df[df['tcp.time_relative'].notna()]['tcp.time_relative'],
-            #8 * ((df[df['tcp.time_relative'].notna()]['tcp.len'].rolling(int(rolling_sma_window_array[i]/ROLLING_FACTOR)).mean()) /
-            #    (df[df['tcp.time_relative'].notna()]['tcp.time_delta'].rolling(int(rolling_sma_window_array[i]/ROLLING_FACTOR)).mean())) / Gbs_scale_factor,
-            8 * ((df[df['tcp.time_relative'].notna()]['tcp.len'].ewm(span=int(rolling_sma_window_array[i]/ROLLING_FACTOR)).mean()) /
-              (df[df['tcp.time_relative'].notna()]['tcp.time_delta'].ewm(span=int(rolling_sma_window_array[i]/ROLLING_FACTOR)).mean())) / Gbs_scale_factor,
-            #8 * ((df[df['tcp.time_relative'].notna()]['tcp.len'].ewm(alpha=ALPHA).mean()) /
-            #     (df[df['tcp.time_relative'].notna()]['tcp.time_delta'].ewm(alpha=ALPHA).mean())) / Gbs_scale_factor,
-            label=('$\|$'.join(files_array[i].split(SPLIT_FILENAME_CHAR)[0:LABEL_RIGHT_LIMIT]) + '$\|$' + str(i+1)),
+            x,
+            y / Gbs_scale_factor,
+            label=labels[i],
             marker=markers[i % len(markers)],
-            markevery=MARKER_EVERY_S * rolling_sma_window_array[i],
+            markevery=markevery,
             markersize=MARKER_SIZE
         )
 
@@ -637,13 +548,13 @@ ax1.grid(which='minor', color='#CCCCCC', linestyle=':')
 # plot link unavailability based on discontinuities of TCP segment length data
 # -----------------------------------
 fig1,ax1 = plt.subplots(figsize=(WIDTH,HEIGHT),dpi=DPI)
-for i, df in enumerate(df_array):
-    df['link_unavailable'] = df['tcp.time_relative'].diff()
+for i, result in enumerate(results):
     if i not in remove_from_plot:
-        # .diff returns the difference between previous row by default, useful to find all the discontinuities in time
-        ax1.plot(df['tcp.time_relative'],
-                    df['link_unavailable'],
-                    label=('$\|$'.join(files_array[i].split(SPLIT_FILENAME_CHAR)[0:LABEL_RIGHT_LIMIT]) + '$\|$' + str(i+1)),
+        # tcp.time_relative.diff(), only the gaps above the lower ylim are kept by the worker
+        x, y, _ = result['series']['link_unavailable']
+        ax1.plot(x,
+                    y,
+                    label=labels[i],
                     marker=markers[i % len(markers)],
                     markersize=MARKER_SIZE
                     )
@@ -675,42 +586,11 @@ ax1.grid(which='minor', color='#CCCCCC', linestyle=':')
 # =============================================================================================================================
 # Calculate packets sent, tcp.analysis.retransmissions and packet loss ratio
 
-pkt_sent_array_series = []
-pkt_retransmit_array_series = []
-pkt_loss_ratio_array_series = []
-link_unavailable_array_series = []
-for i, df in enumerate(df_array):
-    # now group tcp.analysis.retransmissions each second.
-    # convert time index to integer
-    # https://www.geeksforgeeks.org/convert-floats-to-integers-in-a-pandas-dataframe/
-    print('calculating packet loss on df: ' + str(i))
-    # drop na values on the column that we are going to convert to integer
-    # https://stackoverflow.com/questions/13413590/how-to-drop-rows-of-pandas-dataframe-whose-value-in-a-certain-column-is-nan
-    df = df[df['tcp.time_relative'].notna()]
-    df['tcp.time_relative'] = df['tcp.time_relative'].astype(int)
-    # print(df.keys())
-    # print(df['tcp.analysis.retransmission'].unique())
-
-    # convert tcp.analysis.retransmissions column to int
-    # first element should be NaN for not tcp.analysis.retransmission
-    df['tcp.analysis.retransmission'] = df['tcp.analysis.retransmission'].replace(df['tcp.analysis.retransmission'].unique()[0], 0)
-    try:
-        # second element should be a weird string of len 9, for tcp.analysis.retransmission
-        df['tcp.analysis.retransmission'] = df['tcp.analysis.retransmission'].replace(df['tcp.analysis.retransmission'].unique()[1], 1)
-    except:
-        print('No tcp.analysis.retransmissions found')
-
-    # count all the packets, no matter if lost or sent successfully.
-    pkt_sent = df.groupby('tcp.time_relative')['tcp.analysis.retransmission'].count()
-    #print('pkt sent mean: ' + str(pkt_sent.mean())) #for debugging purposes
-    pkt_sent_array_series.append(pkt_sent)
-    # add all the tcp.analysis.retransmissions per second, as a metric for packet loss
-    pkt_retransmit = df.groupby('tcp.time_relative')['tcp.analysis.retransmission'].sum()
-    #pkt_retransmit = df[df['tcp.analysis.retransmission']==1].groupby('tcp.time_relative')['tcp.analysis.retransmission'].count()
-    pkt_retransmit_array_series.append(pkt_retransmit)
-    # calculate the packet loss metric
-    pkt_loss_ratio_array_series.append(100 * pkt_retransmit / pkt_sent)
-    #pkt_loss_ratio_array_series.append(100 * pkt_retransmit / rolling_sma_window_array[i])
+# per second counters are computed by the workers (one bincount per counter, pcapcsv_bins.py): packets sent,
+# retransmissions, and their ratio. result['bins'] holds the same counters in BIN_WIDTH bins.
+pkt_sent_array_series = [result['pkt_sent'] for result in results]
+pkt_retransmit_array_series = [result['pkt_retransmit'] for result in results]
+pkt_loss_ratio_array_series = [result['pkt_loss_ratio'] for result in results]
 
 
 # Now plot the results.
@@ -724,7 +604,7 @@ for i, pkt_sent in enumerate(pkt_sent_array_series):
     if i not in remove_from_plot:
         plt.plot(pkt_sent,
                  #label=files_array[i]
-                 label=('$\|$'.join(files_array[i].split(SPLIT_FILENAME_CHAR)[0:LABEL_RIGHT_LIMIT]) + '$\|$' + str(i+1)),
+                 label=labels[i],
                  marker=markers[i % len(markers)],
                  markevery=MARKER_EVERY_S ,
                  markersize=MARKER_SIZE
@@ -748,7 +628,7 @@ for i, pkt_retransmit in enumerate(pkt_retransmit_array_series):
     if i not in remove_from_plot:
         plt.plot(pkt_retransmit,
                  #label=files_array[i]
-                 label=('$\|$'.join(files_array[i].split(SPLIT_FILENAME_CHAR)[0:LABEL_RIGHT_LIMIT]) + '$\|$' + str(i+1)),
+                 label=labels[i],
                  marker=markers[i % len(markers)],
                  markevery=MARKER_EVERY_S,
                  markersize=MARKER_SIZE
@@ -769,7 +649,7 @@ for i, pkt_loss_ratio in enumerate(pkt_loss_ratio_array_series):
     if i not in remove_from_plot:
         ax1.plot(pkt_loss_ratio,
                  #label=files_array[i]
-                 label=('$\|$'.join(files_array[i].split(SPLIT_FILENAME_CHAR)[0:LABEL_RIGHT_LIMIT]) + '$\|$' + str(i+1)),
+                 label=labels[i],
                  marker=markers[i % len(markers)],
                  markevery=MARKER_EVERY_S,
                  markersize=MARKER_SIZE
@@ -799,6 +679,84 @@ else:
 ax1.grid(which='major', color='#a3a3a3', linestyle='--')
 ax1.grid(which='minor', color='#CCCCCC', linestyle=':')
 
+# -----------------------------------
+# Plot goodput in BIN_WIDTH bins around the reconfiguration, 1 s bins hide effects of tens of ms
+# -----------------------------------
+fig1,ax1 = plt.subplots(figsize=(WIDTH,HEIGHT),dpi=DPI)
+for i, result in enumerate(results):
+    if i not in remove_from_plot:
+        bins = result['bins']
+        ax1.plot(bins.index,
+                 bins['goodput'] / Gbs_scale_factor,
+                 label=labels[i],
+                 marker=markers[i % len(markers)],
+                 markevery=max(1, int(MARKER_EVERY_S / 20 / BIN_WIDTH)),
+                 markersize=MARKER_SIZE
+                 )
+ax1.set(title=(filename + " - Goodput, " + str(int(BIN_WIDTH * ms_scale_factor)) + " ms bins"),
+        xlabel="Time [s]",
+        ylabel="Goodput [Gbps]",
+        ylim=[BOTTOM_BW_AXIS,TOP_BW_AXIS],
+        xlim=[RECONFIGURATION-1,RECONFIGURATION+1],
+        )
+fig1.set_tight_layout(True)
+ax1.xaxis.set_major_locator(MultipleLocator(0.5))
+ax1.yaxis.set_major_locator(MultipleLocator(2))
+ax1.xaxis.set_minor_locator(AutoMinorLocator(5))
+ax1.yaxis.set_minor_locator(AutoMinorLocator(5))
+if len(files_array)>2:
+    # Shrink current axis by 20%
+    fig1.set_figwidth(1.3 * PIXEL_W * px)
+    box = ax1.get_position()
+    ax1.set_position([box.x0, box.y0, box.width * 0.7, box.height])
+    ax1.legend(loc='center left', bbox_to_anchor=(1, 0.5))
+else:
+    ax1.legend(loc='lower right')
+ax1.grid(which='major', color='#a3a3a3', linestyle='--')
+ax1.grid(which='minor', color='#CCCCCC', linestyle=':')
+
+# -----------------------------------
+# Plot throughput per second of every parallel flow (dashed) and of all flows together (solid)
+# -----------------------------------
+if MULTI_STREAM:
+    fig1,ax1 = plt.subplots(figsize=(WIDTH,HEIGHT),dpi=DPI)
+    for i, result in enumerate(results):
+        if i not in remove_from_plot:
+            label = labels[i]
+            aggregate = result['aggregate']['metrics']
+            line, = ax1.plot(aggregate.index,
+                             aggregate['throughput'] / Gbs_scale_factor,
+                             label=label,
+                             marker=markers[i % len(markers)],
+                             markevery=MARKER_EVERY_S,
+                             markersize=MARKER_SIZE
+                             )
+            for stream, stream_result in result['streams'].items():
+                ax1.plot(stream_result['metrics'].index,
+                         stream_result['metrics']['throughput'] / Gbs_scale_factor,
+                         label=label + ' stream ' + str(stream),
+                         color=line.get_color(),
+                         linestyle='--'
+                         )
+    ax1.set(title=(filename + " - Throughput per flow"),
+            xlabel="Time [s]",
+            ylabel="Throughput [Gbps]",
+            ylim=[BOTTOM_BW_AXIS,TOP_BW_AXIS],
+            xlim=[1,TEST_DURATION-1],
+            )
+    fig1.set_tight_layout(True)
+    ax1.xaxis.set_major_locator(MultipleLocator(XAXIS_LOCATOR))
+    ax1.yaxis.set_major_locator(MultipleLocator(2))
+    ax1.xaxis.set_minor_locator(AutoMinorLocator(5))
+    ax1.yaxis.set_minor_locator(AutoMinorLocator(5))
+    # Shrink current axis by 20%, one legend entry per flow
+    fig1.set_figwidth(1.3 * PIXEL_W * px)
+    box = ax1.get_position()
+    ax1.set_position([box.x0, box.y0, box.width * 0.7, box.height])
+    ax1.legend(loc='center left', bbox_to_anchor=(1, 0.5))
+    ax1.grid(which='major', color='#a3a3a3', linestyle='--')
+    ax1.grid(which='minor', color='#CCCCCC', linestyle=':')
+
 '''
 plt.figure()
 #plot with stem
@@ -806,7 +764,7 @@ for i, pkt_loss_ratio in enumerate(pkt_loss_ratio_array_series):
     if i not in remove_from_plot:
         plt.stem(pkt_loss_ratio,
                  #label=files_array[i]
-                 label=('$\|$'.join(files_array[i].split(SPLIT_FILENAME_CHAR)[0:LABEL_RIGHT_LIMIT]) + '$\|$' + str(i+1)),
+                 label=labels[i],
                  #marker=markers[i % len(markers)],
                  #markevery=MARKER_EVERY_S,
                  #markersize=MARKER_SIZE
@@ -825,24 +783,19 @@ plt.legend(loc='upper left')
 # -----------------------------------
 fig1,ax1 = plt.subplots(figsize=(WIDTH,HEIGHT),dpi=DPI)
 df_loss=[[],[],[],[]]
-for i, pkt_loss_ratio in enumerate(pkt_loss_ratio_array_series):
+# steady state, then the max per second loss of t=4..6 (mbb 1), t=9..11 (optical reconfiguration) and t=14..16 (mbb 2)
+for i, file in enumerate(files_array):
     #if i not in remove_from_plot:
-    try:
-        df_loss[0].append(pkt_loss_ratio[STEADY_INDEX])  # steady state
-        if 'mbb' in files_array[i]:
-            #single
-            #df_loss[1].append(pkt_loss_ratio[5])  # make_before_break 1
-            #df_loss[3].append(pkt_loss_ratio[15]) # make_before_break 2
-            #df_loss[2].append(pkt_loss_ratio[10])  # optical reconfiguration
-            #dual
-            df_loss[1].append(max(pkt_loss_ratio[4],pkt_loss_ratio[5],pkt_loss_ratio[6]))  # make_before_break 1
-            df_loss[3].append(max(pkt_loss_ratio[14],pkt_loss_ratio[15],pkt_loss_ratio[16])) # make_before_break 2
-            df_loss[2].append(max(pkt_loss_ratio[9],pkt_loss_ratio[10],pkt_loss_ratio[11]))  # optical reconfiguration
-        else:
-            #if max(pkt_loss_ratio[9],pkt_loss_ratio[10],pkt_loss_ratio[11]) <20:
-            df_loss[2].append(max(pkt_loss_ratio[9],pkt_loss_ratio[10],pkt_loss_ratio[11]))  # optical reconfiguration
-    except:
+    row = summary.loc[file]
+    if 'mbb' in file:
+        windows = [(0, 'loss_steady'), (1, 'loss_mbb1'), (2, 'loss_reconfiguration'), (3, 'loss_mbb2')]
+    else:
+        windows = [(0, 'loss_steady'), (2, 'loss_reconfiguration')]
+    if any(pd.isna(row.get(column)) for index, column in windows):
         print('error calculating loss on df'+str(i))
+        continue
+    for index, column in windows:
+        df_loss[index].append(row[column])
 #print('packet loss steady state len: '+str(len(df_loss[0])))
 #print('packet loss optical switch reconfiguration t=10 len: ' + str(len(df_loss[2])))
 if 'mbb' in files_array[0]:
@@ -887,40 +840,22 @@ ax1.grid(which='minor', color='#CCCCCC', linestyle=':')
 # -----------------------------------
 df_link_unavailable=[[],[],[],[]]
 fig1,ax1 = plt.subplots(figsize=(WIDTH,HEIGHT),dpi=DPI)
-for i, df in enumerate(df_array):
+# window maxima come from the summary store (pcapcsv_metrics.LINK_WINDOWS_MBB / LINK_WINDOWS), empty when the
+# window has no gap above its threshold
+for i, file in enumerate(files_array):
     #if i not in remove_from_plot:
-    df = df[df['tcp.time_relative'].notna()] # very important line. Otherwise an exception can be raised.
-    df['tcp.time_relative'] = df['tcp.time_relative'].astype(int)
-    # print(df[['tcp.time_relative', 'link_unavailable']]) #for debugging purposes
-    df_link_unavailable[0].extend(df[(df['tcp.time_relative'] == STEADY_INDEX) & (df['link_unavailable']>0.006)]['link_unavailable'])  # steady state, bypass sampling rate
-
-    if 'mbb' in files_array[i]:
-        #single
-        #df_link_unavailable[1].extend(df[(df['tcp.time_relative']==5)  & (df['link_unavailable']>0.03)]['link_unavailable'])  # make_before_break 1
-        #df_link_unavailable[3].extend(df[(df['tcp.time_relative']==15) & (df['link_unavailable']>0.005) & (df['link_unavailable']<0.2)]['link_unavailable']) # make_before_break 2
-        #df_link_unavailable[2].extend(df[(df['tcp.time_relative'] == 10) & (df['link_unavailable'] > 0.005)]['link_unavailable'])  # optical reconfiguration, bypass sampling rate
-        #dual (bandwidth steering)
-        try:
-            df_link_unavailable[1].append(max(df[(df['tcp.time_relative']>=4)  & (df['tcp.time_relative']<=6)  & (df['link_unavailable']>0.03)]['link_unavailable']))  # make_before_break 1
-        except:
-            print('error on link unavailable mbb 1')
-        try:
-            df_link_unavailable[3].append(max(df[(df['tcp.time_relative']>=14) & (df['tcp.time_relative']<=16) & (df['link_unavailable']>0.005) & (df['link_unavailable']<0.2)]['link_unavailable'])) # make_before_break 2
-        except:
-            print('error on link unavailable mbb 2')
-        try:
-            df_link_unavailable[2].append(max(df[(df['tcp.time_relative']>=9) & (df['tcp.time_relative']<=11) & (df['link_unavailable'] > 0.005)]['link_unavailable']))  # optical reconfiguration, bypass sampling rate
-        except:
-            print('error on link unavailable ost 1')
-    else:
-        try:
-            df_link_unavailable[2].append(max(df[(df['tcp.time_relative'] >=9) & (df['tcp.time_relative'] <= 11) & (df['link_unavailable'] > 0.006)]['link_unavailable']))  # optical reconfiguration, bypass sampling rate
-        except:
-            print ("df link unavailable error")
-    #print(max(df[(df['tcp.time_relative'] >=9) & (df['tcp.time_relative'] <= 11) & (df['link_unavailable'] > 0.005)]['link_unavailable']))
-    #df_link_unavailable[1].extend(df[(df['tcp.time_relative'] ==  5)]['link_unavailable'])  # make_before_break 1
-    #df_link_unavailable[2].extend(df[(df['tcp.time_relative'] == 10)]['link_unavailable'])  # optical reconfiguration
-    #df_link_unavailable[3].extend(df[(df['tcp.time_relative'] == 15)]['link_unavailable'])  # make_before_break 2
+    row = summary.loc[file]
+    df_link_unavailable[0].extend(row['gaps_steady'])  # steady state, bypass sampling rate
+    mbb = 'mbb' in file
+    for index, name, error in [(1, 'mbb1', 'error on link unavailable mbb 1'),
+                               (2, 'reconfiguration', 'error on link unavailable ost 1' if mbb else "df link unavailable error"),
+                               (3, 'mbb2', 'error on link unavailable mbb 2')]:
+        if not mbb and name != 'reconfiguration':
+            continue
+        if pd.isna(row.get('max_gap_' + name)):
+            print(error)
+        else:
+            df_link_unavailable[index].append(row['max_gap_' + name])
 
 #print("link unavailable steady state len: "+ str(len(df_link_unavailable[0]))) #for debugging purposes
 #print("link unavailable t=10 len: "+ str(len(df_link_unavailable[2]))) #for debugging purposes
@@ -971,14 +906,14 @@ ax1.grid(which='minor', color='#CCCCCC', linestyle=':')
 # Plot calculated throughput as packets sent * TCP Window size
 # -----------------------------------
 plt.figure()
-for i, pkt_sent in enumerate(pkt_sent_array_series):
+for i, result in enumerate(results):
     if i not in remove_from_plot:
         #plt.plot(pkt_sent * TCP_WINDOW_SIZE * 8 / Gbs_scale_factor / 2, label=files_array[i])
 
-        #updated formula: pkt_sent (packets/second) * effective TCP length (KBytes/packet) * 8 (bits/Byte) / Gbs_scale_factor
-        plt.plot(pkt_sent * (df[df['tcp.time_relative'].notna()]['tcp.len'].rolling(rolling_sma_window_array[i]).mean()).mean() * 8 / Gbs_scale_factor ,
+        #updated formula: payload bytes sent per second * 8 (bits/Byte) / Gbs_scale_factor
+        plt.plot(result['metrics']['throughput'] / Gbs_scale_factor ,
                  #label=files_array[i]
-                 label=('$\|$'.join(files_array[i].split(SPLIT_FILENAME_CHAR)[0:LABEL_RIGHT_LIMIT]) + '$\|$' + str(i+1)),
+                 label=labels[i],
                  marker=markers[i % len(markers)],
                  markevery=MARKER_EVERY_S,
                  markersize=MARKER_SIZE
@@ -999,14 +934,15 @@ plt.legend(loc='lower left')
 plt.figure(figsize=(PIXEL_W*px, PIXEL_H*px))
 # create a new entry in the dataframe for the throughput with Moving Average
 # https://www.geeksforgeeks.org/how-to-calculate-moving-average-in-a-pandas-dataframe/
-for i, df in enumerate(df_array):
+for i, result in enumerate(results):
     if i not in remove_from_plot:
+        x, y, markevery = result['series']['loss']
         plt.plot(
-            df[df['tcp.time_relative'].notna()]['tcp.time_relative'],
-            df[df['tcp.time_relative'].notna()]['loss'],
-            label=('$\|$'.join(files_array[i].split(SPLIT_FILENAME_CHAR)[0:LABEL_RIGHT_LIMIT]) + '$\|$' + str(i+1)),
+            x,
+            y,
+            label=labels[i],
             marker=markers[i % len(markers)],
-            markevery=MARKER_EVERY_S * rolling_sma_window_array[i],
+            markevery=markevery,
             markersize=MARKER_SIZE
         )
 
@@ -1027,14 +963,15 @@ plt.legend(loc='lower right')
 plt.figure(figsize=(PIXEL_W*px, PIXEL_H*px))
 # create a new entry in the dataframe for the throughput with Moving Average
 # https://www.geeksforgeeks.org/how-to-calculate-moving-average-in-a-pandas-dataframe/
-for i, df in enumerate(df_array):
+for i, result in enumerate(results):
     if i not in remove_from_plot:
+        x, y, markevery = result['series']['retransmit']
         plt.plot(
-            df[df['tcp.time_relative'].notna()]['tcp.time_relative'],
-            df[df['tcp.time_relative'].notna()]['tcp.analysis.retransmission'].rolling(int(rolling_sma_window_array[i] / ROLLING_FACTOR_LOSS)).sum(),
-            label=('$\|$'.join(files_array[i].split(SPLIT_FILENAME_CHAR)[0:LABEL_RIGHT_LIMIT]) + '$\|$' + str(i+1)),
+            x,
+            y,
+            label=labels[i],
             marker=markers[i % len(markers)],
-            markevery=MARKER_EVERY_S * rolling_sma_window_array[i],
+            markevery=markevery,
             markersize=MARKER_SIZE
         )
 
@@ -1056,14 +993,15 @@ plt.legend(loc='lower right')
 plt.figure(figsize=(PIXEL_W*px, PIXEL_H*px))
 # create a new entry in the dataframe for the throughput with Moving Average
 # https://www.geeksforgeeks.org/how-to-calculate-moving-average-in-a-pandas-dataframe/
-for i, df in enumerate(df_array):
+for i, result in enumerate(results):
     if i not in remove_from_plot:
+        x, y, markevery = result['series']['sent']
         plt.plot(
-            df[df['tcp.time_relative'].notna()]['tcp.time_relative'],
-            df[df['tcp.time_relative'].notna()]['tcp.time_relative'].rolling(int(rolling_sma_window_array[i] / ROLLING_FACTOR_LOSS)).count(),
-            label=('$\|$'.join(files_array[i].split(SPLIT_FILENAME_CHAR)[0:LABEL_RIGHT_LIMIT]) + '$\|$' + str(i+1)),
+            x,
+            y,
+            label=labels[i],
             marker=markers[i % len(markers)],
-            markevery=MARKER_EVERY_S * rolling_sma_window_array[i],
+            markevery=markevery,
             markersize=MARKER_SIZE
         )
 
@@ -1123,4 +1061,4 @@ plt.grid('on')
 #plt.legend(loc='upper left')
 '''
 
-plt.show()
+show_or_render()
@@ -0,0 +1,201 @@
+'''
+Time binning kernel for the per interval counters of the analysis scripts.
+
+bin_counters() splits the packets of one run in bins of any width (1 s down to 1 ms) and computes, with one
+np.bincount per counter:
+- packets: packets sent, retransmitted or not
+- bytes: tcp payload bytes
+- retransmissions, lost_segments: packets flagged by tshark
+- loss_ratio: 100 * retransmissions / packets
+- throughput, goodput: bits/s of all payload and of the payload that was not retransmitted
+The result is indexed by the start time of every bin. Bins without packets are dropped unless keep_empty=True
+(short outages then show as zero rows). BinAccumulator keeps the same counters across chunks of a capture read
+piece by piece, plus per bin means and maxima of other columns. GroupedBins computes them for several groups of
+packets at once (e.g. every tcp.stream of a capture), still one np.bincount per counter.
+
+Usage:
+    from pcapcsv_bins import bin_counters
+    from pcapcsv_loader import FLAGS_COLUMN, flag_mask
+    bins = bin_counters(df['tcp.time_relative'], 0.01, length=df['tcp.len'],
+                        retransmission=flag_mask(df[FLAGS_COLUMN], 'tcp.analysis.retransmission'))
+'''
+
+import numpy as np
+import pandas as pd
+
+
+# bin number of every time value, floor((time - origin) / bin_width). The quotient is rounded to 1e-9 bins first:
+# a time on a bin boundary (e.g. 0.07 s with 10 ms bins) can divide to 6.999999999999999 and must not fall in the
+# bin below.
+def time_bins(time, bin_width=1.0, origin=0.0):
+    quotient = (np.asarray(time, dtype=np.float64) - origin) / bin_width
+    return np.floor(np.round(quotient, 9)).astype(np.int64)
+
+
+def _flags(values):
+    values = np.asarray(values)
+    if values.dtype == bool:
+        return values
+    return np.nan_to_num(values.astype(np.float64)) != 0
+
+
+# counters of bin_width bins filled one chunk of packets at a time. Every chunk extends the bin range if needed
+# and adds its np.bincount sums to the carried arrays; means and maxima are accumulated in row order
+# (np.add.at / np.fmax.at), so one chunk or many give the same table.
+class BinAccumulator:
+    def __init__(self, bin_width=1.0, origin=0.0):
+        self.bin_width = bin_width
+        self.origin = origin
+        self.first = None  # bin number of the first carried bin
+        self.sums = {}  # counter name -> sums per bin
+        self.means = {}  # column name -> (sum, count) of the values present per bin
+        self.maxima = {}  # column name -> max per bin, NaN ignored
+
+    def __len__(self):
+        return len(self.sums['packets']) if 'packets' in self.sums else 0
+
+    # bin numbers of time relative to the first carried bin, growing the carried arrays to hold them
+    def _bins(self, time):
+        bins = time_bins(time, self.bin_width, self.origin)
+        if len(bins) == 0:
+            return bins
+        first = int(bins.min()) if self.first is None else min(self.first, int(bins.min()))
+        size = max(int(bins.max()) - first + 1, (self.first - first + len(self)) if self.first is not None else 0)
+        if self.first is None:
+            self.sums['packets'] = np.zeros(size, dtype=np.int64)
+        else:
+            before, after = self.first - first, size - (self.first - first) - len(self)
+            for arrays, fill in ((self.sums, 0), (self.maxima, np.nan)):
+                for name, values in arrays.items():
+                    arrays[name] = np.pad(values, (before, after), constant_values=fill)
+            for name, (total, count) in self.means.items():
+                self.means[name] = (np.pad(total, (before, after)), np.pad(count, (before, after)))
+        self.first = first
+        return bins - first
+
+    def _sum(self, name, bins, weights=None):
+        counts = np.bincount(bins, weights=weights, minlength=len(self))
+        if name not in self.sums:
+            self.sums[name] = np.zeros(len(self), dtype=counts.dtype)
+        self.sums[name] += counts
+
+    # packets, and per given column: bytes and goodput (length), retransmissions, lost segments
+    def add(self, time, length=None, retransmission=None, lost_segment=None):
+        bins = self._bins(time)
+        if len(bins) == 0:
+            return self
+        self._sum('packets', bins)
+        resent = None
+        if retransmission is not None:
+            resent = _flags(retransmission)
+            self._sum('retransmissions', bins, resent.astype(np.int64))
+        if lost_segment is not None:
+            self._sum('lost_segments', bins, _flags(lost_segment).astype(np.int64))
+        if length is not None:
+            length = np.nan_to_num(np.asarray(length, dtype=np.float64))
+            self._sum('bytes', bins, length)
+            if resent is not None:
+                self._sum('goodput_bytes', bins, np.where(resent, 0, length))
+        return self
+
+    # mean of the values present (not NaN) per bin, as column name of the table
+    def add_mean(self, name, time, values):
+        bins = self._bins(time)
+        values = np.asarray(values, dtype=np.float64)
+        if name not in self.means:
+            self.means[name] = (np.zeros(len(self)), np.zeros(len(self), dtype=np.int64))
+        total, count = self.means[name]
+        present = ~np.isnan(values)
+        np.add.at(total, bins[present], values[present])
+        np.add.at(count, bins[present], 1)
+        return self
+
+    # max of the values per bin, NaN ignored, as column name of the table
+    def add_max(self, name, time, values):
+        bins = self._bins(time)
+        if name not in self.maxima:
+            self.maxima[name] = np.full(len(self), np.nan)
+        np.fmax.at(self.maxima[name], bins, np.asarray(values, dtype=np.float64))
+        return self
+
+    # table indexed by the start time of every bin. Bins without packets are dropped unless keep_empty=True.
+    def table(self, keep_empty=False):
+        if self.first is None:
+            return pd.DataFrame(index=pd.Index([], dtype=np.float64, name='time'))
+        index = pd.Index(self.origin + (np.arange(len(self)) + self.first) * self.bin_width, name='time')
+        table = pd.DataFrame({'packets': self.sums['packets']}, index=index)
+        if 'bytes' in self.sums:
+            table['bytes'] = self.sums['bytes'].astype(np.int64)
+        for name in ('retransmissions', 'lost_segments'):
+            if name in self.sums:
+                table[name] = self.sums[name].astype(np.int64)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            if 'retransmissions' in self.sums:
+                table['loss_ratio'] = 100 * table['retransmissions'] / table['packets']
+            if 'bytes' in self.sums:
+                table['throughput'] = 8 * table['bytes'] / self.bin_width
+            if 'goodput_bytes' in self.sums:
+                table['goodput'] = 8 * self.sums['goodput_bytes'] / self.bin_width
+            for name, (total, count) in self.means.items():
+                table[name] = total / count
+        for name, values in self.maxima.items():
+            table[name] = values
+        if not keep_empty:
+            table = table[table['packets'] > 0]
+        return table
+
+
+# BinAccumulator counters of several groups of packets (e.g. tcp streams) in one pass: the group code and the bin
+# number of a packet form one flat key, group * bins per group + bin, so every counter stays a single np.bincount
+# over all packets. group is the code (0 .. groups-1) of every packet, in the order of the time and value arrays
+# given to add, add_mean and add_max; the bin range is set by the first call. group_bins(code) and total()
+# return BinAccumulators holding the bins of one group or of all groups together.
+class GroupedBins(BinAccumulator):
+    def __init__(self, group, groups, bin_width=1.0, origin=0.0):
+        super().__init__(bin_width, origin)
+        self.group = np.asarray(group, dtype=np.int64)
+        self.groups = groups
+        self.size = 0  # bins per group
+
+    def _bins(self, time):
+        bins = time_bins(time, self.bin_width, self.origin)
+        if self.first is None:
+            self.first = int(bins.min()) if len(bins) else 0
+            self.size = int(bins.max()) - self.first + 1 if len(bins) else 0
+            self.sums['packets'] = np.zeros(self.groups * self.size, dtype=np.int64)
+        return self.group * self.size + (bins - self.first)
+
+    def _grid(self, values):
+        return values.reshape(self.groups, self.size)
+
+    def _view(self, first, sums, means, maxima):
+        view = BinAccumulator(self.bin_width, self.origin)
+        view.first = first
+        view.sums, view.means, view.maxima = sums, means, maxima
+        return view
+
+    # bins of one group, from its first to its last packet
+    def group_bins(self, code):
+        packets = self._grid(self.sums['packets'])[code]
+        present = np.flatnonzero(packets)
+        low, high = (present[0], present[-1] + 1) if len(present) else (0, 0)
+        return self._view(self.first + low,
+                          {name: self._grid(values)[code, low:high] for name, values in self.sums.items()},
+                          {name: (self._grid(total)[code, low:high], self._grid(count)[code, low:high])
+                           for name, (total, count) in self.means.items()},
+                          {name: self._grid(values)[code, low:high] for name, values in self.maxima.items()})
+
+    # bins of all groups together: counters and means add up, maxima are the max over the groups
+    def total(self):
+        return self._view(self.first,
+                          {name: self._grid(values).sum(axis=0) for name, values in self.sums.items()},
+                          {name: (self._grid(total).sum(axis=0), self._grid(count).sum(axis=0))
+                           for name, (total, count) in self.means.items()},
+                          {name: np.fmax.reduce(self._grid(values), axis=0) for name, values in self.maxima.items()})
+
+
+def bin_counters(time, bin_width=1.0, length=None, retransmission=None, lost_segment=None, origin=0.0,
+                 keep_empty=False):
+    accumulator = BinAccumulator(bin_width, origin)
+    accumulator.add(time, length, retransmission, lost_segment)
+    return accumulator.table(keep_empty)
@@ -1,6 +1,6 @@
-import pandas as pd
 import matplotlib
-matplotlib.use('Qt5Agg', force=True) #fix for use qt5agg backend for matplotlib. Use $pip install pyqt5
+from pcapcsv_render import select_backend, show_or_render
+select_backend() #qt5agg backend for matplotlib (Use $pip install pyqt5), Agg when "render_dir" is set in parameters.json
 # https://python-graph-gallery.com/custom-fonts-in-matplotlib
 matplotlib.rcParams['font.family'] = 'cmr10' #for labels, titles, and other text
 matplotlib.rcParams['mathtext.fontset'] = 'cm'
@@ -9,6 +9,7 @@ import matplotlib.pyplot as plt
 from matplotlib.ticker import (AutoMinorLocator, MultipleLocator)
 import json
 import os
+from pcapcsv_loader import read_files
 
 markers = ['>', '+', '.', ',', 'o', 'v', 'x', 'X', 'D', '|']
 MARKER_SIZE = 10
@@ -34,19 +35,8 @@ files_array.sort()
 
 filename='Orchestrator to controller ACK RTT'
 
-# read files and return the dataframe with the required columns
-def read_files(files_array, path=path):
-    df_array = []
-    for i, filename in enumerate(files_array):
-        # Read csv file and convert to pandas dataframe. Pull only relevant columns
-        try:
-            df_temp = pd.read_csv(path + filename, encoding="ISO-8859-1") #fix for pandas 1.4
-            print('reading: ' + path + filename)
-            df_array.append(df_temp)
-        except:
-            print('error reading: ' + path + filename)
-    return df_array
-df_array=read_files(files_array)
+# only the first run is plotted, do not load the others
+df_array=read_files(files_array[0:1], path)
 
 
 #identify tcp stream with wireshark...
@@ -88,4 +78,4 @@ if len(files_array)>2:
 ax1.grid(which='major', color='#a3a3a3', linestyle='--')
 ax1.grid(which='minor', color='#CCCCCC', linestyle=':')
 #enable tightlayout to figure before saving.
-plt.show()
\ No newline at end of file
+show_or_render()
\ No newline at end of file
@@ -0,0 +1,228 @@
+'''
+Render-time decimation of dense time series for the analysis figures.
+
+A line plot cannot show more than one value per pixel column, so a series is reduced to a few points per column
+before it is handed to matplotlib:
+- minmax (default): the x range is split in `buckets` columns and every column keeps its first, last, min and max
+  point. Extrema and one-packet outage spikes survive, and the drawn envelope matches the full series.
+- lttb: Largest-Triangle-Three-Buckets, keeps the visually most significant point per bucket (smoother lines).
+Both are linear in the number of points; the output size depends on the figure width only.
+Decimator gives the same points for a series that arrives in pieces, when its length and x range are known.
+
+Usage:
+    from pcapcsv_decimate import decimate, pixel_columns
+    x, y, markevery = decimate(x, y, markevery, max_points=2 * pixel_columns(WIDTH, DPI))
+'''
+
+import numpy as np
+
+MAX_PLOT_POINTS = 5000
+DEFAULT_METHOD = 'minmax'
+
+
+# pixel columns of a figure width_in inches wide at dpi
+def pixel_columns(width_in, dpi):
+    return max(1, int(width_in * dpi))
+
+
+# [start, stop) row range of every non-empty bucket when the x range is split in buckets equal columns (x sorted)
+def _bucket_bounds(x, buckets):
+    edges = np.linspace(x[0], x[-1], buckets + 1)[1:-1]
+    bounds = np.concatenate(([0], np.searchsorted(x, edges, side='left'), [len(x)]))
+    starts, stops = bounds[:-1], bounds[1:]
+    keep = stops > starts
+    return starts[keep], stops[keep]
+
+
+# row of the first value equal to target in every bucket, the bucket start if there is none (all NaN bucket)
+def _first_match(y, target, starts, stops):
+    counts = stops - starts
+    match = np.flatnonzero(y == np.repeat(target, counts))
+    if len(match) == 0:
+        return starts
+    position = np.searchsorted(match, starts)
+    found = position < len(match)
+    rows = np.where(found, match[np.minimum(position, len(match) - 1)], starts)
+    return np.where(found & (rows < stops), rows, starts)
+
+
+# indices of the first, last, min and max point of every x bucket, NaN values ignored
+def minmax_indices(x, y, buckets):
+    if len(x) <= 4 * buckets:
+        return np.arange(len(x))
+    starts, stops = _bucket_bounds(x, buckets)
+    with np.errstate(invalid='ignore'):
+        low = np.fmin.reduceat(y, starts)
+        high = np.fmax.reduceat(y, starts)
+    rows = np.concatenate((starts, stops - 1, _first_match(y, low, starts, stops), _first_match(y, high, starts, stops)))
+    return np.unique(rows)
+
+
+# Largest-Triangle-Three-Buckets: first and last point plus the point of every bucket that forms the largest
+# triangle with the previously selected point and the mean of the next bucket
+def lttb_indices(x, y, threshold):
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    y = np.where(np.isnan(y), 0, y)
+    bounds = np.floor(np.linspace(1, n - 1, threshold - 1)).astype(np.int64)
+    rows = np.empty(threshold, dtype=np.int64)
+    rows[0], rows[-1] = 0, n - 1
+    selected = 0
+    for bucket in range(threshold - 2):
+        start, stop = bounds[bucket], bounds[bucket + 1]
+        following = slice(stop, bounds[bucket + 2] if bucket + 2 < len(bounds) else n)
+        mean_x, mean_y = x[following].mean(), y[following].mean()
+        area = np.abs((x[selected] - mean_x) * (y[start:stop] - y[selected])
+                      - (x[selected] - x[start:stop]) * (mean_y - y[selected]))
+        selected = start + int(np.argmax(area)) if stop > start else selected
+        rows[bucket + 1] = selected
+    return np.unique(rows)
+
+
+# reduce (x, y) to at most about max_points points for plotting, x sorted. Points without a finite x are dropped
+# (they can not be placed and would turn the bucket edges into NaN). markevery (a row count) is scaled to keep one
+# marker every same span of x.
+def decimate(x, y, markevery=1, max_points=MAX_PLOT_POINTS, method=DEFAULT_METHOD):
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    finite = np.isfinite(x)
+    if not finite.all():
+        x, y = x[finite], y[finite]
+    if len(x) <= max_points:
+        return x, y, max(1, int(markevery))
+    if method == 'lttb':
+        rows = lttb_indices(x, y, max_points)
+    else:
+        rows = minmax_indices(x, y, max(1, max_points // 4))
+    markevery = max(1, int(round(int(markevery) * len(rows) / len(x))))
+    return x[rows], y[rows], markevery
+
+
+
+# decimate() for a series given in pieces in x order (chunked analysis, pcapcsv_metrics.PlotSeries). count, first
+# and last are the number of points and the x range of the whole series, known in advance, so the buckets are the
+# ones decimate() would use and the kept points are the same: minmax holds the first, last, min and max point of the
+# bucket a piece ends in until the bucket is closed, lttb walks the buckets one behind the input and holds the
+# points of two buckets. Memory is the output plus that state, whatever the length of the series.
+class Decimator:
+    def __init__(self, count, first, last, max_points=MAX_PLOT_POINTS, method=DEFAULT_METHOD):
+        self.count = count
+        self.method = method
+        self.rows = 0  # points added so far
+        self.kept = []  # (rows, x, y) arrays of the kept points, in row order
+        if method == 'lttb':
+            self.keep_all = max_points >= count or max_points < 3
+            if not self.keep_all:
+                self.bounds = np.floor(np.linspace(1, count - 1, max_points - 1)).astype(np.int64)
+                self.bucket = 0
+                self.selected = None  # (row, x, y with NaN as 0) of the point selected in the previous bucket
+                self.pending = (np.empty(0, dtype=np.int64), np.empty(0), np.empty(0))  # rows not walked yet
+        else:
+            buckets = max(1, max_points // 4)
+            self.keep_all = count <= max_points or count <= 4 * buckets
+            self.edges = np.linspace(first, last, buckets + 1)[1:-1]
+            self.open = None  # bucket number and candidate points of the bucket the last piece ended in
+
+    def add(self, x, y):
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        finite = np.isfinite(x)
+        if not finite.all():
+            x, y = x[finite], y[finite]
+        if len(x) == 0:
+            return
+        rows = self.rows + np.arange(len(x))
+        self.rows += len(x)
+        if self.keep_all:
+            self.kept.append((rows, x, y))
+        elif self.method == 'lttb':
+            self._add_lttb(rows, x, y)
+        else:
+            self._add_minmax(rows, x, y)
+
+    def _add_minmax(self, rows, x, y):
+        bucket = np.searchsorted(self.edges, x, side='right')
+        starts = np.flatnonzero(np.diff(bucket, prepend=-1))
+        stops = np.append(starts[1:], len(x))
+        with np.errstate(invalid='ignore'):
+            low = np.fmin.reduceat(y, starts)
+            high = np.fmax.reduceat(y, starts)
+        low_rows = _first_match(y, low, starts, stops)
+        high_rows = _first_match(y, high, starts, stops)
+        for i, start in enumerate(starts):
+            # a min/max that is NaN has no matching point, the bucket then falls back to its first point
+            part = {'number': bucket[start],
+                    'first': _point(rows, x, y, start),
+                    'last': _point(rows, x, y, stops[i] - 1),
+                    'low': (low[i], None if np.isnan(low[i]) else _point(rows, x, y, low_rows[i])),
+                    'high': (high[i], None if np.isnan(high[i]) else _point(rows, x, y, high_rows[i]))}
+            if self.open is not None and self.open['number'] == part['number']:
+                # the bucket goes on from the previous piece: its first match of the min/max wins a tie
+                part['first'] = self.open['first']
+                if part['low'][1] is None or (self.open['low'][1] is not None
+                                              and self.open['low'][0] <= part['low'][0]):
+                    part['low'] = self.open['low']
+                if part['high'][1] is None or (self.open['high'][1] is not None
+                                               and self.open['high'][0] >= part['high'][0]):
+                    part['high'] = self.open['high']
+            else:
+                self._close()
+            self.open = part
+
+    # keep the points of the open minmax bucket
+    def _close(self):
+        if self.open is None:
+            return
+        first = self.open['first']
+        points = [first, self.open['last']] + [self.open[key][1] or first for key in ('low', 'high')]
+        self.kept.append(tuple(np.array(values) for values in zip(*points)))
+        self.open = None
+
+    def _add_lttb(self, rows, x, y):
+        pending_rows, pending_x, pending_y = self.pending
+        rows = np.concatenate((pending_rows, rows))
+        x = np.concatenate((pending_x, x))
+        y = np.concatenate((pending_y, y))
+        if self.selected is None:
+            self.kept.append((rows[:1], x[:1], y[:1]))
+            self.selected = (0, x[0], 0.0 if np.isnan(y[0]) else y[0])
+        filled = np.where(np.isnan(y), 0, y)
+        bounds = self.bounds
+        while self.bucket < len(bounds) - 1:
+            bucket = self.bucket
+            end = bounds[bucket + 2] if bucket + 2 < len(bounds) else self.count
+            if rows[-1] < end - 1:
+                break
+            start, stop = bounds[bucket] - rows[0], bounds[bucket + 1] - rows[0]
+            following = slice(stop, end - rows[0])
+            mean_x, mean_y = x[following].mean(), filled[following].mean()
+            _, selected_x, selected_y = self.selected
+            area = np.abs((selected_x - mean_x) * (filled[start:stop] - selected_y)
+                          - (selected_x - x[start:stop]) * (mean_y - selected_y))
+            if stop > start:
+                row = start + int(np.argmax(area))
+                self.selected = (rows[row], x[row], filled[row])
+                self.kept.append((rows[row:row + 1], x[row:row + 1], y[row:row + 1]))
+            self.bucket += 1
+        first = bounds[self.bucket] - rows[0]
+        if rows[-1] == self.count - 1:
+            self.kept.append((rows[-1:], x[-1:], y[-1:]))
+        self.pending = (rows[first:], x[first:], y[first:])
+
+    # (x, y, markevery) of the points added, the result of decimate() on the whole series
+    def result(self, markevery=1):
+        if not self.keep_all and self.method != 'lttb':
+            self._close()
+        if not self.kept:
+            return np.empty(0), np.empty(0), max(1, int(markevery))
+        rows, x, y = (np.concatenate(values) for values in zip(*self.kept))
+        if self.keep_all:
+            return x, y, max(1, int(markevery))
+        rows, unique = np.unique(rows, return_index=True)
+        markevery = max(1, int(round(int(markevery) * len(rows) / self.count)))
+        return x[unique], y[unique], markevery
+
+
+def _point(rows, x, y, i):
+    return rows[i], x[i], y[i]
@@ -0,0 +1,161 @@
+'''
+Lazy index over a sweep directory of csv files.
+
+Experiment files are named with fields separated by SPLIT_FILENAME_CHAR, e.g. "OST)10G)RTO 200)run3).csv".
+ExperimentSet lists the directory once and parses every name into metadata (scenario, bandwidth, RTO, run number),
+without opening any file. Columns are loaded on first access through the csv cache of pcapcsv_loader and kept in
+an LRU cache; when the loaded columns exceed mem_cap_mb the least recently used ones are dropped.
+A query touching 5 runs out of 500 only loads those 5, and only the columns it asks for.
+
+Usage:
+    from pcapcsv_experiments import ExperimentSet
+    experiments = ExperimentSet(path, mem_cap_mb=parameters.get("experiment_mem_cap_mb"))
+    for filename in experiments.select(scenario='OST', bandwidth=10):
+        df = experiments.load(filename, ['tcp.time_relative', 'tcp.len'])
+'''
+
+import os
+import re
+from collections import OrderedDict
+import pandas as pd
+
+from pcapcsv_loader import read_csv_cached
+
+SPLIT_FILENAME_CHAR = ')'
+DEFAULT_MEM_CAP_MB = 2048
+METADATA_COLUMNS = ['scenario', 'bandwidth', 'rto', 'run']
+# "10G", "10 Gbps", "400M", "2.5Gb/s" -> bandwidth in Gb/s
+BANDWIDTH_PATTERN = re.compile(r'^(\d+(?:\.\d+)?)\s*([GMK])(?:b(?:ps|/s)?)?$', re.IGNORECASE)
+BANDWIDTH_UNITS = {'G': 1, 'M': 1e-3, 'K': 1e-6}
+# "RTO 200", "RTO=200ms", "rto_1000" -> RTO as written (ms)
+RTO_PATTERN = re.compile(r'RTO\s*[=_-]?\s*(\d+(?:\.\d+)?)', re.IGNORECASE)
+RUN_PATTERN = re.compile(r'(\d+)\D*$')
+
+
+# metadata of one experiment from its file name. Fields that are not found are None.
+# The scenario is the first field and the run number the last number of the last field.
+def parse_filename(filename, split_char=SPLIT_FILENAME_CHAR):
+    stem = os.path.splitext(filename)[0]
+    fields = [field.strip() for field in stem.split(split_char) if field.strip()]
+    metadata = dict.fromkeys(METADATA_COLUMNS)
+    metadata['fields'] = tuple(fields)
+    if not fields:
+        return metadata
+    metadata['scenario'] = fields[0]
+    for field in fields[1:]:
+        match = BANDWIDTH_PATTERN.match(field)
+        if match and metadata['bandwidth'] is None:
+            metadata['bandwidth'] = float(match.group(1)) * BANDWIDTH_UNITS[match.group(2).upper()]
+        match = RTO_PATTERN.search(field)
+        if match and metadata['rto'] is None:
+            metadata['rto'] = float(match.group(1))
+    match = RUN_PATTERN.search(fields[-1]) if len(fields) > 1 else None
+    if match:
+        metadata['run'] = int(match.group(1))
+    return metadata
+
+
+# one row per file of the directory, sorted by file name like the analysis scripts do
+def build_index(path, extension='.csv', split_char=SPLIT_FILENAME_CHAR):
+    rows = []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_file() and entry.name.endswith(extension):
+                row = parse_filename(entry.name, split_char)
+                row['filename'] = entry.name
+                row['size'] = entry.stat().st_size
+                rows.append(row)
+    index = pd.DataFrame(rows, columns=['filename'] + METADATA_COLUMNS + ['fields', 'size'])
+    return index.sort_values('filename', ignore_index=True)
+
+
+class ExperimentSet:
+    def __init__(self, path, extension='.csv', split_char=SPLIT_FILENAME_CHAR, mem_cap_mb=None, usecols=None):
+        self.path = path
+        self.split_char = split_char
+        self.mem_cap = int((mem_cap_mb if mem_cap_mb is not None else DEFAULT_MEM_CAP_MB) * 2 ** 20)
+        self.usecols = usecols
+        self.index = build_index(path, extension, split_char)
+        self.cached_bytes = 0
+        self._columns = OrderedDict()  # (filename, column) -> Series, least recently used first
+        self._absent = {}  # filename -> requested columns the file does not have
+        self._attrs = {}  # filename -> DataFrame.attrs set by the loader (packed analysis flags)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __iter__(self):
+        return iter(self.filenames)
+
+    @property
+    def filenames(self):
+        return self.index['filename'].tolist()
+
+    # file names matching every criterion: a value, a list/tuple/set of accepted values or a function
+    # of the value, e.g. select(scenario='OST', bandwidth=[10, 25], run=lambda run: run <= 5)
+    def select(self, **criteria):
+        mask = pd.Series(True, index=self.index.index)
+        for key, accepted in criteria.items():
+            if callable(accepted):
+                mask &= self.index[key].map(lambda value: value is not None and bool(accepted(value)))
+            elif isinstance(accepted, (list, tuple, set)):
+                mask &= self.index[key].isin(accepted)
+            else:
+                mask &= self.index[key] == accepted
+        return self.index[mask]['filename'].tolist()
+
+    # plot label made of the first fields of the file name, as in the analysis scripts
+    def label(self, filename, limit=2, number=None):
+        label = '$\\|$'.join(filename.split(self.split_char)[0:limit])
+        if number is not None:
+            label += '$\\|$' + str(number)
+        return label
+
+    # dataframe with the requested columns of one file, missing columns are read from disk
+    def load(self, filename, columns=None):
+        if columns is None:
+            columns = self.usecols
+        absent = self._absent.setdefault(filename, set())
+        if columns is None:
+            missing = None
+        else:
+            missing = [column for column in columns if (filename, column) not in self._columns
+                       and column not in absent]
+        if missing is None or missing:
+            df = read_csv_cached(os.path.join(self.path, filename), usecols=missing)
+            self._attrs.setdefault(filename, {}).update(df.attrs)
+            for column in df.columns:
+                self._store(filename, column, df[column])
+            if columns is None:
+                columns = list(df.columns)
+            absent.update(column for column in missing or [] if column not in df.columns)
+
+        present = [column for column in columns if (filename, column) in self._columns]
+        for column in present:
+            self._columns.move_to_end((filename, column))
+        df = pd.DataFrame({column: self._columns[(filename, column)] for column in present})
+        df.attrs.update(self._attrs.get(filename, {}))
+        self._evict(keep=filename)
+        return df
+
+    # (filename, dataframe) for every file of filenames (all files by default), loaded one at a time
+    def frames(self, filenames=None, columns=None):
+        for filename in (self.filenames if filenames is None else filenames):
+            yield filename, self.load(filename, columns)
+
+    def _store(self, filename, column, series):
+        key = (filename, column)
+        if key in self._columns:
+            self.cached_bytes -= self._columns[key].memory_usage(index=False, deep=True)
+        self._columns[key] = series
+        self.cached_bytes += series.memory_usage(index=False, deep=True)
+
+    # drop least recently used columns until under the cap. Columns of the file being loaded are kept,
+    # a single run larger than the cap is still returned.
+    def _evict(self, keep=None):
+        for key in list(self._columns):
+            if self.cached_bytes <= self.mem_cap:
+                break
+            if key[0] == keep:
+                continue
+            self.cached_bytes -= self._columns.pop(key).memory_usage(index=False, deep=True)
@@ -0,0 +1,231 @@
+'''
+Live monitoring of a tcp capture while the experiment runs.
+
+Follows either
+- a growing csv written by tshark on the capture host, e.g.
+  tshark -l -i <interface> -T fields -E header=y -E separator=, -E quote=d -E occurrence=a -e ... > run.csv
+  parameters.json "live_csv": <path of the csv>
+- a tshark pipe started by this script (tshark -l -i <interface>, fields of pcap_to_csv.TCP_FIELDS)
+  parameters.json "live_interface": <interface>, optional "live_capture_filter" (e.g. "tcp port 5201")
+
+New lines are parsed every "live_interval" seconds (default LIVE_INTERVAL) with the schema of pcapcsv_loader and
+fed to a pcapcsv_metrics.ChunkedRun, so the values are the ones of pcapcsv_analysis_stateless.py: throughput and
+goodput, retransmissions and loss ratio, mean ACK RTT and max gap between packets, per live_interval bin.
+The iperf stream is picked (most packets) once WARMUP_PACKETS packets were seen.
+Every completed interval is printed, and appended as a json line to "live_output" if set. The source ends after
+"live_idle_timeout" seconds without new packets (or when tshark exits / Ctrl+C); the summary values of the run
+(loss and max gap of the event windows) are printed then.
+'''
+
+import io
+import json
+import os
+import queue
+import subprocess
+import threading
+import time
+import numpy as np
+import pandas as pd
+
+from pcap_to_csv import TSHARK_FIELD_OPTIONS, TCP_FIELDS
+from pcapcsv_loader import CSV_ENCODING, apply_schema
+from pcapcsv_metrics import DEFAULT_CONFIG, ChunkedRun, stream_census, merge_census
+
+LIVE_INTERVAL = 0.1  # seconds, bin width of the live metrics and read period of the source
+IDLE_TIMEOUT = 5  # seconds without new lines before the source is considered finished
+WARMUP_PACKETS = 1000  # tcp packets seen before the iperf stream is chosen
+
+
+def live_tshark_args(interface, fields=TCP_FIELDS, capture_filter=None):
+    args = ['tshark', '-l', '-i', interface]
+    if capture_filter:
+        args += ['-f', capture_filter]
+    args += TSHARK_FIELD_OPTIONS
+    for field in fields:
+        args += ['-e', field]
+    return args
+
+
+# batches of complete lines appended to a growing file, read every interval seconds
+def follow_file(path, interval=LIVE_INTERVAL, idle_timeout=IDLE_TIMEOUT):
+    idle = 0.0
+    while not os.path.exists(path):
+        if idle >= idle_timeout:
+            return
+        time.sleep(interval)
+        idle += interval
+    with open(path, encoding=CSV_ENCODING, newline='') as f:
+        partial = ''
+        idle = 0.0
+        while idle < idle_timeout:
+            data = f.read()
+            if data:
+                idle = 0.0
+                lines = (partial + data).split('\n')
+                partial = lines.pop()  # a line tshark is still writing
+                if lines:
+                    yield [line + '\n' for line in lines]
+            else:
+                idle += interval
+            time.sleep(interval)
+
+
+def _read_lines(stream, lines):
+    for line in stream:
+        lines.put(line)
+    lines.put(None)
+
+
+# batches of the lines written by a command (tshark -l), collected for interval seconds
+def follow_pipe(args, interval=LIVE_INTERVAL, idle_timeout=IDLE_TIMEOUT):
+    proc = subprocess.Popen(args, stdout=subprocess.PIPE, encoding=CSV_ENCODING)
+    lines = queue.Queue()
+    threading.Thread(target=_read_lines, args=(proc.stdout, lines), daemon=True).start()
+    try:
+        idle = 0.0
+        finished = False
+        while not finished and idle < idle_timeout:
+            batch = []
+            deadline = time.monotonic() + interval
+            while True:
+                try:
+                    line = lines.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if line is None:
+                    finished = True
+                    break
+                batch.append(line)
+            idle = 0.0 if batch else idle + interval
+            if batch:
+                yield batch
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+        proc.wait()
+
+
+# parse batches of csv lines, the first line of the first batch is the header
+class LineParser:
+    def __init__(self):
+        self.names = None
+
+    def parse(self, lines):
+        if self.names is None:
+            header = pd.read_csv(io.StringIO(lines[0]), nrows=0).columns
+            self.names = list(header)  # duplicated names are renamed like read_csv does: tcp.seq, tcp.seq.1
+            lines = lines[1:]
+        if not lines:
+            return None
+        df = pd.read_csv(io.StringIO(''.join(lines)), header=None, names=self.names)
+        return apply_schema(df)
+
+
+# per interval metrics of the iperf stream, updated one batch of packets at a time
+class LiveMonitor:
+    def __init__(self, name, config=None, interval=LIVE_INTERVAL, warmup_packets=WARMUP_PACKETS):
+        self.name = name
+        self.config = dict(DEFAULT_CONFIG, **(config or {}), bin_width=interval, plot_series=False)
+        self.interval = interval
+        self.warmup_packets = warmup_packets
+        self.census = None
+        self.waiting = []  # chunks seen before the iperf stream is chosen
+        self.run = None
+        self.reported = 0  # intervals already returned by update
+
+    # add a chunk of packets, returns the intervals completed by it
+    def update(self, chunk):
+        if chunk is None or len(chunk) == 0:
+            return self._completed()
+        self.census = merge_census(self.census, stream_census(chunk))
+        if self.run is None:
+            self.waiting.append(chunk)
+            if self.census['packets'].sum() < self.warmup_packets:
+                return self._completed()
+            self.run = ChunkedRun(self.name, self.census, self.config)
+            print('live: following tcp.stream ' + str(self.run.stream_index))
+            chunks, self.waiting = self.waiting, []
+        else:
+            chunks = [chunk]
+        for chunk in chunks:
+            self.run.update(chunk)
+        return self._completed()
+
+    # an interval is complete once a packet after its end was analyzed
+    def _completed(self, final=False):
+        if self.run is None or self.run.bins is None:
+            return pd.DataFrame()
+        table = self.run.bins.table(keep_empty=True)
+        complete = len(table) if final else int(np.searchsorted(table.index + self.interval, self.run.last_time,
+                                                                side='right'))
+        rows = table.iloc[self.reported:complete]
+        self.reported = max(self.reported, complete)
+        return rows
+
+    # flush the held packets, returns the last intervals and the result of the run (pcapcsv_metrics.run_result)
+    def finish(self):
+        if self.run is None:
+            if not self.waiting:
+                return pd.DataFrame(), None
+            self.run = ChunkedRun(self.name, self.census, self.config)
+            for chunk in self.waiting:
+                self.run.update(chunk)
+            self.waiting = []
+        self.run.census = self.census
+        result = self.run.result()
+        return self._completed(final=True), result
+
+
+def format_interval(start, row):
+    return ('t=%7.2f s  throughput %6.2f Gb/s  goodput %6.2f Gb/s  retransmissions %5d (%5.2f %%)  '
+            'ack rtt %7.3f ms  max gap %8.3f ms' % (start, row['throughput'] / 1e9, row['goodput'] / 1e9,
+                                                     row['retransmissions'], np.nan_to_num(row['loss_ratio']),
+                                                     row['ack_rtt'] * 1000, row['max_gap'] * 1000))
+
+
+def report(rows, output=None):
+    for start, row in rows.iterrows():
+        print(format_interval(start, row))
+        if output is not None:
+            values = {key: (None if pd.isna(value) else float(value)) for key, value in row.items()}
+            output.write(json.dumps(dict(values, time=float(start))) + '\n')
+    if output is not None and len(rows):
+        output.flush()
+
+
+# follow a source of line batches until it ends, reporting every completed interval
+def monitor(batches, name='live', config=None, interval=LIVE_INTERVAL, output=None):
+    parser = LineParser()
+    live = LiveMonitor(name, config, interval)
+    try:
+        for lines in batches:
+            report(live.update(parser.parse(lines)), output)
+    except KeyboardInterrupt:
+        print('live: stopped')
+    rows, result = live.finish()
+    report(rows, output)
+    return result
+
+
+if __name__ == '__main__':
+    parameters = json.load(open('parameters.json'))
+    interval = parameters.get("live_interval", LIVE_INTERVAL)
+    idle_timeout = parameters.get("live_idle_timeout", IDLE_TIMEOUT)
+    if parameters.get("live_csv"):
+        name = os.path.basename(parameters["live_csv"])
+        batches = follow_file(parameters["live_csv"], interval, idle_timeout)
+    else:
+        name = parameters["live_interface"]
+        batches = follow_pipe(live_tshark_args(parameters["live_interface"],
+                                               capture_filter=parameters.get("live_capture_filter")),
+                              interval, idle_timeout)
+    output = open(parameters["live_output"], 'a') if parameters.get("live_output") else None
+    result = monitor(batches, name, interval=interval, output=output)
+    if output is not None:
+        output.close()
+    if result is not None:
+        print('packets: ' + str(result['packets']))
+        for window, loss in result['loss_windows'].items():
+            print('loss ' + window + ': ' + str(loss))
+        for window, values in result['event_windows'].items():
+            print('max gap ' + window + ': ' + str(values['max_gap']) + ' (' + str(values['gap_count']) + ' gaps)')
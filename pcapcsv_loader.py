@@ -0,0 +1,385 @@
+'''
+Shared csv loader for the pcapcsv analysis scripts, with a columnar cache.
+
+The first time a csv is read it is parsed once and written next to it as an uncompressed Feather (Arrow IPC)
+sidecar in <datapath>/.pcapcsv_cache/. The sidecar records the size and mtime of the csv; as long as they
+match, later runs memory-map the sidecar and read only the requested columns instead of parsing text again.
+If the csv changes the sidecar is rebuilt. Without pyarrow the loader falls back to plain pd.read_csv.
+
+Every tshark column listed in SCHEMA gets a compact declared type instead of float64/str:
+IPv4 addresses uint32 (see pcap_reader.ipv4_to_str), ports uint16, lengths/seq/stream uint32, times float64,
+analysis flags packed into tcp.analysis.flags. Integer columns store a missing value as 0; RTT and bytes in flight
+stay float64 since NaN means "not present on this row". Rows without a time value (frames of another protocol)
+are dropped.
+
+The tshark analysis flags (tcp.analysis.retransmission, lost_segment, fast_retransmission, duplicate_ack,
+zero_window: any text on the row means set) are decoded once at parse time and packed into a single uint8 bitmask
+column, tcp.analysis.flags (see FLAG_BITS). Loss metrics test a bit instead of comparing strings:
+    retransmission = flag_mask(df[FLAGS_COLUMN], 'tcp.analysis.retransmission')
+Asking for a flag by its tshark name in usecols still returns a bool column, unpacked from the bitmask.
+
+read_csv_chunks() yields the same dataframes chunk by chunk, for captures larger than memory.
+The csv is parsed with the multithreaded pyarrow engine when it is available.
+
+A .pcap / .pcapng path is decoded by pcap_reader.read_pcap instead of being parsed as a csv, and cached the same
+way. It has no tcp.analysis.* fields (they need tshark), so loss and RTT metrics still need the tshark csv.
+
+Usage:
+    from pcapcsv_loader import read_files
+    df_array = read_files(files_array, path, usecols=desired_df_columns)
+'''
+
+import os
+import csv
+import numpy as np
+import pandas as pd
+
+from pcap_reader import ipv4_from_str, read_pcap
+
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+except ImportError:
+    pa = None
+
+CSV_ENCODING = "ISO-8859-1"  # fix for pandas 1.4
+CACHE_DIRNAME = '.pcapcsv_cache'
+CACHE_SUFFIX = '.feather'
+# bump when the way the sidecar is built changes, old sidecars are then rebuilt
+CACHE_VERSION = '3'
+# rows per chunk of read_csv_chunks
+CHUNK_ROWS = 1000000
+# captures read natively by pcap_reader instead of a tshark csv
+CAPTURE_SUFFIXES = ('.pcap', '.pcapng')
+
+# declared packet schema for the fields written by pcap_to_csv.py. 'ipv4' -> uint32, 'flag' -> bool.
+# tcp.seq.1 is the second tcp.seq column of the csv, renamed by the parser.
+SCHEMA = {
+    'ip.ttl': 'uint8',
+    'ip.src': 'ipv4',
+    'ip.dst': 'ipv4',
+    'tcp.srcport': 'uint16',
+    'tcp.dstport': 'uint16',
+    'tcp.seq': 'uint32',
+    'tcp.seq.1': 'uint32',
+    'tcp.ack': 'uint32',
+    'tcp.len': 'uint32',
+    'tcp.nxtseq': 'uint32',
+    'tcp.time_delta': 'float64',
+    'tcp.time_relative': 'float64',
+    'tcp.stream': 'uint32',
+    'tcp.analysis.retransmission': 'flag',
+    'tcp.analysis.lost_segment': 'flag',
+    'tcp.analysis.fast_retransmission': 'flag',
+    'tcp.analysis.duplicate_ack': 'flag',
+    'tcp.analysis.zero_window': 'flag',
+    'tcp.window_size': 'uint32',
+    'tcp.analysis.ack_rtt': 'float64',
+    'tcp.analysis.bytes_in_flight': 'float64',
+    'udp.srcport': 'uint16',
+    'udp.dstport': 'uint16',
+    'udp.length': 'uint32',
+    'udp.time_delta': 'float64',
+    'udp.time_relative': 'float64',
+    # column name of the Wireshark GUI csv export
+    'Retransmission': 'flag',
+}
+# bit of every tshark analysis flag in the packed FLAGS_COLUMN
+FLAGS_COLUMN = 'tcp.analysis.flags'
+FLAG_BITS = {
+    'tcp.analysis.retransmission': 1,
+    'tcp.analysis.lost_segment': 2,
+    'tcp.analysis.fast_retransmission': 4,
+    'tcp.analysis.duplicate_ack': 8,
+    'tcp.analysis.zero_window': 16,
+}
+# the flags extracted in the csv, a flag that was not extracted is absent rather than never set.
+# Kept in DataFrame.attrs and in the metadata of the sidecar.
+FLAGS_ATTR = 'packed_flags'
+# rows with no value in these columns are not tcp/udp packets
+TIME_COLUMNS = ['tcp.time_relative', 'udp.time_relative']
+
+
+# path of a file derived from csv_path inside the cache folder (the feather sidecar by default)
+def cache_path(csv_path, cache_dir=None, suffix=CACHE_SUFFIX):
+    directory, name = os.path.split(csv_path)
+    if cache_dir is None:
+        cache_dir = os.path.join(directory, CACHE_DIRNAME)
+    return os.path.join(cache_dir, name + suffix)
+
+
+# temp file next to path for an atomic write (os.replace), the pid keeps concurrent writers of the same file apart
+def temp_path(path):
+    return path + '.' + str(os.getpid()) + '.part'
+
+
+# size and mtime of the csv, stored with everything derived from it to detect a stale cache entry
+def source_key(csv_path):
+    stat = os.stat(csv_path)
+    return {'source_size': stat.st_size, 'source_mtime_ns': stat.st_mtime_ns, 'cache_version': CACHE_VERSION}
+
+
+def _source_key(csv_path):
+    return {key.encode(): str(value).encode() for key, value in source_key(csv_path).items()}
+
+
+# True if the sidecar exists and was built from the current version of the csv. Only the schema is read.
+def is_cache_valid(csv_path, sidecar):
+    if not os.path.exists(sidecar):
+        return False
+    try:
+        with pa.memory_map(sidecar) as source:
+            metadata = pa.ipc.open_file(source).schema.metadata or {}
+    except (OSError, pa.ArrowInvalid):
+        return False
+    key = _source_key(csv_path)
+    return all(metadata.get(k) == v for k, v in key.items())
+
+
+# header of a csv file, used to select existing columns before parsing
+def csv_header(csv_path):
+    with open(csv_path, newline='', encoding=CSV_ENCODING) as f:
+        return next(csv.reader(f), [])
+
+
+# parse a csv with the multithreaded pyarrow engine if available, the c engine otherwise
+def parse_csv(csv_path, usecols=None):
+    if usecols is not None:
+        header = csv_header(csv_path)
+        usecols = list(dict.fromkeys(column for column in header if column in set(usecols)))
+    if pa is None:
+        return pd.read_csv(csv_path, usecols=usecols, encoding=CSV_ENCODING)
+    df = pd.read_csv(csv_path, usecols=usecols, encoding=CSV_ENCODING, engine='pyarrow')
+    # the pyarrow engine keeps duplicated names (tcp.seq twice), rename like the c engine does: tcp.seq, tcp.seq.1
+    seen = {}
+    columns = []
+    for column in df.columns:
+        columns.append(column if column not in seen else column + '.' + str(seen[column]))
+        seen[column] = seen.get(column, 0) + 1
+    df.columns = columns
+    return df
+
+
+def is_capture(path):
+    return path.lower().endswith(CAPTURE_SUFFIXES)
+
+
+# the columns of a csv, or of a capture decoded by pcap_reader (all its columns, usecols is applied later)
+def parse_source(path, usecols=None):
+    if is_capture(path):
+        return pd.DataFrame(read_pcap(path))
+    return parse_csv(path, usecols)
+
+
+# first value of multi occurrence fields ("a,b" with tshark -E occurrence=a), as numbers
+def _numeric(series):
+    if not pd.api.types.is_numeric_dtype(series):
+        series = pd.to_numeric(series.astype('str').str.split(',').str[0], errors='coerce')
+    return series
+
+
+def _ipv4(series):
+    if pd.api.types.is_integer_dtype(series):
+        return series.astype(np.uint32)
+    # only a handful of distinct addresses per capture, convert those and map back
+    codes, uniques = pd.factorize(series)
+    values = ipv4_from_str([str(value).split(',')[0] for value in uniques])
+    return pd.Series(np.where(codes >= 0, values[np.maximum(codes, 0)], 0).astype(np.uint32), index=series.index)
+
+
+def _flag(series):
+    if series.dtype == bool:
+        return series
+    return series.notna() & (series.astype('str') != '')
+
+
+# bool array, True where the bit of flag (a FLAG_BITS name) is set in the packed flags
+def flag_mask(flags, flag):
+    return (np.asarray(flags) & FLAG_BITS[flag]) != 0
+
+
+# the flags of FLAG_BITS that were extracted in the csv df was read from
+def packed_flags(df):
+    return df.attrs.get(FLAGS_ATTR, [])
+
+
+# replace the flag columns of FLAG_BITS by one uint8 bitmask column, one pass per flag
+def pack_flags(df):
+    present = [column for column in FLAG_BITS if column in df.columns]
+    if not present:
+        return df
+    flags = np.zeros(len(df), dtype=np.uint8)
+    for column in present:
+        flags |= np.where(_flag(df[column]).to_numpy(), FLAG_BITS[column], 0).astype(np.uint8)
+    df = df.drop(columns=present)
+    df[FLAGS_COLUMN] = flags
+    df.attrs[FLAGS_ATTR] = present
+    return df
+
+
+# bool columns for the flag names of usecols found in the bitmask, the bitmask is kept only if it was asked for
+def unpack_flags(df, usecols=None):
+    present = packed_flags(df)
+    if FLAGS_COLUMN not in df.columns or usecols is None:
+        return df
+    for column in usecols:
+        if column in present:
+            df[column] = flag_mask(df[FLAGS_COLUMN], column)
+    if FLAGS_COLUMN not in usecols:
+        df = df.drop(columns=FLAGS_COLUMN)
+    return df
+
+
+# column names to read for usecols: the bitmask stands for the flag columns
+def _stored_columns(usecols):
+    if usecols is None:
+        return None
+    usecols = set(usecols)
+    if usecols & set(FLAG_BITS):
+        usecols.add(FLAGS_COLUMN)
+    return usecols
+
+
+# column names to parse from the csv for stored: the flag columns of the bitmask and the time columns, whose
+# missing values mark the rows of other protocols that apply_schema drops
+def _parsed_columns(stored):
+    if stored is None:
+        return None
+    columns = stored | set(TIME_COLUMNS)
+    if FLAGS_COLUMN in columns:
+        columns = columns | set(FLAG_BITS)
+    return columns
+
+
+# the stored columns of a converted dataframe, after the rows were filtered on columns that were not asked for
+def _project(df, stored):
+    if stored is None:
+        return df
+    return df[[column for column in df.columns if column in stored]]
+
+
+# convert the columns listed in SCHEMA to their declared types, pack the analysis flags and drop rows of other
+# protocols
+def apply_schema(df):
+    for column in TIME_COLUMNS:
+        if column in df.columns:
+            df = df[_numeric(df[column]).notna()]
+    df = df.reset_index(drop=True)
+    for column in df.columns:
+        kind = SCHEMA.get(column)
+        if kind is None:
+            continue
+        if kind == 'ipv4':
+            df[column] = _ipv4(df[column])
+        elif kind == 'flag':
+            df[column] = _flag(df[column])
+        elif kind == 'float64':
+            df[column] = _numeric(df[column]).astype(np.float64)
+        else:
+            df[column] = _numeric(df[column]).fillna(0).astype(kind)
+    return pack_flags(df)
+
+
+# arrow needs one type per column; tshark columns mixing numbers and text are stored as text
+def _to_arrow_table(df):
+    for column in df.columns:
+        if df[column].dtype == object:
+            df[column] = df[column].where(df[column].isna(), df[column].astype(str))
+    return pa.Table.from_pandas(df, preserve_index=False)
+
+
+def write_cache(csv_path, df, sidecar):
+    table = _to_arrow_table(df)
+    metadata = dict(table.schema.metadata or {})
+    metadata.update(_source_key(csv_path))
+    metadata[FLAGS_ATTR.encode()] = ','.join(packed_flags(df)).encode()
+    table = table.replace_schema_metadata(metadata)
+    os.makedirs(os.path.dirname(sidecar), exist_ok=True)
+    # write to a temp file and rename, a killed run never leaves a half written sidecar
+    part = temp_path(sidecar)
+    try:
+        feather.write_feather(table, part, compression='uncompressed')
+        os.replace(part, sidecar)
+    except BaseException:
+        if os.path.exists(part):
+            os.remove(part)
+        raise
+
+
+# read one csv through the cache. usecols is a list of column names, missing names are ignored.
+def read_csv_cached(csv_path, usecols=None, cache=True, cache_dir=None):
+    stored = _stored_columns(usecols)
+    if pa is None or not cache:
+        return unpack_flags(_project(apply_schema(parse_source(csv_path, _parsed_columns(stored))), stored), usecols)
+
+    sidecar = cache_path(csv_path, cache_dir)
+    if not is_cache_valid(csv_path, sidecar):
+        df = apply_schema(parse_source(csv_path))
+        print('building cache: ' + sidecar)
+        try:
+            write_cache(csv_path, df, sidecar)
+        except (OSError, pa.ArrowException) as e:
+            print('could not write cache for ' + csv_path + ': ' + str(e))
+        return unpack_flags(_project(df, stored), usecols)
+
+    with pa.memory_map(sidecar) as source:
+        schema = pa.ipc.open_file(source).schema
+    columns = None
+    if usecols is not None:
+        columns = [column for column in schema.names if column in stored]
+    df = feather.read_table(sidecar, columns=columns, memory_map=True).to_pandas()
+    flags = (schema.metadata or {}).get(FLAGS_ATTR.encode(), b'').decode()
+    df.attrs[FLAGS_ATTR] = flags.split(',') if flags else []
+    return unpack_flags(df, usecols)
+
+
+# read one csv as dataframes of about chunk_rows rows, converted like read_csv_cached, for files that do not fit
+# in memory. A valid sidecar is read batch by batch from its memory map; otherwise the csv is parsed in chunks
+# and no sidecar is built (that needs the whole table). A capture is decoded whole and yielded as one chunk.
+def read_csv_chunks(csv_path, usecols=None, chunk_rows=CHUNK_ROWS, cache=True, cache_dir=None):
+    stored = _stored_columns(usecols)
+    sidecar = cache_path(csv_path, cache_dir)
+    if pa is not None and cache and is_cache_valid(csv_path, sidecar):
+        with pa.memory_map(sidecar) as source:
+            reader = pa.ipc.open_file(source)
+            flags = (reader.schema.metadata or {}).get(FLAGS_ATTR.encode(), b'').decode()
+            columns = [column for column in reader.schema.names if stored is None or column in stored]
+            batches = []
+            rows = 0
+            for i in range(reader.num_record_batches):
+                batch = reader.get_batch(i).select(columns)
+                batches.append(batch)
+                rows += batch.num_rows
+                if rows >= chunk_rows or i == reader.num_record_batches - 1:
+                    df = pa.Table.from_batches(batches, schema=batch.schema).to_pandas()
+                    df.attrs[FLAGS_ATTR] = flags.split(',') if flags else []
+                    yield unpack_flags(df, usecols)
+                    batches = []
+                    rows = 0
+        return
+
+    if is_capture(csv_path):
+        yield read_csv_cached(csv_path, usecols=usecols, cache=cache, cache_dir=cache_dir)
+        return
+    columns = _parsed_columns(stored)
+    if columns is not None:
+        columns = list(dict.fromkeys(column for column in csv_header(csv_path) if column in columns))
+    with pd.read_csv(csv_path, usecols=columns, encoding=CSV_ENCODING, chunksize=chunk_rows) as reader:
+        for chunk in reader:
+            yield unpack_flags(_project(apply_schema(chunk), stored), usecols)
+
+
+# read files (tshark csvs or captures) and return the dataframes with the required columns.
+# skip_errors=True prints and skips unreadable files, False raises (keeps df_array aligned with files_array)
+def read_files(files_array, path, usecols=None, skip_errors=True, cache=True):
+    df_array = []
+    for filename in files_array:
+        try:
+            df_temp = read_csv_cached(os.path.join(path, filename), usecols=usecols, cache=cache)
+            print('reading: ' + path + filename)
+            df_array.append(df_temp)
+        except (OSError, ValueError) as e:
+            if not skip_errors:
+                raise
+            print('error reading: ' + path + filename + ' (' + str(e) + ')')
+    return df_array
@@ -0,0 +1,878 @@
+'''
+Per run analysis for pcapcsv_analysis_stateless.py.
+
+analyze_file() loads one csv, finds the iperf stream and computes everything the stateless figures need.
+It returns a compact result (plain dict, cheap to pickle) instead of the packet table:
+- per second metrics table (per_second_metrics): pkt_sent, pkt_retransmit, pkt_loss_ratio, bytes, throughput,
+  ack_rtt, max_gap; pkt_sent, pkt_retransmit and pkt_loss_ratio are also returned as series. The counters are
+  np.bincount passes over the bin number of every packet (pcapcsv_bins.py), with config 'bin_width' (seconds) the
+  same table plus goodput is also returned in finer bins (result['bins'])
+- event window values used by the boxplots: loss and link unavailability at steady state, t=5, t=10, t=15.
+  event_windows() extracts max gap, gap count, packets, retransmissions and loss of each declared window with a
+  binary search on the sorted time column
+- plot series (x, y, markevery) already smoothed and decimated to about max_plot_points points, keeping the
+  min/max of every pixel column (pcapcsv_decimate.py)
+
+Moving averages use time windows, not packet counts: a rolling factor N means a window of 1/N seconds over
+tcp.time_relative (TimeWindows), so the window covers the same time at 1 Gb/s and at 100 Gb/s and while the rate
+changes during a reconfiguration. Throughput, packet delta t, payload, ACK RTT and loss share the same sorted
+time column and cost O(n) each.
+
+analyze_files() runs analyze_file over a sweep in a bounded process pool (pcapcsv_sweep.py), so the parent never
+holds raw packets and memory stays flat as the sweep grows.
+With config 'chunk_rows' a capture is read in chunks instead (pcapcsv_loader.read_csv_chunks) and ChunkedRun
+carries the state between chunks: the last packet time for the gaps, the bin counters and the event windows.
+The plot series are built in a second pass (ChunkedSeries): the rolling windows carry the running sums of their
+last seconds (WindowCarry) and every series is decimated as it grows (pcapcsv_decimate.Decimator). Peak memory
+is then set by the chunk size and the results are those of the in-memory analysis.
+With config 'multi_stream' every stream above 'stream_min_share' of the packets is analyzed in the same pass
+(analyze_streams), for experiments with parallel flows: per stream results and an aggregate of all of them.
+
+The stream census (packets, bytes, first/last time and endpoints of every tcp.stream) is computed in one
+vectorized pass and saved next to the csv cache (<datapath>/.pcapcsv_cache/<file>.streams.json), so later runs
+pick the iperf stream(s) without looking at the packets again.
+'''
+
+import os
+import json
+from functools import partial
+import numpy as np
+import pandas as pd
+
+from pcapcsv_loader import (read_csv_cached, read_csv_chunks, cache_path, source_key, temp_path, SCHEMA,
+                            FLAGS_COLUMN, flag_mask, packed_flags)
+from pcapcsv_decimate import decimate, Decimator, MAX_PLOT_POINTS
+from pcapcsv_bins import BinAccumulator, GroupedBins
+from pcapcsv_sweep import sweep
+
+CENSUS_SUFFIX = '.streams.json'
+CENSUS_ENDPOINT_COLUMNS = ['ip.src', 'ip.dst', 'tcp.srcport', 'tcp.dstport']
+IPERF_PORT = 5201
+
+DESIRED_DF_COLUMNS = ['tcp.time_relative',
+                      'ip.src',
+                      'ip.dst',
+                      'tcp.srcport',
+                      'tcp.dstport',
+                      'tcp.stream',
+                      'tcp.time_delta',
+                      'tcp.len',
+                      'tcp.window_size',
+                      FLAGS_COLUMN,
+                      'tcp.analysis.bytes_in_flight',
+                      'tcp.analysis.ack_rtt']
+
+# defaults of the stateless script, override any of them through the config argument
+DEFAULT_CONFIG = {
+    'usecols': DESIRED_DF_COLUMNS,
+    'test_duration': 20,
+    'steady_index': 2,
+    'rolling_factor': 1,
+    'rolling_factor_time_delta': 2,
+    'rolling_factor_rtt_ack': 2,
+    'rolling_factor_loss': 1,
+    'marker_every_s': 4,
+    'link_unavailable_min_plot': 0.02,  # lower ylim of the link unavailability figure
+    'max_plot_points': MAX_PLOT_POINTS,
+    'decimation': 'minmax',  # 'minmax' or 'lttb', see pcapcsv_decimate.py
+    'plot_series': True,  # False when only the summary values are needed
+    'grid_step': 0.001,  # time grid of the bytes in flight / RTT throughput, seconds
+    'asof_tolerance': 0.1,  # samples older than this are not carried forward on the grid, seconds
+    'bin_width': None,  # width of the fine bins (result['bins']) in seconds, e.g. 0.01. None: no fine bins
+    'chunk_rows': None,  # read and analyze the csv in chunks of this many rows (ChunkedRun). None: in memory
+    'chunk_reorder_window': 0.01,  # packets out of time order by up to this many seconds are sorted across chunks
+    'multi_stream': False,  # also analyze every other stream (result['streams'], result['aggregate'])
+    'stream_min_share': 0.01,  # multi_stream: streams with a smaller share of the packets (iperf control) are left out
+}
+
+# event windows of the boxplots: (first second, last second) of tcp.time_second
+LOSS_WINDOWS = {'mbb1': (4, 6), 'reconfiguration': (9, 11), 'mbb2': (14, 16)}
+# link unavailability windows: (first second, last second, min gap, max gap) for make before break runs
+LINK_WINDOWS_MBB = {'mbb1': (4, 6, 0.03, None), 'reconfiguration': (9, 11, 0.005, None), 'mbb2': (14, 16, 0.005, 0.2)}
+LINK_WINDOWS = {'reconfiguration': (9, 11, 0.006, None)}
+LINK_STEADY_MIN = 0.006
+
+
+# one pass over the packets: packets, bytes, first/last time and endpoints (first packet) of every tcp.stream.
+# tcp.stream ids are small consecutive integers, so bincount and index assignment replace per stream scans.
+def stream_census(df):
+    stream = df['tcp.stream'].to_numpy().astype(np.int64)
+    n_streams = int(stream.max()) + 1 if len(stream) else 0
+    packets = np.bincount(stream, minlength=n_streams)
+    payload = np.bincount(stream, weights=df['tcp.len'].to_numpy(), minlength=n_streams)
+    # first row of every stream present (np.unique returns the first occurrence) and last row (largest row index)
+    present, first = np.unique(stream, return_index=True)
+    last = np.zeros(n_streams, dtype=np.int64)
+    np.maximum.at(last, stream, np.arange(len(stream)))
+    time = df['tcp.time_relative'].to_numpy()
+    census = pd.DataFrame({'packets': packets[present],
+                           'bytes': payload[present].astype(np.int64),
+                           'first_time': time[first],
+                           'last_time': time[last[present]]},
+                          index=pd.Index(present, name='tcp.stream'))
+    for column in CENSUS_ENDPOINT_COLUMNS:
+        if column in df.columns:
+            census[column] = df[column].to_numpy()[first]
+    return census
+
+
+# census of the packets of two consecutive chunks: counts add up, first values come from the earlier chunk and
+# the last time from the later one
+def merge_census(census, other):
+    if census is None:
+        return other
+    index = census.index.union(other.index)
+    merged = census.combine_first(other)[census.columns]
+    for column in ('packets', 'bytes'):
+        merged[column] = census[column].reindex(index, fill_value=0) + other[column].reindex(index, fill_value=0)
+    merged['last_time'] = other['last_time'].reindex(index).fillna(census['last_time'].reindex(index))
+    return merged.astype(census.dtypes.to_dict())
+
+
+def save_stream_census(csv_path, census):
+    census_path = cache_path(csv_path, suffix=CENSUS_SUFFIX)
+    os.makedirs(os.path.dirname(census_path), exist_ok=True)
+    content = dict(source_key(csv_path), census=census.reset_index().to_dict(orient='list'))
+    part = temp_path(census_path)
+    with open(part, 'w') as f:
+        json.dump(content, f, default=int)
+    os.replace(part, census_path)
+
+
+# census saved by a previous run, None if missing or built from another version of the csv
+def load_stream_census(csv_path):
+    try:
+        with open(cache_path(csv_path, suffix=CENSUS_SUFFIX)) as f:
+            content = json.load(f)
+    except (OSError, ValueError):
+        return None
+    key = source_key(csv_path)
+    if any(content.get(name) != value for name, value in key.items()):
+        return None
+    census = pd.DataFrame(content['census']).set_index('tcp.stream')
+    # json has no unsigned types, give the endpoints their loader types back like a census of the packets
+    for column in CENSUS_ENDPOINT_COLUMNS:
+        if column in census.columns:
+            census[column] = census[column].astype(np.uint32 if SCHEMA[column] == 'ipv4' else SCHEMA[column])
+    return census
+
+
+# stream ids sorted by packets, count=None returns every stream carrying at least min_share of the packets
+def dominant_streams(census, count=1, min_share=0.0):
+    ranked = census.sort_values('packets', ascending=False, kind='stable')
+    ranked = ranked[ranked['packets'] >= min_share * census['packets'].sum()]
+    if count is not None:
+        ranked = ranked.iloc[:count]
+    return ranked.index.tolist()
+
+
+# filter traffic of the actual tcp stream, drop the rest.
+# the pcap file show the data stream on ID 0 or 1. Must identify and filter the right tcp stream ID.
+# None for a capture without tcp packets, its run is empty
+def find_stream_index(census):
+    streams = dominant_streams(census, count=1)
+    return streams[0] if streams else None
+
+
+# running sums of a series given in pieces: sums[k] and counts[k] are the sum and the number of the non NaN values
+# before row k of the rows held (the kept tail of the previous pieces, then the new piece). np.cumsum adds the values
+# one by one, so the sums continue those of the previous pieces exactly as if the series was given at once.
+class RunningSums:
+    def __init__(self):
+        self.sums = np.zeros(1)
+        self.counts = np.zeros(1, dtype=np.int64)
+
+    def extend(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        valid = ~np.isnan(values)
+        sums = np.cumsum(np.concatenate((self.sums[-1:], np.where(valid, values, 0.0))))
+        counts = np.cumsum(np.concatenate((self.counts[-1:], valid)))
+        self.sums = np.concatenate((self.sums, sums[1:]))
+        self.counts = np.concatenate((self.counts, counts[1:]))
+
+    # sum and number of the non NaN values of rows [first, last] for every pair, the sum is NaN without any value
+    def window(self, first, last):
+        counts = self.counts[last + 1] - self.counts[first]
+        sums = np.where(counts > 0, self.sums[last + 1] - self.sums[first], np.nan)
+        return sums, counts
+
+    def drop(self, rows):
+        self.sums = self.sums[rows:]
+        self.counts = self.counts[rows:]
+
+
+def _nanoseconds(seconds):
+    return pd.to_timedelta(seconds, unit='s').to_numpy().astype(np.int64) if np.ndim(seconds) else \
+        pd.Timedelta(seconds=seconds).value
+
+
+# what the time windows of the next chunk need from the previous ones: per subset of the packets (all, ACKs, ...)
+# the times of the last horizon seconds and the running sums of every statistic over them. A run given at once
+# needs no horizon.
+class WindowCarry:
+    def __init__(self, horizon=None):
+        self.horizon = horizon
+        self.times = {}
+        self.sums = {}
+        self.extended = set()  # (subset, values) already extended with the current piece
+
+    # times (ns) of the kept tail of subset followed by time, the new piece
+    def extend_time(self, subset, time):
+        if subset not in self.extended:
+            self.times[subset] = np.concatenate((self.times.get(subset, np.empty(0, dtype=np.int64)), time))
+            self.extended.add(subset)
+        return self.times[subset]
+
+    def running_sums(self, subset, name, values):
+        if (subset, name) not in self.extended:
+            self.sums.setdefault((subset, name), RunningSums()).extend(values)
+            self.extended.add((subset, name))
+        return self.sums[(subset, name)]
+
+    # the piece is done: keep the rows of the last horizon seconds before last_ns, the time of its last packet
+    def advance(self, last_ns):
+        for subset, times in self.times.items():
+            drop = int(np.searchsorted(times, last_ns - _nanoseconds(self.horizon), side='right'))
+            self.times[subset] = times[drop:]
+            for (sums_subset, _), sums in self.sums.items():
+                if sums_subset == subset:
+                    sums.drop(drop)
+        self.extended = set()
+
+
+# trailing time windows over a sorted time column (seconds): the window of a packet at time t holds the packets
+# in (t - window, t], compared in integer nanoseconds like a pandas time based rolling window. The first row of
+# every window is a binary search and its sums are differences of running sums, so every statistic costs O(n).
+# With a WindowCarry the time column is one chunk of a run and the windows reach back into the previous chunks;
+# the statistics are the ones of the whole run. subset and name key the carried tails, the same values keep the
+# same name from chunk to chunk.
+class TimeWindows:
+    def __init__(self, time, carry=None, subset='packets'):
+        self.time = np.asarray(time, dtype=np.float64)
+        self.carry = WindowCarry() if carry is None else carry
+        self.subset_name = subset
+        self.ns = _nanoseconds(self.time)
+        self.all_ns = self.carry.extend_time(subset, self.ns)
+        self.rows = np.arange(len(self.all_ns) - len(self.ns), len(self.all_ns))
+
+    # windows restricted to the rows of a boolean mask (e.g. packets that carry an ACK RTT)
+    def subset(self, mask, subset):
+        return TimeWindows(self.time[np.asarray(mask, dtype=bool)], self.carry, subset)
+
+    # sums of values over the windows. name keys the running sums carried to the next chunk; without a name the
+    # sums start at this piece, for a whole run only.
+    def _window(self, values, window, name):
+        first = np.searchsorted(self.all_ns, self.ns - _nanoseconds(window), side='right')
+        if name is None:
+            sums = RunningSums()
+            sums.extend(values)
+        else:
+            sums = self.carry.running_sums(self.subset_name, name, values)
+        return sums.window(first, self.rows)
+
+    def mean(self, values, window, name=None):
+        sums, counts = self._window(values, window, name)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return sums / counts
+
+    def sum(self, values, window, name=None):
+        return self._window(values, window, name)[0]
+
+    def count(self, window):
+        first = np.searchsorted(self.all_ns, self.ns - _nanoseconds(window), side='right')
+        return (self.rows + 1 - first).astype(np.float64)
+
+    # sum(numerator) / sum(denominator) over the same window, e.g. bytes / elapsed time
+    def ratio(self, numerator, denominator, window, names=(None, None)):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return self.sum(numerator, window, names[0]) / self.sum(denominator, window, names[1])
+
+
+# as-of join of samples on a time grid: for every grid time the last sample at or before it, NaN if there is none
+# within tolerance seconds. pd.merge_asof walks both sorted columns once.
+def asof(grid, time, values, tolerance=None):
+    samples = pd.DataFrame({'time': np.asarray(time, dtype=np.float64), 'value': np.asarray(values, dtype=np.float64)})
+    joined = pd.merge_asof(pd.DataFrame({'time': np.asarray(grid, dtype=np.float64)}), samples, on='time',
+                           direction='backward', tolerance=tolerance)
+    return joined['value'].to_numpy()
+
+
+# throughput (bits/s) as bytes in flight / ACK RTT on a fixed time grid from start to end. Bytes in flight are
+# sampled on data packets and RTT on ACKs (other rows): both are carried forward as-of to the grid, averaged over
+# window seconds and divided. The samples can be added in pieces in time order (chunked analysis): the grid points
+# before the last sample time are computed from the samples so far, the last samples and the running sums of the
+# last window are kept for the next points.
+class GridThroughput:
+    def __init__(self, start, end, step, window, tolerance=None):
+        self.start = start
+        self.step = step
+        self.size = int(np.floor((end - start) / step)) + 1
+        self.points = max(1, int(round(window / step)))
+        self.tolerance = tolerance
+        self.next = 0  # first grid point not computed yet
+        self.samples = {'bif': (np.empty(0), np.empty(0)), 'rtt': (np.empty(0), np.empty(0))}
+        self.sums = {'bif': RunningSums(), 'rtt': RunningSums()}
+
+    # add samples and return (grid, throughput) of the grid points before until, of all the remaining points when
+    # until is None (no sample left)
+    def add(self, bif_time, bif, rtt_time, rtt, until=None):
+        stop = self.size
+        if until is not None:
+            stop = min(self.size, max(self.next, int(np.floor((until - self.start) / self.step)) + 2))
+        grid = self.start + self.step * np.arange(self.next, stop)
+        if until is not None:
+            grid = grid[:np.searchsorted(grid, until, side='left')]
+        means = {}
+        for name, time, values in (('bif', bif_time, bif), ('rtt', rtt_time, rtt)):
+            time = np.concatenate((self.samples[name][0], np.asarray(time, dtype=np.float64)))
+            values = np.concatenate((self.samples[name][1], np.asarray(values, dtype=np.float64)))
+            sums = self.sums[name]
+            sums.extend(asof(grid, time, values, self.tolerance))
+            rows = np.arange(len(sums.sums) - 1 - len(grid), len(sums.sums) - 1)
+            total, counts = sums.window(np.maximum(rows - self.points + 1, 0), rows)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                means[name] = total / counts
+            sums.drop(max(0, len(sums.sums) - self.points))
+            # the last sample at or before the last grid point is still needed by the next points
+            keep = max(0, int(np.searchsorted(time, grid[-1], side='right')) - 1) if len(grid) else 0
+            self.samples[name] = (time[keep:], values[keep:])
+        self.next += len(grid)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return grid, 8 * means['bif'] / means['rtt']
+
+
+# GridThroughput of samples given at once, the grid spans them
+def bif_rtt_throughput(bif_time, bif, rtt_time, rtt, step, window, tolerance=None):
+    if len(bif_time) == 0 or len(rtt_time) == 0:
+        return np.empty(0), np.empty(0)
+    throughput = GridThroughput(max(bif_time[0], rtt_time[0]), max(bif_time[-1], rtt_time[-1]), step, window,
+                                tolerance)
+    return throughput.add(bif_time, bif, rtt_time, rtt)
+
+
+# max of the per second loss ratio over the seconds of a window, None if a second is missing
+def _window_max(series, first, last):
+    try:
+        return max(series[second] for second in range(first, last + 1))
+    except KeyError:
+        return None
+
+
+# rows [first, last) of the packets with start <= time < end (time <= end with closed='both'), found by binary
+# search on the sorted time column: extracting a window costs its size, not the size of the file
+def window_slice(time, start, end, closed='left'):
+    first = int(np.searchsorted(time, start, side='left'))
+    last = int(np.searchsorted(time, end, side='right' if closed == 'both' else 'left'))
+    return first, max(first, last)
+
+
+def _window_values(packets, retransmissions, gaps):
+    return {
+        'packets': packets,
+        'retransmissions': retransmissions,
+        'loss': 100 * retransmissions / packets if packets else None,
+        'gaps': gaps,
+        'gap_count': len(gaps),
+        'max_gap': gaps.max() if len(gaps) else None,
+    }
+
+
+# statistics of the packets in [start, end): gaps between packets in (low, high) with their max and count,
+# packets, retransmissions and loss ratio (%). Empty values are None.
+def event_window(time, gaps, retransmission, start, end, low=0.0, high=None):
+    first, last = window_slice(time, start, end)
+    window_gaps = gaps[first:last]
+    selected = window_gaps > low
+    if high is not None:
+        selected &= window_gaps < high
+    return _window_values(last - first, int(retransmission[first:last].sum()), window_gaps[selected])
+
+
+# event_window for every declared window: name -> (first second, last second, min gap, max gap), as in LINK_WINDOWS
+def event_windows(time, gaps, retransmission, windows):
+    return {name: event_window(time, gaps, retransmission, first, last + 1, low, high)
+            for name, (first, last, low, high) in windows.items()}
+
+
+# event windows of the packets of two consecutive chunks
+def merge_event_windows(windows, other):
+    if windows is None:
+        return other
+    return {name: _window_values(window['packets'] + other[name]['packets'],
+                                 window['retransmissions'] + other[name]['retransmissions'],
+                                 np.concatenate((window['gaps'], other[name]['gaps'])))
+            for name, window in windows.items()}
+
+
+# windows of event_windows for a run: the link windows of its kind (make before break or not) and the steady second
+def declared_windows(filename, config):
+    return dict(LINK_WINDOWS_MBB if 'mbb' in filename else LINK_WINDOWS,
+                steady=(config['steady_index'], config['steady_index'], LINK_STEADY_MIN, None))
+
+
+# add the packets of df to a BinAccumulator (see pcapcsv_bins.py): packets, bytes, retransmissions, lost segments
+def add_bin_metrics(accumulator, df):
+    flags = df[FLAGS_COLUMN].to_numpy()
+    lost_segment = None
+    if 'tcp.analysis.lost_segment' in packed_flags(df):
+        lost_segment = flag_mask(flags, 'tcp.analysis.lost_segment')
+    return accumulator.add(df['tcp.time_relative'], length=df['tcp.len'],
+                           retransmission=flag_mask(flags, 'tcp.analysis.retransmission'), lost_segment=lost_segment)
+
+
+# add the packets of df to the per interval accumulator (1 s or config 'bin_width'): bin counters, mean ACK RTT
+# and largest gap between packets
+def add_interval_bins(accumulator, df, is_ack):
+    add_bin_metrics(accumulator, df)
+    time = df['tcp.time_relative'].to_numpy()
+    accumulator.add_mean('ack_rtt', time, np.where(is_ack, df['tcp.analysis.ack_rtt'].to_numpy(), np.nan))
+    accumulator.add_max('max_gap', time, df['link_unavailable'].to_numpy())
+    return accumulator
+
+
+# counters, ACK RTT and max gap of bin_width second bins, empty bins included
+def bin_metrics(df, bin_width, is_ack):
+    return add_interval_bins(BinAccumulator(bin_width), df, is_ack).table(keep_empty=True)
+
+
+# per second metrics table of one run: the 1 s bin counters (pkt_sent, pkt_retransmit, pkt_loss_ratio, bytes,
+# throughput in bits/s, ...) plus the mean ACK RTT and the largest gap between packets of every second
+def per_second_table(seconds):
+    table = seconds.table()
+    if not len(table.columns):
+        # empty stream: no bin was added, keep the columns every run reads
+        table = pd.DataFrame({'packets': pd.Series(dtype=np.int64), 'retransmissions': pd.Series(dtype=np.int64),
+                              'loss_ratio': pd.Series(dtype=np.float64)}, index=table.index)
+    table.index = pd.Index(table.index.astype(np.int64), name='tcp.time_second')
+    return table.rename(columns={'packets': 'pkt_sent', 'retransmissions': 'pkt_retransmit',
+                                 'loss_ratio': 'pkt_loss_ratio'})
+
+
+def per_second_metrics(df, is_ack):
+    return per_second_table(add_interval_bins(BinAccumulator(1), df, is_ack))
+
+
+# data packets that carry bytes in flight, the samples of the bytes in flight series
+def _is_data(df):
+    return (df['tcp.analysis.bytes_in_flight'].notna() & (df['tcp.dstport'] == IPERF_PORT)).to_numpy()
+
+
+def _extent(x):
+    return (len(x), x[0], x[-1]) if len(x) else (0, np.nan, np.nan)
+
+
+# number of points and first/last time of the x columns of the plot series of sorted packets: all packets, the
+# ACKs with an RTT and, when bytes in flight were loaded, the data packets
+def series_extents(df, is_ack):
+    time = df['tcp.time_relative'].to_numpy()
+    extents = {'packets': _extent(time), 'acks': _extent(time[is_ack])}
+    if 'tcp.analysis.bytes_in_flight' in df.columns:
+        extents['data'] = _extent(time[_is_data(df)])
+    return extents
+
+
+# extents of the packets of two consecutive chunks
+def merge_extents(extents, other):
+    if extents is None:
+        return other
+    merged = {}
+    for kind, (count, first, last) in extents.items():
+        other_count, other_first, other_last = other[kind]
+        merged[kind] = (count + other_count, first if count else other_first, other_last if other_count else last)
+    return merged
+
+
+# time series of the stateless figures, (x, y, markevery) decimated for plotting, from packets sorted by time given
+# in one piece (plot_series) or chunk by chunk (ChunkedSeries). The extents (series_extents of all the packets)
+# fix the length and x range of every series in advance: the rolling windows go on over the tail of the previous
+# chunk (WindowCarry), every series is decimated as it grows (pcapcsv_decimate.Decimator) and the series are the
+# same whatever the chunking. Series of optional columns (window size, bytes in flight) are only present when the
+# column was loaded.
+class PlotSeries:
+    def __init__(self, config, extents):
+        self.config = config
+        self.extents = extents
+        self.window_rtt = 1 / config['rolling_factor_rtt_ack']
+        self.window_loss = 1 / config['rolling_factor_loss']
+        self.window_time_delta = 1 / config['rolling_factor_time_delta']
+        self.window_throughput = 1 / config['rolling_factor']
+        self.carry = WindowCarry(max(1, self.window_rtt, self.window_loss, self.window_time_delta,
+                                     self.window_throughput))
+        self.decimators = {}  # series name -> (Decimator, kind of x)
+        self.grid = None
+        if 'data' in extents and extents['data'][0] and extents['acks'][0]:
+            data, acks = extents['data'], extents['acks']
+            self.grid = GridThroughput(max(data[1], acks[1]), max(data[2], acks[2]), config['grid_step'],
+                                       self.window_time_delta, config['asof_tolerance'])
+        # link unavailability: the points kept, the last packet (kept or not once the gap of the next one is known)
+        # and whether the packet before it is a gap (or there is none)
+        self.link = []
+        self.link_last = None
+        self.link_before = True
+
+    def _add(self, name, kind, x, y):
+        if name not in self.decimators:
+            if kind == 'grid':
+                grid = self.grid
+                extent = (0, np.nan, np.nan)
+                if grid is not None:
+                    extent = (grid.size, grid.start, grid.start + grid.step * (grid.size - 1))
+            else:
+                extent = self.extents[kind]
+            self.decimators[name] = (Decimator(*extent, self.config['max_plot_points'], self.config['decimation']),
+                                     kind)
+        self.decimators[name][0].add(x, y)
+
+    # add packets sorted by time, all later than the packets already added
+    def add(self, df, is_ack):
+        if len(df) == 0:
+            return
+        time = df['tcp.time_relative'].to_numpy()
+        windows = TimeWindows(time, self.carry)
+        ack_windows = windows.subset(is_ack, 'acks')
+        ack_time = time[is_ack]
+        ack_rtt = df['tcp.analysis.ack_rtt'].to_numpy()[is_ack]
+        self._add('ack_rtt', 'acks', ack_time, ack_windows.mean(ack_rtt, self.window_rtt, 'ack_rtt'))
+        self._add('time_delta', 'packets', time,
+                  windows.mean(df['tcp.time_delta'], self.window_time_delta, 'time_delta'))
+        self._add('payload', 'packets', time, windows.mean(df['tcp.len'], 1, 'len'))
+        self._add('segment_length', 'packets', time, df['tcp.len'])
+        # bits sent in the window / time covered by their delta t
+        self._add('throughput', 'packets', time,
+                  8 * windows.ratio(df['tcp.len'], df['tcp.time_delta'], self.window_throughput, ('len', 'time_delta')))
+        retransmission = df['retransmission']
+        self._add('loss', 'packets', time, 100 * windows.mean(retransmission, self.window_loss, 'retransmission'))
+        self._add('retransmit', 'packets', time, windows.sum(retransmission, self.window_loss, 'retransmission'))
+        self._add('sent', 'packets', time, windows.count(self.window_loss))
+
+        if 'tcp.window_size' in df.columns:
+            self._add('window_size', 'acks', ack_time,
+                      ack_windows.mean(df['tcp.window_size'].to_numpy()[is_ack], self.window_rtt, 'window_size'))
+        if 'tcp.analysis.bytes_in_flight' in df.columns:
+            is_data = _is_data(df)
+            bytes_in_flight = df['tcp.analysis.bytes_in_flight'].to_numpy()[is_data]
+            self._add('bytes_in_flight', 'data', time[is_data],
+                      windows.subset(is_data, 'data').mean(bytes_in_flight, self.window_rtt, 'bytes_in_flight'))
+            if self.grid is not None:
+                self._add('bif_throughput', 'grid',
+                          *self.grid.add(time[is_data], bytes_in_flight, ack_time, ack_rtt, until=time[-1]))
+            else:
+                self._add('bif_throughput', 'grid', np.empty(0), np.empty(0))
+        self._add_link(time, df['link_unavailable'].to_numpy())
+        self.carry.advance(windows.ns[-1])
+
+    # points under the lower ylim of the figure are not visible. Keep the gaps, their neighbours (so every spike is
+    # drawn from the baseline like in the full series) and the first/last point.
+    def _add_link(self, time, link):
+        gap = link >= self.config['link_unavailable_min_plot']
+        if self.link_last is not None:
+            time = np.concatenate(([self.link_last[0]], time))
+            link = np.concatenate(([self.link_last[1]], link))
+            gap = np.concatenate(([self.link_last[2]], gap))
+        keep = gap.copy()
+        keep[1:] |= gap[:-1]
+        keep[:-1] |= gap[1:]
+        keep[0] |= self.link_before
+        self.link.append((time[:-1][keep[:-1]], link[:-1][keep[:-1]]))
+        self.link_before = bool(gap[-2]) if len(gap) > 1 else self.link_before
+        self.link_last = (time[-1], link[-1], gap[-1])
+
+    # the series once all the packets were added. rolling_sma_window: packets per second, sets the marker spacing
+    def result(self, rolling_sma_window):
+        config = self.config
+        duration = config['test_duration']
+        if self.grid is not None and 'bif_throughput' in self.decimators:
+            self._add('bif_throughput', 'grid', *self.grid.add(np.empty(0), np.empty(0), np.empty(0), np.empty(0)))
+        markers = {'packets': config['marker_every_s'] * rolling_sma_window,
+                   'acks': config['marker_every_s'] * int(self.extents['acks'][0] / duration),
+                   'data': config['marker_every_s'] * int(self.extents.get('data', (0,))[0] / duration),
+                   'grid': config['marker_every_s'] / config['grid_step']}
+        series = {name: decimator.result(markers[kind]) for name, (decimator, kind) in self.decimators.items()}
+        if self.link_last is not None:
+            self.link.append(([self.link_last[0]], [self.link_last[1]]))
+            time, link = (np.concatenate(values) for values in zip(*self.link))
+            series['link_unavailable'] = decimate(time, link, 1, config['max_plot_points'], config['decimation'])
+        return series
+
+
+# plot series of the packets of one run, sorted by time
+def plot_series(df, is_ack, config, rolling_sma_window):
+    if len(df) == 0:
+        return {}
+    series = PlotSeries(config, series_extents(df, is_ack))
+    series.add(df, is_ack)
+    return series.result(rolling_sma_window)
+
+
+# scan one run: select the iperf stream, build the per second table, the plot series and the event window values
+def analyze_frame(df, filename, config=None):
+    config = dict(DEFAULT_CONFIG, **(config or {}))
+    if config['multi_stream']:
+        return analyze_streams(df, filename, config)
+
+    census = config.get('stream_census')
+    if census is None:
+        census = stream_census(df)
+    stream_index = find_stream_index(census)
+    df = df[df['tcp.stream'] == stream_index]
+    if not df['tcp.time_relative'].is_monotonic_increasing:
+        df = df.sort_values('tcp.time_relative', kind='stable')
+    # retransmission bit of the packed analysis flags as 0/1, averaged and summed by the loss metrics
+    df['retransmission'] = flag_mask(df[FLAGS_COLUMN], 'tcp.analysis.retransmission').astype(np.int64)
+    # .diff returns the difference between previous row by default, useful to find all the discontinuities in time
+    df['link_unavailable'] = df['tcp.time_relative'].diff()
+    is_ack = ((df['tcp.analysis.ack_rtt'].notna()) & (df['tcp.srcport'] == IPERF_PORT)).to_numpy()
+
+    metrics = per_second_metrics(df, is_ack)
+    bins = bin_metrics(df, config['bin_width'], is_ack) if config['bin_width'] else None
+    windows = event_windows(df['tcp.time_relative'].to_numpy(), df['link_unavailable'].to_numpy(),
+                            df['retransmission'].to_numpy(), declared_windows(filename, config))
+    result = run_result(filename, stream_index, census, len(df), metrics, bins, windows, config)
+    if config['plot_series']:
+        result['series'] = plot_series(df, is_ack, config, result['rolling_sma_window'])
+    return result
+
+
+# every stream with at least config 'stream_min_share' of the packets in one grouped pass, for experiments with
+# parallel flows. The selected packets are sorted once by (stream, time), so every stream is a contiguous block of
+# rows: gaps are differences within a block, every counter is one np.bincount over (stream, bin) keys (GroupedBins)
+# and the event windows of a stream are binary searches in its block. Returns the analyze_frame result of the
+# dominant stream plus result['streams'] (stream index -> result of that stream, without plot series) and
+# result['aggregate'] (all selected streams as one flow: counters add up, gaps are the silences between packets
+# of any stream).
+def analyze_streams(df, filename, config):
+    census = config.get('stream_census')
+    if census is None:
+        census = stream_census(df)
+    streams = dominant_streams(census, count=None, min_share=config['stream_min_share'])
+    if not streams:
+        empty = analyze_frame(df, filename, dict(config, multi_stream=False, stream_census=census))
+        return dict(empty, streams={}, aggregate=empty)
+    codes = np.full(int(census.index.max()) + 1, -1, dtype=np.int64)
+    codes[streams] = np.arange(len(streams))
+    group = codes[df['tcp.stream'].to_numpy().astype(np.int64)]
+    selected = group >= 0
+    df = df[selected]
+    group = group[selected]
+    # lexsort is stable: packets with the same time keep the file order, like the sort of analyze_frame
+    order = np.lexsort((df['tcp.time_relative'].to_numpy(), group))
+    df = df.take(order)
+    group = group[order]
+    bounds = np.searchsorted(group, np.arange(len(streams) + 1))
+    time = df['tcp.time_relative'].to_numpy()
+    retransmission = flag_mask(df[FLAGS_COLUMN], 'tcp.analysis.retransmission').astype(np.int64)
+    gaps = np.diff(time, prepend=np.nan)
+    gaps[bounds[:-1]] = np.nan  # first packet of every stream
+    df['retransmission'] = retransmission
+    df['link_unavailable'] = gaps
+    is_ack = ((df['tcp.analysis.ack_rtt'].notna()) & (df['tcp.srcport'] == IPERF_PORT)).to_numpy()
+
+    seconds = add_interval_bins(GroupedBins(group, len(streams), 1), df, is_ack)
+    fine = add_interval_bins(GroupedBins(group, len(streams), config['bin_width']), df, is_ack) \
+        if config['bin_width'] else None
+    declared = declared_windows(filename, config)
+    results = {}
+    for code, stream_index in enumerate(streams):
+        first, last = bounds[code], bounds[code + 1]
+        windows = event_windows(time[first:last], gaps[first:last], retransmission[first:last], declared)
+        bins = fine.group_bins(code).table(keep_empty=True) if fine is not None else None
+        results[stream_index] = run_result(filename, stream_index, census, int(last - first),
+                                           per_second_table(seconds.group_bins(code)), bins, windows, config)
+
+    # aggregate: the same bins summed over the streams, gaps and max gap of the packets of all streams in time order
+    merged = np.argsort(time, kind='stable')
+    merged_time = time[merged]
+    merged_gaps = np.diff(merged_time, prepend=np.nan)
+    aggregates = []
+    for accumulator in (seconds, fine):
+        if accumulator is not None:
+            accumulator = accumulator.total()
+            accumulator.maxima.pop('max_gap')
+            accumulator.add_max('max_gap', merged_time, merged_gaps)
+        aggregates.append(accumulator)
+    windows = event_windows(merged_time, merged_gaps, retransmission[merged], declared)
+    aggregate = run_result(filename, streams, census, len(df), per_second_table(aggregates[0]),
+                           aggregates[1].table(keep_empty=True) if fine is not None else None, windows, config)
+
+    result = dict(results[streams[0]], streams=results, aggregate=aggregate)
+    if config['plot_series']:
+        dominant = df.iloc[bounds[0]:bounds[1]]
+        result['series'] = plot_series(dominant, is_ack[bounds[0]:bounds[1]], config, result['rolling_sma_window'])
+    return result
+
+
+# result of one run from its per second table and event windows, the same for the in-memory and chunked analysis
+def run_result(filename, stream_index, census, packets, metrics, bins, windows, config):
+    pkt_sent = metrics['pkt_sent']
+    pkt_loss_ratio = metrics['pkt_loss_ratio']
+    mbb = 'mbb' in filename
+    loss_windows = {'steady': pkt_loss_ratio.get(config['steady_index'])}
+    for name, (first, last) in LOSS_WINDOWS.items():
+        if mbb or name == 'reconfiguration':
+            loss_windows[name] = _window_max(pkt_loss_ratio, first, last)
+    link_windows = {name: window['max_gap'] for name, window in windows.items()}
+    link_windows['steady'] = windows['steady']['gaps'].tolist()
+
+    return {
+        'filename': filename,
+        'stream_index': stream_index,
+        'stream_census': census,
+        'packets': packets,
+        'rolling_sma_window': int(pkt_sent.mean()) if len(pkt_sent) else 0,
+        'metrics': metrics,
+        'bins': bins,
+        'pkt_sent': pkt_sent,
+        'pkt_retransmit': metrics['pkt_retransmit'],
+        'pkt_loss_ratio': pkt_loss_ratio,
+        'loss_windows': loss_windows,
+        'link_windows': link_windows,
+        'event_windows': windows,
+        'series': {},
+    }
+
+
+# analysis state of one run carried from chunk to chunk, for captures that do not fit in memory. Chunks come in
+# file order; the packets of the last chunk_reorder_window seconds are held back and sorted with the next chunk,
+# like the in-memory analysis sorts the whole stream. The gap of the first packet released is measured from the
+# last packet of the previous release, the per second and fine bins add up in BinAccumulators and the event
+# windows join their gaps. The result is the one of analyze_frame; with plot series the run also records their
+# extents, and ChunkedSeries builds them in a second pass. stream_index is one tcp.stream (the dominant one by
+# default) or a list of streams analyzed as one flow, like the aggregate of analyze_streams.
+class ChunkedRun:
+    def __init__(self, filename, census, config=None, stream_index=None):
+        self.config = dict(DEFAULT_CONFIG, **(config or {}))
+        self.filename = filename
+        self.census = census
+        self.stream_index = find_stream_index(census) if stream_index is None else stream_index
+        self.streams = list(np.atleast_1d(self.stream_index))
+        self.declared = declared_windows(filename, self.config)
+        self.seconds = BinAccumulator(1)
+        self.bins = BinAccumulator(self.config['bin_width']) if self.config['bin_width'] else None
+        self.windows = None
+        self.extents = None  # series_extents of the packets so far, with plot series
+        self.held = None  # packets of the last chunk_reorder_window seconds, not analyzed yet
+        self.last_time = np.nan
+        self.packets = 0
+
+    def update(self, chunk):
+        df = chunk[chunk['tcp.stream'].isin(self.streams)]
+        if self.held is not None:
+            df = pd.concat([self.held, df], ignore_index=True)
+            df.attrs.update(self.held.attrs)
+        if len(df) == 0:
+            return
+        if not df['tcp.time_relative'].is_monotonic_increasing:
+            df = df.sort_values('tcp.time_relative', kind='stable')
+        time = df['tcp.time_relative'].to_numpy()
+        release = int(np.searchsorted(time, time[-1] - self.config['chunk_reorder_window'], side='left'))
+        self.held = df.iloc[release:]
+        self._analyze(df.iloc[:release])
+
+    # analyze packets sorted by time, all later than the packets already analyzed
+    def _analyze(self, df):
+        if len(df) == 0:
+            return
+        time = df['tcp.time_relative'].to_numpy()
+        if time[0] < self.last_time:
+            raise ValueError(self.filename + ': packets out of time order by more than chunk_reorder_window, '
+                             'analyze it in memory')
+        df['retransmission'] = flag_mask(df[FLAGS_COLUMN], 'tcp.analysis.retransmission').astype(np.int64)
+        df['link_unavailable'] = np.diff(time, prepend=self.last_time)
+        is_ack = ((df['tcp.analysis.ack_rtt'].notna()) & (df['tcp.srcport'] == IPERF_PORT)).to_numpy()
+        self._add(df, is_ack)
+        self.last_time = time[-1]
+        self.packets += len(df)
+
+    def _add(self, df, is_ack):
+        add_interval_bins(self.seconds, df, is_ack)
+        if self.bins is not None:
+            add_interval_bins(self.bins, df, is_ack)
+        self.windows = merge_event_windows(self.windows, event_windows(df['tcp.time_relative'].to_numpy(),
+                                                                       df['link_unavailable'].to_numpy(),
+                                                                       df['retransmission'].to_numpy(),
+                                                                       self.declared))
+        if self.config['plot_series']:
+            self.extents = merge_extents(self.extents, series_extents(df, is_ack))
+
+    def _flush(self):
+        if self.held is not None:
+            self._analyze(self.held)
+            self.held = None
+
+    def result(self):
+        self._flush()
+        windows = self.windows
+        if windows is None:
+            empty = np.empty(0)
+            windows = event_windows(empty, empty, empty, self.declared)
+        bins = self.bins.table(keep_empty=True) if self.bins is not None else None
+        return run_result(self.filename, self.stream_index, self.census, self.packets,
+                          per_second_table(self.seconds), bins, windows, self.config)
+
+
+# second pass of a chunked run over the same chunks: the packets are released in the same order and fed to
+# PlotSeries with the extents recorded by the first pass
+class ChunkedSeries(ChunkedRun):
+    def __init__(self, run):
+        super().__init__(run.filename, run.census, run.config, run.stream_index)
+        self.series = PlotSeries(self.config, run.extents)
+
+    def _add(self, df, is_ack):
+        self.series.add(df, is_ack)
+
+    def result(self, rolling_sma_window):
+        self._flush()
+        return self.series.result(rolling_sma_window)
+
+
+# analyze one csv chunk by chunk, memory is bound by config['chunk_rows'] (and the packets of the longest rolling
+# window for the plot series). Without a saved census the file is read once more for it; the plot series need a
+# second pass, once the length of every series is known. With multi_stream every selected stream and their
+# aggregate are analyzed in the same passes, the result is the one of analyze_streams.
+def analyze_file_chunked(path, filename, config=None):
+    config = dict(DEFAULT_CONFIG, **(config or {}))
+    csv_path = os.path.join(path, filename)
+    print('analyzing in chunks of ' + str(config['chunk_rows']) + ' rows: ' + path + filename)
+    census = load_stream_census(csv_path)
+    if census is None:
+        for chunk in read_csv_chunks(csv_path, usecols=config['usecols'], chunk_rows=config['chunk_rows']):
+            census = merge_census(census, stream_census(chunk))
+        save_stream_census(csv_path, census)
+    if config['multi_stream']:
+        streams = dominant_streams(census, count=None, min_share=config['stream_min_share'])
+        # without any stream the aggregate is the empty run of analyze_frame
+        runs = [ChunkedRun(filename, census, config, stream_index) for stream_index in streams + [streams or None]]
+    else:
+        runs = [ChunkedRun(filename, census, config)]
+    for chunk in read_csv_chunks(csv_path, usecols=config['usecols'], chunk_rows=config['chunk_rows']):
+        for run in runs:
+            run.update(chunk)
+    results = [run.result() for run in runs]
+    result = results[0]
+    if config['multi_stream']:
+        result = dict(result, streams=dict(zip(streams, results[:-1])), aggregate=results[-1])
+    if config['plot_series'] and runs[0].packets:
+        series = ChunkedSeries(runs[0])
+        for chunk in read_csv_chunks(csv_path, usecols=config['usecols'], chunk_rows=config['chunk_rows']):
+            series.update(chunk)
+        result['series'] = series.result(result['rolling_sma_window'])
+    return result
+
+
+def analyze_file(path, filename, config=None):
+    config = dict(DEFAULT_CONFIG, **(config or {}))
+    if config['chunk_rows']:
+        return analyze_file_chunked(path, filename, config)
+    csv_path = os.path.join(path, filename)
+    df = read_csv_cached(csv_path, usecols=config['usecols'])
+    print('analyzing: ' + path + filename)
+    census = load_stream_census(csv_path)
+    if census is None:
+        census = stream_census(df)
+        save_stream_census(csv_path, census)
+    return analyze_frame(df, filename, dict(config, stream_census=census))
+
+
+# analyze a sweep in a bounded process pool (pcapcsv_sweep.sweep), results are returned in the order of files_array
+def analyze_files(files_array, path, config=None, workers=None):
+    return list(sweep(files_array, path, partial(analyze_file, config=config), workers))
@@ -0,0 +1,278 @@
+'''
+Staged pipeline over a sweep: convert -> load -> metrics -> summarize -> render, all stages running at once.
+
+Instead of pcap_to_csv.py, then the analysis, then the plots one after another, an asyncio loop moves every run
+through the stages as soon as the previous one is done with it:
+- convert: tshark as an asyncio subprocess per pcap that is not up to date in the manifest of pcap_to_csv.py,
+  "tshark_workers" at a time and within the tshark memory budget (same estimate as pcap_to_csv.py)
+- load: parse the csv once into its columnar sidecar and stream census (pcapcsv_loader), in a process pool
+- metrics: pcapcsv_metrics.analyze_file on the sidecar, in the same process pool ("analysis_workers")
+- summarize: append the summary values to the summary store (pcapcsv_summary) in the event loop. Runs whose
+  summary is current are not analyzed again, unless their figure is rendered
+- render: one figure per run (throughput and per second loss) written to "render_dir", in the process pool
+Stages are connected by bounded queues ("pipeline_queue_size" runs, default two per consumer): a stage that runs
+ahead waits for the next one, so at most a few parsed runs are in memory whatever the sweep size. The figures of
+the first runs are on disk while later captures are still converting. At the end the loss boxplot of the sweep
+is rendered and the busy time of every stage is printed next to the wall time.
+
+TO BE EXECUTED in the computer/server where the pcap files are stored (tshark must be in the PATH).
+parameters.json: "datapath" (pcap and csv folder), optional "render_dir", "render_formats", "tshark_workers",
+"tshark_mem_budget_gb", "analysis_workers", "pipeline_queue_size", "manifest_full_hash",
+"manifest_reconvert_existing" (see pcap_to_csv.py).
+'''
+
+import os
+import time
+import asyncio
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import matplotlib
+
+from pcap_to_csv import (select_fields, tshark_args, field_profile, pcap_hash, estimate_tshark_memory,
+                         available_memory, load_manifest, append_manifest, compact_manifest, find_pending,
+                         partial_path, TSHARK_MEM_FRACTION)
+from pcapcsv_loader import read_csv_cached
+from pcapcsv_metrics import analyze_file, load_stream_census, save_stream_census, stream_census, DEFAULT_CONFIG
+from pcapcsv_summary import (tcp_fingerprint, make_entry, run_summary, append_summary, load_summary, summary_table,
+                             is_current)
+from pcapcsv_render import load_parameters, figure_name, BATCH_BACKEND, DEFAULT_FORMATS
+
+
+# memory budget of the running tshark jobs, asyncio version of pcap_to_csv.MemoryGate
+class AsyncMemoryGate:
+    def __init__(self, budget):
+        self.budget = budget
+        self.in_use = 0
+        self.condition = asyncio.Condition()
+
+    async def acquire(self, amount):
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.in_use == 0 or self.in_use + amount <= self.budget)
+            self.in_use += amount
+
+    async def release(self, amount):
+        async with self.condition:
+            self.in_use -= amount
+            self.condition.notify_all()
+
+
+# convert one pcap with tshark running as a subprocess of the event loop, returns the manifest entry
+async def convert_file(path, pcap_file, filename, gate, full_hash=False):
+    pcap_path = os.path.join(path, pcap_file)
+    csv_path = os.path.join(path, filename)
+    part_path = partial_path(csv_path)
+    fields = select_fields(filename)
+    stat = os.stat(pcap_path)
+    entry = {'pcap': pcap_file, 'csv': filename, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+             'hash': pcap_hash(pcap_path, full_hash), 'profile': field_profile(fields)}
+    mem = estimate_tshark_memory(pcap_path)
+    await gate.acquire(mem)
+    try:
+        start = time.perf_counter()
+        proc = None
+        try:
+            with open(part_path, 'w') as outfile:
+                print('writing: ' + filename)
+                proc = await asyncio.create_subprocess_exec(*tshark_args(pcap_path, fields), stdout=outfile)
+                if await proc.wait() != 0:
+                    raise RuntimeError('tshark exit code ' + str(proc.returncode))
+                outfile.flush()
+                os.fsync(outfile.fileno())
+            os.replace(part_path, csv_path)
+        except BaseException:
+            # cancelled or interrupted: stop tshark and remove its output before anything is awaited, a second
+            # cancellation (asyncio.run cancelling the remaining tasks) can interrupt the await
+            if proc is not None and proc.returncode is None:
+                proc.kill()
+            if os.path.exists(part_path):
+                os.remove(part_path)
+            if proc is not None:
+                await proc.wait()
+            raise
+        entry['elapsed'] = time.perf_counter() - start
+        entry['csv_size'] = os.path.getsize(csv_path)
+        print('done: ' + filename + ' in ' + '{:.1f}'.format(entry['elapsed']) + ' s')
+        return entry
+    finally:
+        await gate.release(mem)
+
+
+# worker: build the sidecar and the stream census of a csv, nothing is returned to the parent
+def load_file(path, filename):
+    csv_path = os.path.join(path, filename)
+    df = read_csv_cached(csv_path, usecols=DEFAULT_CONFIG['usecols'])
+    if load_stream_census(csv_path) is None:
+        save_stream_census(csv_path, stream_census(df))
+    return filename
+
+
+# worker: throughput and per second loss of one run, saved as <render_dir>/<NN>_<title>.<format>
+def render_run(result, number, directory, formats):
+    matplotlib.use(BATCH_BACKEND, force=True)
+    import matplotlib.pyplot as plt
+    fig, (ax1, ax2) = plt.subplots(2, 1, sharex=True, figsize=(6, 6))
+    if 'throughput' in result['series']:
+        x, y, markevery = result['series']['throughput']
+        ax1.plot(x, y / 1e9)
+    ax1.set(title=result['filename'] + ' - Throughput and loss', ylabel='Throughput [Gbps]')
+    metrics = result['metrics']
+    ax2.plot(metrics.index, metrics['pkt_loss_ratio'], marker='.')
+    ax2.set(xlabel='Time [s]', ylabel='Packet loss [%]')
+    for ax in (ax1, ax2):
+        ax.grid(which='major', color='#a3a3a3', linestyle='--')
+    fig.set_tight_layout(True)
+    base_path = os.path.join(directory, figure_name(fig, number))
+    for fmt in formats:
+        fig.savefig(base_path + '.' + fmt, format=fmt)
+    plt.close(fig)
+    return base_path
+
+
+# a pipeline stage: `workers` coroutines take items from inbox, await work(item) and put the result in outbox.
+# When inbox is exhausted every consumer of outbox gets an end marker. Errors are printed and the item dropped.
+async def run_stage(name, inbox, outbox, work, workers, consumers, busy):
+    async def worker():
+        while True:
+            item = await inbox.get()
+            if item is None:
+                return
+            start = time.perf_counter()
+            try:
+                result = await work(item)
+            except Exception as e:
+                print('error in ' + name + ': ' + str(e))
+                result = None
+            busy[name] = busy.get(name, 0) + time.perf_counter() - start
+            if result is not None and outbox is not None:
+                await outbox.put(result)  # waits while the next stage is behind
+
+    await asyncio.gather(*(worker() for _ in range(workers)))
+    if outbox is not None:
+        for _ in range(consumers):
+            await outbox.put(None)
+
+
+async def run_pipeline(path, parameters):
+    loop = asyncio.get_running_loop()
+    tshark_workers = parameters.get("tshark_workers", 1)
+    analysis_workers = parameters.get("analysis_workers") or os.cpu_count()
+    directory = parameters.get("render_dir")
+    formats = parameters.get("render_formats") or DEFAULT_FORMATS
+    config = {'plot_series': bool(directory)}  # the series are only needed for the figures
+
+    mem_budget = parameters.get("tshark_mem_budget_gb")
+    if mem_budget is not None:
+        mem_budget = mem_budget * 1024 ** 3
+    else:
+        available = available_memory()
+        mem_budget = TSHARK_MEM_FRACTION * available if available is not None else float('inf')
+    gate = AsyncMemoryGate(mem_budget)
+
+    manifest = load_manifest(path)
+    full_hash = parameters.get("manifest_full_hash", False)
+    pending = find_pending(path, manifest, full_hash,
+                           adopt_existing=not parameters.get("manifest_reconvert_existing", False))
+    converting = {filename for pcap_file, filename in pending}
+    files_array = sorted(set(file for file in os.listdir(path) if file.endswith('.csv') and 'udp' not in file)
+                         | {filename for filename in converting if 'udp' not in filename})
+    numbers = {filename: i + 1 for i, filename in enumerate(files_array)}
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    # the workers are forked here, before the event loop starts any subprocess or thread
+    pool = ProcessPoolExecutor(max_workers=analysis_workers, mp_context=multiprocessing.get_context('fork'))
+    pool.submit(int).result()
+
+    fingerprint = tcp_fingerprint(config)
+    entries = load_summary(path)
+    manifest_lock = threading.Lock()
+    busy = {}
+
+    async def convert(item):
+        pcap_file, filename = item
+        if pcap_file is not None:
+            entry = await convert_file(path, pcap_file, filename, gate, full_hash)
+            append_manifest(path, entry, manifest_lock)
+            manifest[pcap_file] = entry
+        return filename if 'udp' not in filename else None  # udp runs are converted, not analyzed here
+
+    async def load(filename):
+        return await loop.run_in_executor(pool, load_file, path, filename)
+
+    async def metrics(filename):
+        return await loop.run_in_executor(pool, analyze_file, path, filename, config)
+
+    def current(filename):
+        return is_current(entries.get(filename), os.path.join(path, filename), fingerprint)
+
+    async def summarize(result):
+        if not current(result['filename']):
+            entry = make_entry(os.path.join(path, result['filename']), fingerprint, run_summary(result))
+            append_summary(path, [entry])
+            entries[result['filename']] = entry
+        return result if directory else None
+
+    async def render(result):
+        base_path = await loop.run_in_executor(pool, render_run, result, numbers[result['filename']], directory,
+                                               formats)
+        print('rendered ' + os.path.basename(base_path))
+
+    stages = [('convert', convert, tshark_workers), ('load', load, analysis_workers),
+              ('metrics', metrics, analysis_workers), ('summarize', summarize, 1)]
+    if directory:
+        stages.append(('render', render, analysis_workers))
+    queue_size = parameters.get("pipeline_queue_size")
+    queues = [asyncio.Queue(maxsize=queue_size or 2 * workers) for name, work, workers in stages]
+
+    async def feed():
+        # conversions first so tshark starts right away; runs that are already converted go through directly
+        jobs = list(pending)
+        # without figures, a run whose summary is current has nothing left to do
+        jobs += [(None, filename) for filename in files_array
+                 if filename not in converting and (directory or not current(filename))]
+        for job in jobs:
+            await queues[0].put(job)
+        for _ in range(stages[0][2]):
+            await queues[0].put(None)
+
+    start = time.perf_counter()
+    try:
+        await asyncio.gather(feed(), *(
+            run_stage(name, queues[i], queues[i + 1] if i + 1 < len(stages) else None, work, workers,
+                      stages[i + 1][2] if i + 1 < len(stages) else 0, busy)
+            for i, (name, work, workers) in enumerate(stages)))
+    finally:
+        compact_manifest(path, manifest)
+        pool.shutdown()
+    wall = time.perf_counter() - start
+    print('pipeline: ' + str(len(files_array)) + ' runs in ' + '{:.1f}'.format(wall) + ' s, busy time per stage: '
+          + ', '.join(name + ' ' + '{:.1f}'.format(seconds) + ' s' for name, seconds in busy.items()))
+    return summary_table(entries, files_array)
+
+
+# loss boxplot of the sweep from the summary table, saved with the per run figures
+def render_summary(summary, directory, formats):
+    import matplotlib.pyplot as plt
+    columns = [column for column in ('loss_steady', 'loss_mbb1', 'loss_reconfiguration', 'loss_mbb2')
+               if column in summary.columns]
+    fig, ax = plt.subplots(figsize=(6, 4))
+    ax.boxplot([summary[column].dropna() for column in columns])
+    ax.set_xticks(range(1, len(columns) + 1), [column[len('loss_'):] for column in columns])
+    ax.set(title='Sweep - Packet loss', ylabel='Packet loss [%]')
+    ax.grid(which='major', color='#a3a3a3', linestyle='--')
+    fig.set_tight_layout(True)
+    for fmt in formats:
+        fig.savefig(os.path.join(directory, figure_name(fig, 0)) + '.' + fmt, format=fmt)
+    plt.close(fig)
+
+
+if __name__ == '__main__':
+    parameters = load_parameters()
+    matplotlib.use(BATCH_BACKEND, force=True)
+    path = parameters["datapath"]
+    summary = asyncio.run(run_pipeline(path, parameters))
+    print(summary[[column for column in summary.columns if column.startswith(('loss_', 'max_gap_'))]].describe().T)
+    if parameters.get("render_dir") and len(summary):
+        render_summary(summary, parameters["render_dir"], parameters.get("render_formats") or DEFAULT_FORMATS)
+    print("------Finished-------")
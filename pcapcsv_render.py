@@ -0,0 +1,112 @@
+'''
+Batch rendering of the analysis figures for headless compute nodes.
+
+By default the scripts open their figures in a Qt5Agg window. With "render_dir": <folder> in parameters.json
+they use the non-interactive Agg backend instead, and at the end every open figure is written to
+<folder>/<NN>_<title>.<format> for each format of "render_formats" (default ["png"], also "pdf", "svg").
+Figures are built from the precomputed series in the main process, pickled and saved by
+"render_workers" worker processes (default: one per cpu). The render time of every figure is printed.
+
+Usage, at the top of a script before importing pyplot and in place of plt.show():
+    from pcapcsv_render import select_backend, show_or_render
+    select_backend()
+    ...
+    show_or_render()
+'''
+
+import os
+import re
+import json
+import time
+import pickle
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import matplotlib
+
+INTERACTIVE_BACKEND = 'Qt5Agg'  # Use $pip install pyqt5
+BATCH_BACKEND = 'Agg'
+DEFAULT_FORMATS = ['png']
+
+
+def load_parameters(parameters_file='parameters.json'):
+    try:
+        with open(parameters_file) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def render_dir(parameters=None):
+    return (parameters if parameters is not None else load_parameters()).get("render_dir")
+
+
+# must run before pyplot is imported. interactive=None keeps the default backend of matplotlib.
+def select_backend(parameters=None, interactive=INTERACTIVE_BACKEND):
+    if render_dir(parameters):
+        matplotlib.use(BATCH_BACKEND, force=True)
+    elif interactive is not None:
+        matplotlib.use(interactive, force=True)
+
+
+# file name of a figure: its number and the title of its first axes, without tex and punctuation
+def figure_name(fig, number):
+    title = fig.axes[0].get_title() if fig.axes else ''
+    title = re.sub(r'\$[^$]*\$', '', title)
+    title = re.sub(r'[^A-Za-z0-9]+', '_', title).strip('_')
+    return '%02d_%s' % (number, title or 'figure')
+
+
+# worker: unpickle one figure and save it in every format, returns the seconds spent per format
+def _render(payload, base_path, formats):
+    fig = pickle.loads(payload)
+    timings = {}
+    for fmt in formats:
+        start = time.perf_counter()
+        fig.savefig(base_path + '.' + fmt, format=fmt)
+        timings[fmt] = time.perf_counter() - start
+    return timings
+
+
+# save the given figures (all open figures by default) to directory, in parallel worker processes
+def render_figures(directory, formats=None, workers=None, figures=None):
+    import matplotlib.pyplot as plt
+    formats = formats or DEFAULT_FORMATS
+    if figures is None:
+        figures = [plt.figure(number) for number in plt.get_fignums()]
+    os.makedirs(directory, exist_ok=True)
+    jobs = []
+    for fig in figures:
+        jobs.append((os.path.join(directory, figure_name(fig, fig.number)), pickle.dumps(fig)))
+    if workers is None:
+        workers = os.cpu_count()
+
+    timings = {}
+    if workers <= 1 or len(jobs) <= 1 or 'fork' not in multiprocessing.get_all_start_methods():
+        for base_path, payload in jobs:
+            timings[base_path] = _render(payload, base_path, formats)
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(jobs)),
+                                 mp_context=multiprocessing.get_context('fork')) as pool:
+            futures = {base_path: pool.submit(_render, payload, base_path, formats) for base_path, payload in jobs}
+            for base_path, future in futures.items():
+                timings[base_path] = future.result()
+    for base_path, fig_timings in timings.items():
+        print('rendered ' + os.path.basename(base_path) + ': '
+              + ', '.join(fmt + ' %.2f s' % seconds for fmt, seconds in fig_timings.items()))
+    return timings
+
+
+# end of a script: show the figures, or write them to files in batch mode
+def show_or_render(parameters=None):
+    import matplotlib.pyplot as plt
+    if parameters is None:
+        parameters = load_parameters()
+    directory = render_dir(parameters)
+    if not directory:
+        plt.show()
+        return None
+    start = time.perf_counter()
+    timings = render_figures(directory, parameters.get("render_formats"), parameters.get("render_workers"))
+    print('rendered ' + str(len(timings)) + ' figures in %.2f s' % (time.perf_counter() - start))
+    plt.close('all')
+    return timings
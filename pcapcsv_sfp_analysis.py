@@ -11,7 +11,8 @@ Save a parameter.json file, with the path of the csvfile.
 
 import pandas as pd
 import matplotlib
-matplotlib.use('Qt5Agg', force=True) #fix for use qt5agg backend for matplotlib. Use $pip install pyqt5
+from pcapcsv_render import select_backend, show_or_render
+select_backend() #qt5agg backend for matplotlib (Use $pip install pyqt5), Agg when "render_dir" is set in parameters.json
 # https://python-graph-gallery.com/custom-fonts-in-matplotlib
 matplotlib.rcParams['font.family'] = 'cmr10' #for labels, titles, and other text
 matplotlib.rcParams['mathtext.fontset'] = 'cm'
@@ -20,6 +21,7 @@ import matplotlib.pyplot as plt
 from matplotlib.ticker import (AutoMinorLocator, MultipleLocator)
 import json
 import os
+from pcapcsv_loader import read_files
 
 
 # the following 2 lines can be replaced by only path=<INSERT_PATH_HERE>".
@@ -43,21 +45,8 @@ PIXEL_H=480
 px = 1/plt.rcParams['figure.dpi'] #get dpi for pixel size setting
 DPI=300
 
-# read files and return the dataframe with the required columns
-def read_files(files_array, path=path):
-    df_array = []
-    for i, filename in enumerate(files_array):
-        # Read csv file and convert to pandas dataframe. Pull only relevant columns
-        try:
-            df_temp = pd.read_csv(path + filename, encoding="ISO-8859-1") #fix for pandas 1.4
-            print('reading: ' + path + filename)
-            df_array.append(df_temp)
-        except:
-            print('error reading: ' + path + filename)
-
-    return df_array
-
-df_array=read_files(files_array)
+# only the first run is plotted, do not load the others
+df_array=read_files(files_array[0:1], path)
 
 
 print('-------plotting-------')
@@ -89,4 +78,4 @@ ax1.yaxis.set_minor_locator(AutoMinorLocator(4))
 ax1.grid(which='major', color='#a3a3a3', linestyle='--')
 ax1.grid(which='minor', color='#CCCCCC', linestyle=':')
 
-plt.show()
\ No newline at end of file
+show_or_render()
\ No newline at end of file
@@ -0,0 +1,216 @@
+'''
+Sweep level column store: the iperf stream of every run of a sweep in one memory-mapped array per column.
+
+<datapath>/.pcapcsv_cache/sweep_store/ holds one raw little endian file per column of STORE_COLUMNS (time, tcp.len,
+packed analysis flags, ACK RTT, source port), the packets of each run sorted by time and stored one run after the
+other, plus index.json: the dtype of every column and, per run, the [start, end) rows, the stream index and the
+size/mtime of its csv. Opening the store maps the files read-only: slicing a run or a window of all runs costs no
+copy, and the OS page cache is shared by every process analyzing the same sweep.
+
+update_store() appends the runs that are missing; when the csv of a stored run changed the store is rebuilt.
+Runs are filled in parallel (pcapcsv_sweep.sweep), every worker writes its rows straight into the mapped files.
+
+Run it directly to update the store of a sweep and print the loss of the steady state and reconfiguration
+windows over all runs: parameters.json "datapath_store" (falls back to "datapath_multi_bw"), optional
+"analysis_workers".
+
+Usage:
+    from pcapcsv_store import update_store
+    store = update_store(path, files_array)
+    run = store.run(files_array[0])  # column name -> view of the run
+    loss = store.window(2, 3)  # packets, retransmissions and loss (%) of every run in [2 s, 3 s)
+'''
+
+import os
+import json
+from functools import partial
+import numpy as np
+import pandas as pd
+
+from pcapcsv_loader import CACHE_DIRNAME, FLAGS_COLUMN, FLAG_BITS, read_csv_cached, source_key, temp_path
+from pcapcsv_metrics import (DEFAULT_CONFIG, CENSUS_ENDPOINT_COLUMNS, stream_census, load_stream_census,
+                             save_stream_census, find_stream_index)
+from pcapcsv_sweep import sweep
+
+STORE_DIRNAME = 'sweep_store'
+INDEX_FILENAME = 'index.json'
+COLUMN_SUFFIX = '.bin'
+STORE_COLUMNS = {
+    'tcp.time_relative': 'float64',
+    'tcp.len': 'uint32',
+    FLAGS_COLUMN: 'uint8',
+    'tcp.analysis.ack_rtt': 'float64',
+    'tcp.srcport': 'uint16',
+}
+RECONFIGURATION_WINDOW = (9, 12)
+
+
+def store_dir(path):
+    return os.path.join(path, CACHE_DIRNAME, STORE_DIRNAME)
+
+
+def column_path(directory, column):
+    return os.path.join(directory, column + COLUMN_SUFFIX)
+
+
+def load_index(directory):
+    try:
+        with open(os.path.join(directory, INDEX_FILENAME)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_index(directory, index):
+    index_path = os.path.join(directory, INDEX_FILENAME)
+    part = temp_path(index_path)
+    with open(part, 'w') as f:
+        json.dump(index, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(part, index_path)
+
+
+# stream index and packets of the iperf stream of one run, from the saved census
+def _run_extent(path, filename):
+    csv_path = os.path.join(path, filename)
+    census = load_stream_census(csv_path)
+    if census is None:
+        census = stream_census(read_csv_cached(csv_path, usecols=['tcp.stream', 'tcp.len', 'tcp.time_relative']
+                                               + CENSUS_ENDPOINT_COLUMNS))
+        save_stream_census(csv_path, census)
+    stream_index = find_stream_index(census)
+    return int(stream_index), int(census.loc[stream_index, 'packets'])
+
+
+# write the packets of the iperf stream of one run to rows [start, end) of the column files
+def _fill_run(path, filename, directory, columns, extents):
+    stream_index, start, end = extents[filename]
+    df = read_csv_cached(os.path.join(path, filename), usecols=list(columns) + ['tcp.stream'])
+    df = df[df['tcp.stream'] == stream_index]
+    if not df['tcp.time_relative'].is_monotonic_increasing:
+        df = df.sort_values('tcp.time_relative', kind='stable')
+    if len(df) != end - start:
+        raise ValueError(filename + ': ' + str(len(df)) + ' packets in stream ' + str(stream_index) + ', the census says '
+                         + str(end - start))
+    for column, dtype in columns.items():
+        if column in df.columns:
+            values = df[column].to_numpy()
+        else:  # not extracted in this csv
+            values = np.nan if np.issubdtype(np.dtype(dtype), np.floating) else 0
+        rows = np.memmap(column_path(directory, column), dtype=dtype, mode='r+',
+                         offset=start * np.dtype(dtype).itemsize, shape=(end - start,))
+        rows[:] = values
+        rows.flush()
+        del rows
+    return filename
+
+
+# add the runs of files_array missing from the store of path and return the store. A run whose csv changed, or
+# a different column set, rebuilds the store.
+def update_store(path, files_array, columns=None, workers=None):
+    columns = dict(columns or STORE_COLUMNS)
+    directory = store_dir(path)
+    os.makedirs(directory, exist_ok=True)
+    index = load_index(directory)
+    keys = {filename: source_key(os.path.join(path, filename)) for filename in files_array}
+    if index is not None and index['columns'] == columns:
+        stored = {run['filename']: run for run in index['runs']}
+        if any(filename in stored and any(stored[filename].get(name) != value for name, value in key.items())
+               for filename, key in keys.items()):
+            index = None
+    else:
+        index = None
+    if index is None:
+        # start over: an interrupted build leaves no index, so it is rebuilt next time
+        if os.path.exists(os.path.join(directory, INDEX_FILENAME)):
+            os.remove(os.path.join(directory, INDEX_FILENAME))
+        for column in columns:
+            if os.path.exists(column_path(directory, column)):
+                os.remove(column_path(directory, column))
+        index = {'columns': columns, 'rows': 0, 'runs': []}
+
+    stored = {run['filename'] for run in index['runs']}
+    pending = [filename for filename in files_array if filename not in stored]
+    if not pending:
+        return SweepStore(path)
+    print('adding ' + str(len(pending)) + ' runs to the sweep store')
+    extents = {}
+    rows = index['rows']
+    for filename, (stream_index, packets) in zip(pending, sweep(pending, path, _run_extent, workers)):
+        extents[filename] = (stream_index, rows, rows + packets)
+        rows += packets
+    for column, dtype in columns.items():
+        with open(column_path(directory, column), 'a+b') as f:
+            f.truncate(rows * np.dtype(dtype).itemsize)
+    list(sweep(pending, path, partial(_fill_run, directory=directory, columns=columns, extents=extents), workers))
+
+    for filename in pending:
+        stream_index, start, end = extents[filename]
+        index['runs'].append(dict(filename=filename, start=start, end=end, stream_index=stream_index,
+                                  **keys[filename]))
+    index['rows'] = rows
+    save_index(directory, index)
+    return SweepStore(path)
+
+
+# read-only view of the store of a sweep
+class SweepStore:
+    def __init__(self, path):
+        self.directory = store_dir(path)
+        index = load_index(self.directory)
+        if index is None:
+            raise FileNotFoundError('no sweep store in ' + self.directory + ', run update_store first')
+        self.columns = index['columns']
+        self.rows = index['rows']
+        self.runs = pd.DataFrame(index['runs'], columns=['filename', 'start', 'end', 'stream_index']
+                                 ).set_index('filename')
+        self._arrays = {}
+
+    def __len__(self):
+        return len(self.runs)
+
+    # the memory-mapped array of a column over every run
+    def column(self, name):
+        if name not in self._arrays:
+            if self.rows == 0:
+                self._arrays[name] = np.empty(0, dtype=self.columns[name])
+            else:
+                self._arrays[name] = np.memmap(column_path(self.directory, name), dtype=self.columns[name],
+                                               mode='r', shape=(self.rows,))
+        return self._arrays[name]
+
+    # column name -> view of the rows of one run
+    def run(self, filename, columns=None):
+        start, end = self.runs.loc[filename, ['start', 'end']]
+        return {name: self.column(name)[start:end] for name in (columns or self.columns)}
+
+    # packets, retransmissions and loss (%) of every run in [start, end) seconds, by binary search on the time
+    # column of each run
+    def window(self, start, end, filenames=None):
+        runs = self.runs if filenames is None else self.runs.loc[filenames]
+        time = self.column('tcp.time_relative')
+        flags = self.column(FLAGS_COLUMN)
+        packets = np.zeros(len(runs), dtype=np.int64)
+        retransmissions = np.zeros(len(runs), dtype=np.int64)
+        for i, (first, last) in enumerate(zip(runs['start'], runs['end'])):
+            low, high = first + np.searchsorted(time[first:last], [start, end], side='left')
+            packets[i] = high - low
+            retransmissions[i] = np.count_nonzero(flags[low:high] & FLAG_BITS['tcp.analysis.retransmission'])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            loss = np.where(packets > 0, 100 * retransmissions / packets, np.nan)
+        return pd.DataFrame({'packets': packets, 'retransmissions': retransmissions, 'loss': loss},
+                            index=runs.index)
+
+
+if __name__ == '__main__':
+    parameters = json.load(open('parameters.json'))
+    path = parameters.get("datapath_store", parameters.get("datapath_multi_bw"))
+    files_array = sorted(file for file in os.listdir(path) if file.endswith(".csv"))
+    store = update_store(path, files_array, workers=parameters.get("analysis_workers"))
+    steady = DEFAULT_CONFIG['steady_index']
+    print('sweep store: ' + str(len(store)) + ' runs, ' + str(store.rows) + ' packets')
+    print('loss steady state t=' + str(steady) + 's')
+    print(store.window(steady, steady + 1, files_array)['loss'].describe())
+    print('loss reconfiguration ' + str(RECONFIGURATION_WINDOW))
+    print(store.window(*RECONFIGURATION_WINDOW, filenames=files_array)['loss'].describe())
@@ -0,0 +1,128 @@
+'''
+Streaming analysis: tshark -> pipe -> per second bins, without writing the intermediate csv.
+
+tshark field output is read from its stdout in chunks of CHUNKSIZE rows. Every chunk is folded into the
+per second counters and the per stream statistics used by pcapcsv_analysis_stateless.py, then dropped.
+Disk I/O is only the pcap read by tshark and peak memory is bounded by the chunk size.
+
+TO BE EXECUTED in the computer/server where the pcap files are stored (tshark must be in the PATH).
+parameters.json: "datapath_stream" (falls back to "datapath"), optional "stream_chunksize".
+'''
+
+import subprocess
+import numpy as np
+import pandas as pd
+import json
+import os
+
+from pcap_to_csv import tshark_args
+from pcapcsv_loader import CSV_ENCODING, FLAGS_COLUMN, apply_schema, flag_mask
+from pcapcsv_bins import BinAccumulator
+from pcapcsv_metrics import stream_census, merge_census, find_stream_index, per_second_table
+
+CHUNKSIZE = 1000000
+# only the fields needed for binning and stream statistics, fewer fields also make tshark faster
+STREAM_FIELDS = ['tcp.stream', 'tcp.time_relative', 'tcp.len', 'tcp.analysis.retransmission']
+STEADY_INDEX = 2
+RECONFIGURATION = 10
+
+
+# run tshark on a pcap and yield its field output as dataframes of at most chunksize rows, converted with the
+# schema of pcapcsv_loader (typed columns, packed analysis flags, rows of other protocols dropped)
+def tshark_chunks(pcap_path, fields=STREAM_FIELDS, chunksize=CHUNKSIZE):
+    args = tshark_args(pcap_path, fields)
+    proc = subprocess.Popen(args, stdout=subprocess.PIPE)
+    try:
+        for chunk in pd.read_csv(proc.stdout, chunksize=chunksize, encoding=CSV_ENCODING):
+            yield apply_schema(chunk)
+        proc.stdout.close()
+        if proc.wait() != 0:
+            raise subprocess.CalledProcessError(proc.returncode, args)
+    finally:
+        # consumer stopped early or parsing failed, do not leave tshark running
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+
+
+# per stream 1 s bin counters (pcapcsv_bins.BinAccumulator) and stream census (pcapcsv_metrics), updated one chunk
+# at a time with the same code as the csv analysis
+class StreamBinner:
+    def __init__(self):
+        self.census = None
+        self.seconds = {}  # tcp.stream -> BinAccumulator
+
+    def update(self, chunk):
+        if len(chunk) == 0:
+            return
+        self.census = merge_census(self.census, stream_census(chunk))
+        # one stable sort by stream, every stream is then a block of rows in time order
+        stream = chunk['tcp.stream'].to_numpy().astype(np.int64)
+        order = np.argsort(stream, kind='stable')
+        stream = stream[order]
+        time = chunk['tcp.time_relative'].to_numpy()[order]
+        length = chunk['tcp.len'].to_numpy()[order]
+        retransmission = flag_mask(chunk[FLAGS_COLUMN].to_numpy()[order], 'tcp.analysis.retransmission')
+        streams, starts = np.unique(stream, return_index=True)
+        for stream_index, first, last in zip(streams.tolist(), starts, np.append(starts[1:], len(stream))):
+            if stream_index not in self.seconds:
+                self.seconds[stream_index] = BinAccumulator(1)
+            self.seconds[stream_index].add(time[first:last], length=length[first:last],
+                                           retransmission=retransmission[first:last])
+
+    # per second counters of the dominant stream, as in pcapcsv_metrics.analyze_frame
+    def result(self):
+        if self.census is None:
+            return None
+        stream_index = find_stream_index(self.census)
+        metrics = per_second_table(self.seconds[stream_index])
+        return {
+            'stream_index': stream_index,
+            'stream_census': self.census,
+            'bins': pd.concat({stream: seconds.table() for stream, seconds in self.seconds.items()},
+                              names=['tcp.stream']),
+            'metrics': metrics,
+            'pkt_sent': metrics['pkt_sent'],
+            'pkt_retransmit': metrics['pkt_retransmit'],
+            'pkt_loss_ratio': metrics['pkt_loss_ratio'],
+        }
+
+
+def analyze_pcap_stream(pcap_path, chunksize=CHUNKSIZE):
+    binner = StreamBinner()
+    for chunk in tshark_chunks(pcap_path, chunksize=chunksize):
+        binner.update(chunk)
+    return binner.result()
+
+
+if __name__ == '__main__':
+    from pcapcsv_render import select_backend, show_or_render
+    select_backend(interactive=None)
+    import matplotlib.pyplot as plt
+
+    parameters = json.load(open('parameters.json'))
+    path = parameters.get("datapath_stream", parameters["datapath"])
+    chunksize = parameters.get("stream_chunksize", CHUNKSIZE)
+
+    files_array = sorted(file for file in os.listdir(path) if file.endswith(".pcap") and 'udp' not in file)
+    pkt_loss_ratio_array_series = []
+    for file in files_array:
+        print('streaming: ' + path + file)
+        result = analyze_pcap_stream(os.path.join(path, file), chunksize)
+        if result is None:
+            print('no tcp packets in: ' + file)
+            continue
+        pkt_loss_ratio_array_series.append((file, result['pkt_loss_ratio']))
+        loss = result['pkt_loss_ratio']
+        print('stream: ' + str(result['stream_index'])
+              + ' steady loss: ' + str(loss.get(STEADY_INDEX))
+              + ' max loss t=' + str(RECONFIGURATION) + 's: '
+              + str(loss.reindex(range(RECONFIGURATION - 1, RECONFIGURATION + 2)).max()))
+
+    fig1, ax1 = plt.subplots()
+    for file, pkt_loss_ratio in pkt_loss_ratio_array_series:
+        ax1.plot(pkt_loss_ratio, label=file)
+    ax1.set(title="Packet loss ratio", xlabel="Time [s]", ylabel="Packet loss %")
+    ax1.grid(which='major', color='#a3a3a3', linestyle='--')
+    ax1.legend(loc='upper right')
+    show_or_render()
@@ -0,0 +1,194 @@
+'''
+Persistent per-run summary store for the boxplots of the analysis scripts.
+
+Every analyzed run leaves one line in <datapath>/.pcapcsv_cache/<kind>.summary.jsonl with its summary values:
+steady state loss, max loss and max gap per event window, stream statistics and mean throughput
+(see run_summary). An entry records the size/mtime of its csv and a fingerprint of the settings it depends on;
+runs whose entry is missing or stale are analyzed again, all others are read back from the store. Adding five
+captures to a 500 run sweep analyzes those five only.
+
+The store is a json lines journal like the pcap_to_csv manifest: appends survive an interrupted run and the last
+entry of a file wins. It is compacted when it holds many superseded lines.
+
+Run it directly to update the store of a sweep and print the summary statistics without plotting time series:
+parameters.json "datapath_summary" (falls back to "datapath_multi_bw"), optional "analysis_workers" and
+"analysis_chunk_rows" (analyze every capture in chunks of that many rows, for captures larger than memory).
+'''
+
+import os
+import json
+import hashlib
+import numpy as np
+import pandas as pd
+
+from pcapcsv_loader import CACHE_DIRNAME, source_key, temp_path
+from pcapcsv_metrics import (analyze_files, DEFAULT_CONFIG, LOSS_WINDOWS, LINK_WINDOWS_MBB, LINK_WINDOWS,
+                             LINK_STEADY_MIN)
+
+SUMMARY_SUFFIX = '.summary.jsonl'
+TCP_SUMMARY = 'tcp'
+# rewrite the journal when it has more than this many lines per entry
+COMPACT_RATIO = 2
+
+
+def summary_path(path, kind=TCP_SUMMARY):
+    return os.path.join(path, CACHE_DIRNAME, kind + SUMMARY_SUFFIX)
+
+
+# fingerprint of everything a summary depends on besides the csv itself; entries with another one are stale
+def config_fingerprint(settings):
+    text = json.dumps(settings, sort_keys=True, default=str)
+    return hashlib.sha1(text.encode()).hexdigest()[:16]
+
+
+def tcp_fingerprint(config=None):
+    config = dict(DEFAULT_CONFIG, **(config or {}))
+    return config_fingerprint({'steady_index': config['steady_index'], 'loss_windows': LOSS_WINDOWS,
+                               'link_windows_mbb': LINK_WINDOWS_MBB, 'link_windows': LINK_WINDOWS,
+                               'link_steady_min': LINK_STEADY_MIN})
+
+
+# json has no numpy types and no NaN
+def _plain(value):
+    if isinstance(value, np.ndarray):
+        return [_plain(item) for item in value.tolist()]
+    if isinstance(value, (list, tuple)):
+        return [_plain(item) for item in value]
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and np.isnan(value):
+        return None
+    return value
+
+
+# filename -> latest entry
+def load_summary(path, kind=TCP_SUMMARY):
+    entries = {}
+    lines = 0
+    try:
+        with open(summary_path(path, kind)) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # partially written line from an interrupted run
+                entries[entry['filename']] = entry
+                lines += 1
+    except FileNotFoundError:
+        pass
+    if lines > COMPACT_RATIO * max(1, len(entries)):
+        compact_summary(path, entries, kind)
+    return entries
+
+
+def append_summary(path, entries, kind=TCP_SUMMARY):
+    if not entries:
+        return
+    store = summary_path(path, kind)
+    os.makedirs(os.path.dirname(store), exist_ok=True)
+    with open(store, 'a') as f:
+        for entry in entries:
+            f.write(json.dumps({key: _plain(value) for key, value in entry.items()}) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+
+
+# rewrite the journal with one line per file, through a temp file so a crash never leaves it half written
+def compact_summary(path, entries, kind=TCP_SUMMARY):
+    store = summary_path(path, kind)
+    part = temp_path(store)
+    with open(part, 'w') as f:
+        for filename in sorted(entries):
+            f.write(json.dumps(entries[filename]) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(part, store)
+
+
+# True if the entry was computed from the current version of csv_path with the same settings
+def is_current(entry, csv_path, fingerprint):
+    if entry is None or entry.get('fingerprint') != fingerprint:
+        return False
+    try:
+        key = source_key(csv_path)
+    except OSError:
+        return False
+    return all(entry.get(name) == value for name, value in key.items())
+
+
+# store entry: the summary values plus the source key of the csv and the settings fingerprint
+def make_entry(csv_path, fingerprint, values):
+    return dict(values, fingerprint=fingerprint, **source_key(csv_path))
+
+
+# summary values of one analyzed run (a pcapcsv_metrics.analyze_frame result)
+def run_summary(result):
+    census = result['stream_census']
+    stream = census.loc[result['stream_index']]
+    duration = stream['last_time'] - stream['first_time']
+    summary = {
+        'filename': result['filename'],
+        'stream_index': result['stream_index'],
+        'streams': len(census),
+        'packets': int(stream['packets']),
+        'bytes': int(stream['bytes']),
+        'duration': duration,
+        'mean_throughput': 8 * int(stream['bytes']) / duration if duration > 0 else None,
+        'retransmissions': result['pkt_retransmit'].sum(),
+    }
+    for name, value in result['loss_windows'].items():
+        summary['loss_' + name] = value
+    for name, window in result['event_windows'].items():
+        summary['max_gap_' + name] = window['max_gap']
+        summary['gap_count_' + name] = window['gap_count']
+    summary['gaps_steady'] = result['link_windows']['steady']
+    return summary
+
+
+# one row per file of files_array found in the store, in the order of files_array
+def summary_table(entries, files_array):
+    rows = [entries[filename] for filename in files_array if filename in entries]
+    if not rows:
+        return pd.DataFrame(index=pd.Index([], name='filename'))
+    return pd.DataFrame(rows).set_index('filename')
+
+
+# record summaries of runs that were already analyzed (results of pcapcsv_metrics.analyze_files).
+# Runs with a current entry are skipped, so the journal does not grow when the same sweep is plotted again.
+def update_summary(path, results, config=None):
+    fingerprint = tcp_fingerprint(config)
+    entries = load_summary(path)
+    new_entries = []
+    for result in results:
+        csv_path = os.path.join(path, result['filename'])
+        if is_current(entries.get(result['filename']), csv_path, fingerprint):
+            continue
+        entry = make_entry(csv_path, fingerprint, run_summary(result))
+        new_entries.append(entry)
+        entries[result['filename']] = entry
+    append_summary(path, new_entries)
+    return entries
+
+
+# summary table of files_array, analyzing only the runs without a current entry (no plot series are built)
+def summarize_files(files_array, path, config=None, workers=None):
+    fingerprint = tcp_fingerprint(config)
+    entries = load_summary(path)
+    pending = [filename for filename in files_array
+               if not is_current(entries.get(filename), os.path.join(path, filename), fingerprint)]
+    if pending:
+        print('summarizing ' + str(len(pending)) + ' of ' + str(len(files_array)) + ' runs')
+        results = analyze_files(pending, path, dict(config or {}, plot_series=False), workers)
+        entries = update_summary(path, results, config)
+    return summary_table(entries, files_array)
+
+
+if __name__ == '__main__':
+    parameters = json.load(open('parameters.json'))
+    path = parameters.get("datapath_summary", parameters.get("datapath_multi_bw"))
+    files_array = sorted(file for file in os.listdir(path) if file.endswith(".csv"))
+    summary = summarize_files(files_array, path, {'chunk_rows': parameters.get("analysis_chunk_rows")},
+                              workers=parameters.get("analysis_workers"))
+    columns = [column for column in summary.columns
+               if column.startswith(('loss_', 'max_gap_')) or column in ('mean_throughput', 'duration')]
+    print(summary[columns].describe().T)
@@ -0,0 +1,70 @@
+'''
+Constant memory driver for multi-file sweeps.
+
+sweep() runs a task on every run of a sweep, one file at a time or in a pool of worker processes, and yields the
+task results in the order of files_array. A task loads one csv, reduces it to small per run artifacts (bin
+counters, event window values, decimated series) and returns those; the packet table is freed as soon as the
+task returns, so memory does not grow with the number of runs. With workers, at most `in_flight` runs (default:
+two per worker) are submitted at a time, which also bounds the finished results waiting for an earlier run.
+
+reduce_file() is the usual task: read a csv through the loader cache and apply reduce(df, filename) to it.
+peak_memory() reports the peak resident memory of the process and of its workers, to check that a sweep stays flat.
+
+Usage:
+    from functools import partial
+    from pcapcsv_sweep import sweep, reduce_file, peak_memory
+    results = list(sweep(files_array, path, partial(reduce_file, reduce=reduce_run, usecols=desired_df_columns),
+                         workers=parameters.get("analysis_workers")))
+    print(peak_memory())
+'''
+
+import os
+import sys
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from pcapcsv_loader import read_csv_cached
+
+try:
+    import resource
+except ImportError:  # not available on windows
+    resource = None
+
+
+# read one csv and return reduce(df, filename), the packets are dropped when this returns
+def reduce_file(path, filename, reduce, usecols=None):
+    df = read_csv_cached(os.path.join(path, filename), usecols=usecols)
+    print('reading: ' + path + filename)
+    return reduce(df, filename)
+
+
+# yield task(path, filename) for every file of files_array, in order. workers=None uses one per cpu, 1 runs the
+# tasks in this process. Worker processes need the fork start method (the scripts run at import time).
+def sweep(files_array, path, task, workers=None, in_flight=None):
+    if workers is None:
+        workers = os.cpu_count()
+    if workers <= 1 or len(files_array) <= 1 or 'fork' not in multiprocessing.get_all_start_methods():
+        for filename in files_array:
+            yield task(path, filename)
+        return
+    workers = min(workers, len(files_array))
+    in_flight = max(workers, in_flight if in_flight is not None else 2 * workers)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork')) as pool:
+        pending = deque()
+        for filename in files_array:
+            pending.append(pool.submit(task, path, filename))
+            if len(pending) >= in_flight:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+# peak resident memory in MB of this process and of its finished worker processes
+def peak_memory():
+    if resource is None:
+        return {}
+    # ru_maxrss is in KB on linux, in bytes on macos
+    scale = 2 ** 20 if sys.platform == 'darwin' else 2 ** 10
+    return {'process_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale,
+            'workers_mb': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale}
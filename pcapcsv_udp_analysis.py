@@ -11,8 +11,10 @@ Save a parameter.json file, with the path of the csvfile.
 '''
 
 import pandas as pd
+import numpy as np
 import matplotlib
-matplotlib.use('Qt5Agg', force=True) #fix for use qt5agg backend for matplotlib. Use $pip install pyqt5
+from pcapcsv_render import select_backend, show_or_render
+select_backend() #qt5agg backend for matplotlib (Use $pip install pyqt5), Agg when "render_dir" is set in parameters.json
 # https://python-graph-gallery.com/custom-fonts-in-matplotlib
 matplotlib.rcParams['font.family'] = 'cmr10' #for labels, titles, and other text
 matplotlib.rcParams['mathtext.fontset'] = 'cm'
@@ -21,19 +23,19 @@ import matplotlib.pyplot as plt
 from matplotlib.ticker import (AutoMinorLocator, MultipleLocator)
 import json
 import os
+from pcapcsv_experiments import ExperimentSet
+from pcapcsv_metrics import window_slice
+from pcapcsv_decimate import decimate, pixel_columns
+from pcapcsv_summary import load_summary, append_summary, is_current, make_entry, config_fingerprint
 
 
 # the following 2 lines can be replaced by only path=<INSERT_PATH_HERE>".
 parameters = json.load(open('parameters.json'))
 path = parameters["datapath_udp"]
 
-files_array=[]
-#for analyzing csv files in path
-for file in os.listdir(path):
-    # analyze only pcap files
-    if (file.endswith(".csv")):# and ('v1' in file):
-        files_array.append(file)
-files_array.sort()
+# csv files in path, indexed by name. Runs are loaded only when plotted.
+experiments = ExperimentSet(path, mem_cap_mb=parameters.get("experiment_mem_cap_mb"))
+files_array = experiments.filenames
 #files_array=files_array[0:10]
 
 
@@ -60,22 +62,20 @@ PIXEL_W=640 #for plot size
 PIXEL_H=480
 px = 1/plt.rcParams['figure.dpi'] #get dpi for pixel size setting
 DPI = 300
+desired_df_columns = ['udp.time_relative', 'udp.time_delta']
+UDP_SUMMARY = 'udp'
+UDP_WINDOW = (9, 12) # link unavailability summary window, seconds
+DELTA_T_XLIM = [8.9, 11.1]
 
-# read files and return the dataframe with the required columns
-def read_files(files_array, path=path):
-    df_array = []
-    for i, filename in enumerate(files_array):
-        # Read csv file and convert to pandas dataframe. Pull only relevant columns
-        try:
-            df_temp = pd.read_csv(path + filename, encoding="ISO-8859-1") #fix for pandas 1.4
-            print('reading: ' + path + filename)
-            df_array.append(df_temp)
-        except:
-            print('error reading: ' + path + filename)
 
-    return df_array
-
-df_array=read_files(files_array)
+# rows of the packets with start <= udp.time_relative <= end. udp.time_relative is relative to each conversation
+# and the csv has no udp.stream to split them: with one conversation the column is sorted and the window is found
+# by binary search, otherwise the rows are selected with a mask and stay in file order.
+def window_rows(time, start, end):
+    if time.is_monotonic_increasing:
+        first, last = window_slice(time.to_numpy(), start, end, closed='both')
+        return np.arange(first, last)
+    return np.flatnonzero(((time >= start) & (time <= end)).to_numpy())
 
 
 print('-------plotting-------')
@@ -84,15 +84,28 @@ print('-------plotting-------')
 # -----------------------------------
 #fig1,ax1 = plt.subplots(figsize=(PIXEL_W*px, PIXEL_H*px))
 fig1,ax1 = plt.subplots(figsize=(6,5),dpi=DPI)
-for i, df in enumerate(df_array):
+for i, file in enumerate(files_array):
     if i not in remove_from_plot:
+        df = experiments.load(file, desired_df_columns)
+        # only the packets inside xlim are drawn, reduced to the min/max of every pixel column
+        rows = window_rows(df['udp.time_relative'], DELTA_T_XLIM[0], DELTA_T_XLIM[1])
+        time = df['udp.time_relative'].to_numpy()[rows]
+        delta = df['udp.time_delta'].diff().to_numpy()[rows]
+        if not df['udp.time_relative'].is_monotonic_increasing:
+            # decimate needs x sorted, the deltas stay the ones of consecutive rows of the file
+            order = np.argsort(time, kind='stable')
+            time, delta = time[order], delta[order]
+        x, y, markevery = decimate(time,
+                                   delta * ms_scale_factor,
+                                   MARKER_EVERY_S*int(len(df)/TEST_DURATION),
+                                   max_points=4 * pixel_columns(6, DPI))
         ax1.plot(
-            df[(df['udp.time_relative'].notna())]['udp.time_relative'],
-            df[(df['udp.time_relative'].notna())]['udp.time_delta'].diff() * ms_scale_factor,
+            x,
+            y,
             label=('$\|$'.join(files_array[i].split(SPLIT_FILENAME_CHAR)[0:LABEL_RIGHT_LIMIT]) + '$\|$'+ str(i+1)),
             # https://www.geeksforgeeks.org/how-to-add-markers-to-a-graph-plot-in-matplotlib-with-python/
             marker=markers[i%len(markers)],
-            markevery=MARKER_EVERY_S*int(len(df[(df['udp.time_relative'].notna())])/TEST_DURATION),
+            markevery=markevery,
             markersize=MARKER_SIZE
         )
 ax1.set(title=(filename + " - Packet $\Delta$t"),
@@ -100,7 +113,7 @@ ax1.set(title=(filename + " - Packet $\Delta$t"),
         ylabel="$\Delta$ t [ms]",
         ylim=[2.2,30],
         #xlim=[1.1,TEST_DURATION],
-        xlim=[8.9,11.1],
+        xlim=DELTA_T_XLIM,
         )
 fig1.set_tight_layout(True)
 # Change major ticks
@@ -131,18 +144,27 @@ ax1.grid(which='minor', color='#CCCCCC', linestyle=':')
 df_link_unavailable=[]
 #fig1,ax1 = plt.subplots(figsize=(PIXEL_W*px, PIXEL_H*px))
 fig1,ax1 = plt.subplots(figsize=(5,4),dpi=DPI)
-for i, df in enumerate(df_array):
-    #df = df[df['udp.time_relative'].notna()]  # very important line. Otherwise an exception can be raised.
-
-    try:
-        df_link_unavailable.append(
-            max(
-            df[(df['udp.time_relative'] >=9) & (df['udp.time_relative'] <= 12) & (df['udp.time_relative'].notna())]
-            ['udp.time_delta'].diff().fillna(0).values*ms_scale_factor
-            )
-        )
-    except:
+# max gap of every run is kept in <path>/.pcapcsv_cache/udp.summary.jsonl, only new or changed runs are loaded
+summary = load_summary(path, UDP_SUMMARY)
+fingerprint = config_fingerprint({'window': UDP_WINDOW})
+new_entries = []
+for i, file in enumerate(files_array):
+    entry = summary.get(file)
+    if not is_current(entry, os.path.join(path, file), fingerprint):
+        df = experiments.load(file, desired_df_columns)
+        #df = df[df['udp.time_relative'].notna()]  # very important line. Otherwise an exception can be raised.
+        # packets with 9 <= udp.time_relative <= 12, in file order
+        rows = window_rows(df['udp.time_relative'], UDP_WINDOW[0], UDP_WINDOW[1])
+        max_gap = None
+        if len(rows):
+            max_gap = np.nan_to_num(np.diff(df['udp.time_delta'].to_numpy()[rows])).max(initial=0)*ms_scale_factor
+        entry = make_entry(os.path.join(path, file), fingerprint, {'filename': file, 'max_gap': max_gap})
+        new_entries.append(entry)
+    if entry['max_gap'] is None:
         print ("df link unavailable error")
+    else:
+        df_link_unavailable.append(entry['max_gap'])
+append_summary(path, new_entries, UDP_SUMMARY)
 
 
 # t=steady,t=10
@@ -169,4 +191,4 @@ ax1.yaxis.set_minor_locator(AutoMinorLocator(5))
 ax1.grid(which='major', color='#a3a3a3', linestyle='--')
 ax1.grid(which='minor', color='#CCCCCC', linestyle=':')
 
-plt.show()
\ No newline at end of file
+show_or_render()
\ No newline at end of file